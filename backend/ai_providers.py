@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+GITHUB_MODELS_URL = "https://models.github.ai/inference/chat/completions"
+
+
+class AIProviderError(Exception):
+    """AI后端请求失败"""
+    pass
+
+
+class AIProvider:
+    """一个OpenAI兼容的对话补全后端"""
+
+    def __init__(self, name, api_url, model, api_key=None, tier='standard',
+                 headers=None, timeout=30):
+        self.name = name
+        self.api_url = api_url
+        self.model = model
+        self.api_key = api_key
+        self.tier = tier  # 'fast' 用于简短问题的低成本快速模型
+        self.extra_headers = headers or {}
+        self.timeout = timeout
+
+    def complete(self, messages, max_tokens=800, temperature=0.7):
+        """发送一次对话补全请求，返回回复文本"""
+        import requests  # 按需导入，不拖慢进程启动
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        headers.update(self.extra_headers)
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+        try:
+            response = requests.post(
+                self.api_url,
+                headers=headers,
+                data=json.dumps(payload),
+                timeout=self.timeout
+            )
+        except requests.exceptions.Timeout:
+            raise AIProviderError(f"[{self.name}] 请求超时")
+        except requests.exceptions.RequestException as e:
+            raise AIProviderError(f"[{self.name}] 网络请求错误: {e}")
+
+        if response.status_code != 200:
+            raise AIProviderError(f"[{self.name}] 请求失败: {response.status_code} - {response.text[:200]}")
+        result = response.json()
+        if 'choices' in result and len(result['choices']) > 0:
+            return result['choices'][0]['message']['content']
+        raise AIProviderError(f"[{self.name}] 响应格式异常: {result}")
+
+
+class ProviderStats:
+    """后端的滑动平均延迟和错误率"""
+
+    unknown_latency = 60.0
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.routed = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        with self._lock:
+            self.requests += 1
+            if not ok:
+                self.errors += 1
+            self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+            if ok:
+                self.latency = latency if self.latency is None else \
+                    self.latency + self.alpha * (latency - self.latency)
+
+    def score(self):
+        """越小越好；从未请求过的后端优先尝试一次，从未成功过的排在最后"""
+        if self.latency is None:
+            return 0.0 if self.requests == 0 else self.unknown_latency * (1 + 4 * self.error_rate)
+        return self.latency * (1 + 4 * self.error_rate)
+
+    def to_dict(self):
+        return {
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "requests": self.requests,
+            "errors": self.errors,
+            "routed": self.routed
+        }
+
+
+class ProviderRouter:
+    """按延迟和错误率选择后端，慢请求在延迟后对冲到第二个后端"""
+
+    def __init__(self, providers, hedge_delay=None, overall_timeout=35):
+        self.providers = providers
+        self.stats = {p.name: ProviderStats() for p in providers}
+        if hedge_delay is None:
+            hedge_delay = float(os.getenv('AI_HEDGE_DELAY', '8'))
+        self.hedge_delay = hedge_delay
+        self.overall_timeout = overall_timeout
+        self.metrics = {"hedged": 0, "hedge_wins": 0, "fast_routed": 0, "failed": 0}
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        # 线程池不能跨fork使用，子进程中重新创建
+        if self._executor is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(
+                max_workers=max(4, len(self.providers) * 4), thread_name_prefix="ai-provider"
+            )
+        return self._executor
+
+    def candidates(self, simple):
+        """按得分排序的候选后端；简单问题优先使用fast层级"""
+        def rank(provider):
+            preferred = (provider.tier == 'fast') == simple
+            return (0 if preferred else 1, self.stats[provider.name].score())
+        return sorted(self.providers, key=rank)
+
+    def _call(self, provider, messages):
+        start = time.monotonic()
+        try:
+            content = provider.complete(messages)
+        except Exception:
+            self.stats[provider.name].record(time.monotonic() - start, False)
+            raise
+        self.stats[provider.name].record(time.monotonic() - start, True)
+        return content
+
+    def complete(self, messages, simple=False):
+        """返回 (回复文本, 后端名称)；所有后端都失败时抛出AIProviderError"""
+        remaining = self.candidates(simple)
+        if not remaining:
+            raise AIProviderError("没有可用的AI后端")
+        if simple and remaining[0].tier == 'fast':
+            self.metrics["fast_routed"] += 1
+
+        executor = self._get_executor()
+        pending = {}
+        errors = []
+        hedged = False
+        primary = remaining[0].name
+
+        def launch():
+            provider = remaining.pop(0)
+            self.stats[provider.name].routed += 1
+            pending[executor.submit(self._call, provider, messages)] = provider
+
+        launch()
+        deadline = time.monotonic() + self.overall_timeout
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            can_hedge = remaining and not hedged and len(pending) == 1
+            timeout = min(self.hedge_delay, deadline - now) if can_hedge else deadline - now
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if can_hedge:
+                    hedged = True
+                    self.metrics["hedged"] += 1
+                    launch()
+                continue
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    content = future.result()
+                except Exception as e:
+                    errors.append(str(e))
+                    # 失败后立即切换到下一个后端
+                    if remaining and not pending:
+                        launch()
+                    continue
+                if hedged and provider.name != primary:
+                    self.metrics["hedge_wins"] += 1
+                return content, provider.name
+
+        self.metrics["failed"] += 1
+        raise AIProviderError("; ".join(errors) or "AI后端请求超时")
+
+    def get_metrics(self):
+        return dict(
+            self.metrics,
+            providers={name: stats.to_dict() for name, stats in self.stats.items()}
+        )
+
+
+def load_providers():
+    """从环境变量读取AI后端配置
+
+    AI_PROVIDERS 为JSON列表，每项包含 name/api_url/model，可选 api_key_env/tier/timeout；
+    未配置时使用GitHub Models（GPT-4o，另以GPT-4o-mini作为fast层级），
+    AI_LOCAL_URL 可追加一个本地OpenAI兼容服务。
+    """
+    providers = []
+    config = os.getenv('AI_PROVIDERS')
+    if config:
+        for item in json.loads(config):
+            providers.append(AIProvider(
+                name=item["name"],
+                api_url=item["api_url"],
+                model=item["model"],
+                api_key=os.getenv(item["api_key_env"]) if item.get("api_key_env") else None,
+                tier=item.get("tier", "standard"),
+                headers=item.get("headers"),
+                timeout=item.get("timeout", 30)
+            ))
+        return providers
+
+    github_pat = os.getenv('GITHUB_PAT')
+    if github_pat:
+        github_headers = {
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28"
+        }
+        providers.append(AIProvider(
+            "github-gpt-4o", GITHUB_MODELS_URL, os.getenv('AI_MODEL', 'openai/gpt-4o'),
+            github_pat, 'standard', github_headers
+        ))
+        providers.append(AIProvider(
+            "github-gpt-4o-mini", GITHUB_MODELS_URL, os.getenv('AI_FAST_MODEL', 'openai/gpt-4o-mini'),
+            github_pat, 'fast', github_headers
+        ))
+
+    local_url = os.getenv('AI_LOCAL_URL')
+    if local_url:
+        providers.append(AIProvider(
+            "local", local_url, os.getenv('AI_LOCAL_MODEL', 'local'),
+            os.getenv('AI_LOCAL_API_KEY'), os.getenv('AI_LOCAL_TIER', 'standard')
+        ))
+    return providers
@@ -1,24 +1,41 @@
-from flask import Flask, request, jsonify, g
+from flask import Flask, Blueprint, Response, request, jsonify, g
 from flask_cors import CORS
 import os
 import json
 import time
+import uuid
+import threading
+from lazy_init import LazyProxy, load_environment
+from responses import init_responses, json_list_response
+from profiling import init_profiling, sampling_profiler
+# 以下全局实例均为延迟代理：导入时不连接数据库、不读取配置，第一次使用时才创建
 from database import db
 from github_ai_service import github_ai_service
+from job_queue import job_queue
+from chat_retention import chat_retention
+from live_sessions import live_sessions
+from goal_recommender import goal_recommender
 
-app = Flask(__name__)
-CORS(app)
+api = Blueprint('api', __name__)
 
-# 配置
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
-app.config['JSON_AS_ASCII'] = False  # 支持中文
+# 同时处理的普通请求不超过 GUNICORN_THREADS 个，线程池中其余的线程留给推送连接（见 gunicorn.conf.py）
+request_slots = LazyProxy(
+    lambda: threading.BoundedSemaphore(int(os.getenv('GUNICORN_THREADS', '4'))), 'request_slots'
+)
 
-@app.before_request
+@api.before_app_request
 def before_request():
     """记录请求日志"""
     g.start_time = time.time()
+    if request.endpoint != 'api.stream_live_sessions':
+        request_slots.acquire()
+        g.request_slot = True
+    # 后台任务队列、归档、推荐任务在每个进程中只启动一次；任务队列启动后会重放日志中未完成的任务
+    job_queue.start()
+    chat_retention.start()
+    goal_recommender.start()
 
-@app.after_request
+@api.after_app_request
 def after_request(response):
     """记录响应日志"""
     if hasattr(g, 'start_time'):
@@ -26,16 +43,29 @@ def after_request(response):
         print(f"[{time.strftime('%H:%M:%S')}] {request.method} {request.path} - {response.status_code} - {duration:.2f}s")
     return response
 
+@api.teardown_app_request
+def release_request_slot(error=None):
+    """归还普通请求占用的名额"""
+    if g.pop('request_slot', False):
+        request_slots.release()
+
 # ========== 健康检查 ==========
-@app.route('/api/health', methods=['GET'])
+@api.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({
         "status": "healthy", 
         "service": "AI学习搭子 Flask版",
-        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "ai_metrics": github_ai_service.get_metrics(),
+        "job_queue": job_queue.get_metrics(),
+        "database": db.get_metrics(),
+        "chat_retention": chat_retention.metrics,
+        "live_sessions": live_sessions.get_metrics(),
+        "goal_recommender": goal_recommender.metrics,
+        "sampling_profiler": sampling_profiler.metrics
     })
 
-@app.route('/')
+@api.route('/')
 def home():
     return jsonify({
         "message": "AI学习搭子 Flask版服务运行正常",
@@ -44,7 +74,7 @@ def home():
     })
 
 # ========== 用户认证 ==========
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def login():
     data = request.get_json()
     username = data.get('username', '').strip()
@@ -66,7 +96,7 @@ def login():
     else:
         return jsonify({"success": False, "error": "用户名或密码错误"}), 401
 
-@app.route('/api/register', methods=['POST'])
+@api.route('/api/register', methods=['POST'])
 def register():
     data = request.get_json()
     username = data.get('username', '').strip()
@@ -85,8 +115,49 @@ def register():
     else:
         return jsonify({"success": False, "error": "用户名已存在"}), 400
 
+# ========== 后台任务 ==========
+def persist_chat_message(payload):
+    """保存聊天记录（后台任务），随后建立向量索引"""
+    chat_id = db.add_chat_message(
+        payload["user_id"], payload["user_message"], payload["ai_response"], payload.get("client_id")
+    )
+    if chat_id:
+        job_queue.enqueue('chat.index', dict(payload, chat_id=chat_id))
+
+def index_chat_message(payload):
+    """为聊天记录建立向量索引（后台任务）"""
+    from semantic_memory import semantic_memory
+    semantic_memory.index_message(
+        payload["user_id"], payload["chat_id"], payload["user_message"], payload["ai_response"]
+    )
+
+def backfill_chat_index(payload):
+    """为用户已有的聊天记录建立向量索引（后台任务）"""
+    from semantic_memory import semantic_memory
+    semantic_memory.backfill(payload["user_id"])
+
+def recent_chat_history(user_id, limit=10):
+    """最近的聊天记录，包括已经提交、后台任务还没写入数据库的对话"""
+    # 先读任务日志再读数据库：两次读取之间保存完成的对话会出现在数据库结果中，不会漏掉
+    pending = job_queue.pending_payloads('chat.persist', user_id=user_id)
+    history = db.get_chat_history(user_id, limit)
+    if not pending:
+        return history
+    saved = {row.get("client_id") for row in history}
+    unsaved = [
+        {key: payload.get(key) for key in ("user_message", "ai_response", "timestamp", "client_id")}
+        for payload in pending if payload.get("client_id") not in saved
+    ]
+    return [*history, *unsaved][-limit:]
+
+def register_jobs():
+    """注册后台任务处理函数"""
+    job_queue.register('chat.persist', persist_chat_message)
+    job_queue.register('chat.index', index_chat_message)
+    job_queue.register('chat.backfill', backfill_chat_index)
+
 # ========== AI聊天 ==========
-@app.route('/api/chat', methods=['POST'])
+@api.route('/api/chat', methods=['POST'])
 def chat():
     data = request.get_json()
     user_id = data.get('user_id')
@@ -97,14 +168,26 @@ def chat():
     
     print(f"💬 用户消息: {message}")
     
-    # 使用GitHub AI服务生成回复
-    ai_response = github_ai_service.generate_response(message)
-    
-    # 保存到数据库
-    db.add_chat_message(user_id, message, ai_response)
+    # 检索学生之前的相关对话，作为回答的参考（numpy较重，按需导入）
+    from semantic_memory import semantic_memory
+    context = semantic_memory.retrieve(user_id, message)
     
-    # 获取更新后的聊天记录
-    history = db.get_chat_history(user_id)
+    # 使用GitHub AI服务生成回复
+    ai_response = github_ai_service.generate_response(message, context)
+    
+    # 先读取已有记录，再把本次对话交给后台任务保存
+    history = recent_chat_history(user_id)
+    # client_id 让至少执行一次的后台任务重放时不会重复保存
+    payload = {"user_id": user_id, "user_message": message, "ai_response": ai_response,
+               "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+               "client_id": uuid.uuid4().hex}
+    if not job_queue.enqueue('chat.persist', payload):
+        # 队列不可用时同步保存（背压）
+        persist_chat_message(payload)
+    
+    history = [*history, {
+        key: payload[key] for key in ("user_message", "ai_response", "timestamp", "client_id")
+    }][-10:]
     
     return jsonify({
         "success": True,
@@ -112,7 +195,7 @@ def chat():
         "history": history
     })
 
-@app.route('/api/chat/history', methods=['GET'])
+@api.route('/api/chat/history', methods=['GET'])
 def get_chat_history():
     """获取用户聊天历史"""
     user_id = request.args.get('user_id')
@@ -121,7 +204,8 @@ def get_chat_history():
         return jsonify({"success": False, "error": "用户ID不能为空"}), 400
     
     try:
-        history = db.get_chat_history(user_id)
+        # 合并还在后台任务队列中的对话，刚发送的消息马上就能读到
+        history = recent_chat_history(user_id)
         return jsonify({
             "success": True,
             "history": history
@@ -130,8 +214,54 @@ def get_chat_history():
         print(f"获取聊天历史失败: {e}")
         return jsonify({"success": False, "error": "获取聊天历史失败"}), 500
     
+@api.route('/api/chat/archive', methods=['GET'])
+def get_archived_chat_history():
+    """按需读取已归档的聊天历史，before_id用于向前翻页"""
+    user_id = request.args.get('user_id')
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    before_id = request.args.get('before_id', type=int)
+    
+    if not user_id:
+        return jsonify({"success": False, "error": "用户ID不能为空"}), 400
+    
+    try:
+        history = db.get_archived_chat_history(user_id, limit, before_id)
+        return jsonify({
+            "success": True,
+            "history": history,
+            "next_before_id": history[0]["id"] if len(history) == limit else None
+        })
+    except Exception as e:
+        print(f"获取归档聊天历史失败: {e}")
+        return jsonify({"success": False, "error": "获取归档聊天历史失败"}), 500
+
+@api.route('/api/chat/search', methods=['GET'])
+def search_chat_history():
+    """全文搜索聊天历史（分页，按相关度排序）"""
+    user_id = request.args.get('user_id')
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_size = min(max(request.args.get('page_size', 20, type=int), 1), 50)
+    
+    if not user_id or not query:
+        return jsonify({"success": False, "error": "用户ID和搜索关键词不能为空"}), 400
+    
+    try:
+        # 多取一条用于判断是否还有下一页
+        results = db.search_chat_history(user_id, query, page_size + 1, (page - 1) * page_size)
+        return jsonify({
+            "success": True,
+            "results": results[:page_size],
+            "page": page,
+            "page_size": page_size,
+            "has_more": len(results) > page_size
+        })
+    except Exception as e:
+        print(f"搜索聊天历史失败: {e}")
+        return jsonify({"success": False, "error": "搜索聊天历史失败"}), 500
+    
 # ========== 学习目标管理 ==========
-@app.route('/api/goals', methods=['GET', 'POST'])
+@api.route('/api/goals', methods=['GET', 'POST'])
 def handle_goals():
     if request.method == 'GET':
         return get_goals()
@@ -176,7 +306,7 @@ def create_goal():
     else:
         return jsonify({"success": False, "error": "创建学习目标失败"}), 400
 
-@app.route('/api/goals/progress', methods=['GET'])
+@api.route('/api/goals/progress', methods=['GET'])
 def get_goals_progress():
     """获取目标进度统计"""
     user_id = request.args.get('user_id')
@@ -190,7 +320,21 @@ def get_goals_progress():
         "progress": progress
     })
 
-@app.route('/api/goals/status', methods=['PUT'])
+@api.route('/api/goals/recommendations', methods=['GET'])
+def get_goal_recommendations():
+    """获取推荐的学习方向（由后台任务根据相似同学的学习情况定期生成）"""
+    user_id = request.args.get('user_id')
+    
+    if not user_id:
+        return jsonify({"success": False, "error": "用户ID不能为空"}), 400
+    
+    recommendations = db.get_goal_recommendations(user_id)
+    return jsonify({
+        "success": True,
+        "recommendations": recommendations
+    })
+
+@api.route('/api/goals/status', methods=['PUT'])
 def update_goal_status():
     """更新目标状态"""
     data = request.get_json()
@@ -209,7 +353,7 @@ def update_goal_status():
     else:
         return jsonify({"success": False, "error": "更新目标状态失败"}), 400
 
-@app.route('/api/goals', methods=['DELETE'])
+@api.route('/api/goals', methods=['DELETE'])
 def delete_goal():
     """删除学习目标"""
     goal_id = request.args.get('goal_id')
@@ -227,7 +371,7 @@ def delete_goal():
         return jsonify({"success": False, "error": "删除学习目标失败"}), 400
 
 # ========== 学习记录管理 ==========
-@app.route('/api/study/session', methods=['POST'])
+@api.route('/api/study/session', methods=['POST'])
 def add_study_session():
     """添加学习记录"""
     data = request.get_json()
@@ -243,6 +387,7 @@ def add_study_session():
     session_id = db.add_study_session(user_id, subject, duration_minutes, goal_id, notes)
     
     if session_id:
+        live_sessions.touch(user_id)
         return jsonify({
             "success": True,
             "message": "学习记录添加成功",
@@ -251,7 +396,7 @@ def add_study_session():
     else:
         return jsonify({"success": False, "error": "添加学习记录失败"}), 400
 
-@app.route('/api/study/sessions', methods=['GET'])
+@api.route('/api/study/sessions', methods=['GET'])
 def get_study_sessions():
     """获取学习记录"""
     user_id = request.args.get('user_id')
@@ -259,13 +404,11 @@ def get_study_sessions():
     if not user_id:
         return jsonify({"success": False, "error": "用户ID不能为空"}), 400
     
-    sessions = db.get_study_sessions(user_id)
-    return jsonify({
-        "success": True,
-        "sessions": sessions
-    })
+    # 逐行读取并流式输出，不在内存中生成完整的记录列表
+    sessions = db.iter_study_sessions(user_id)
+    return json_list_response("sessions", sessions, success=True)
 
-@app.route('/api/study/statistics', methods=['GET'])
+@api.route('/api/study/statistics', methods=['GET'])
 def get_study_statistics():
     """获取学习统计"""
     user_id = request.args.get('user_id')
@@ -279,15 +422,112 @@ def get_study_statistics():
         "statistics": stats
     })
 
+# ========== 实时学习会话 ==========
+@api.route('/api/study/live', methods=['GET'])
+def get_live_sessions():
+    """获取用户进行中的学习会话"""
+    user_id = request.args.get('user_id')
+    
+    if not user_id:
+        return jsonify({"success": False, "error": "用户ID不能为空"}), 400
+    
+    return jsonify(dict(live_sessions.snapshot(user_id), success=True))
+
+@api.route('/api/study/live/start', methods=['POST'])
+def start_live_session():
+    """开始学习会话，由服务端计时"""
+    data = request.get_json()
+    user_id = data.get('user_id')
+    subject = data.get('subject', '').strip()
+    goal_id = data.get('goal_id')
+    notes = data.get('notes', '').strip()
+    
+    if not user_id or not subject:
+        return jsonify({"success": False, "error": "用户ID和学科不能为空"}), 400
+    
+    session = live_sessions.start_session(user_id, subject, goal_id, notes)
+    return jsonify({
+        "success": True,
+        "session": session,
+        "heartbeat_interval": live_sessions.heartbeat_interval
+    })
+
+@api.route('/api/study/live/heartbeat', methods=['POST'])
+def live_session_heartbeat():
+    """学习会话心跳（批量写入，立即返回）"""
+    data = request.get_json()
+    user_id = data.get('user_id')
+    session_id = data.get('session_id')
+    
+    if not user_id or not session_id:
+        return jsonify({"success": False, "error": "参数不完整"}), 400
+    
+    live_sessions.heartbeat(user_id, session_id)
+    return jsonify({"success": True}), 202
+
+@api.route('/api/study/live/stop', methods=['POST'])
+def stop_live_session():
+    """结束学习会话并保存学习记录"""
+    data = request.get_json()
+    user_id = data.get('user_id')
+    session_id = data.get('session_id')
+    notes = data.get('notes')
+    
+    if not user_id or not session_id:
+        return jsonify({"success": False, "error": "参数不完整"}), 400
+    
+    result = live_sessions.stop_session(user_id, session_id, notes.strip() if notes else None)
+    if result is None:
+        return jsonify({"success": False, "error": "学习会话不存在或已结束"}), 404
+    return jsonify(dict(result, success=True, message="学习会话已结束"))
+
+@api.route('/api/study/live/stream', methods=['GET'])
+def stream_live_sessions():
+    """推送用户学习会话的变化（SSE），用户打开的所有页面同步更新"""
+    user_id = request.args.get('user_id')
+    
+    if not user_id:
+        return jsonify({"success": False, "error": "用户ID不能为空"}), 400
+    
+    events = live_sessions.stream(user_id)
+    if events is None:
+        return jsonify({"success": False, "error": "推送连接过多，请稍后重试"}), 503
+    return Response(events, mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 # ========== 错误处理 ==========
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(error):
     return jsonify({"success": False, "error": "接口不存在"}), 404
 
-@app.errorhandler(500)
+@api.app_errorhandler(500)
 def internal_error(error):
     return jsonify({"success": False, "error": "服务器内部错误"}), 500
 
+# ========== 应用工厂 ==========
+def create_app():
+    """创建Flask应用；数据库和AI服务在第一次使用时才初始化"""
+    load_environment()
+    
+    app = Flask(__name__)
+    CORS(app)
+    
+    # 配置
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
+    app.config['JSON_AS_ASCII'] = False  # 支持中文
+    
+    # 快速JSON序列化（中文不转义）+ gzip/brotli压缩
+    init_responses(app)
+    # 性能分析（需在其他请求钩子之前注册）
+    init_profiling(app)
+    app.register_blueprint(api)
+    register_jobs()
+    return app
+
+app = create_app()
+
 # ========== 启动应用 ==========
 def run_flask_app():
     port = 5000
@@ -300,14 +540,16 @@ def run_flask_app():
     print("=" * 60)
     
     # 检查AI服务状态
-    if github_ai_service.github_pat:
-        print("✅ GitHub PAT: 已配置")
-        print("🔗 API端点: https://models.github.ai/inference/chat/completions")
+    if github_ai_service.router.providers:
+        print("✅ AI后端: 已配置")
+        for provider in github_ai_service.router.providers:
+            print(f"🔗 [{provider.tier}] {provider.name}: {provider.model} @ {provider.api_url}")
     else:
-        print("⚠️ GitHub PAT: 未配置 (运行在模拟模式)")
+        print("⚠️ AI后端: 未配置 (运行在模拟模式)")
     
     print("✅ Flask服务启动成功！")
     print("💡 提示: 按 Ctrl+C 停止服务")
+    print("💡 提示: 这是开发服务器，生产环境请使用 python serve.py 启动多进程服务")
 
 if __name__ == '__main__':
     run_flask_app()
@@ -0,0 +1,50 @@
+"""组提交写入吞吐量基准
+
+用法: python benchmarks/bench_group_commit.py [并发线程数] [每线程写入数]
+在临时SQLite文件上分别以逐行提交和组提交方式并发插入学习记录，比较每秒写入行数。
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database.sqlite_database import SQLiteDatabase
+
+
+def run(group_commit, threads, per_thread):
+    os.environ['DB_GROUP_COMMIT'] = '1' if group_commit else '0'
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SQLiteDatabase(os.path.join(tmp, 'bench.db'))
+        errors = []
+
+        def worker(n):
+            for i in range(per_thread):
+                try:
+                    db.add_study_session(n, '数学', 30, None, f'第{i}次')
+                except Exception as e:
+                    errors.append(e)
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        start = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - start
+        total = threads * per_thread - len(errors)
+        label = "组提交" if group_commit else "逐行提交"
+        print(f"{label}: {total} 行, {elapsed:.2f}s, {total / elapsed:.0f} 行/秒, 失败 {len(errors)}")
+        if db._group_writer is not None:
+            print(f"  批次统计: {db._group_writer.metrics}")
+        return total / elapsed
+
+
+if __name__ == '__main__':
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    baseline = run(False, threads, per_thread)
+    grouped = run(True, threads, per_thread)
+    print(f"提升: {grouped / baseline:.1f}x")
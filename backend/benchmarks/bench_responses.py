@@ -0,0 +1,117 @@
+"""响应序列化与压缩基准
+
+用法: python benchmarks/bench_responses.py [重复次数]
+在临时SQLite文件中写入示例数据，按各接口的方式用 db.get_* 读出真实的行并组装响应，对比:
+  1. Flask 默认 JSON 序列化（标准库，中文转义为 \\uXXXX）与 FastJSONProvider 的CPU耗时
+  2. 原始、gzip、brotli 三种情况下实际传输的字节数
+"""
+import os
+import sys
+import time
+import gzip
+import random
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from database.sqlite_database import SQLiteDatabase
+from database.result_set import ResultSet, Record
+import responses
+
+ANSWER = ("学习是一个循序渐进的过程。建议你先把今天的目标拆成几个小任务，"
+          "每完成一个就休息五分钟，这样既能保持专注又不会太累。加油！💪 ") * 4
+SUBJECTS = ["数学", "英语", "物理", "化学", "编程"]
+
+
+def populate(db):
+    """用户1: 少量记录；用户2: 一周5000条学习记录"""
+    rng = random.Random(1)
+    for user_id, username in ((1, "xiaoming"), (2, "xiaohong")):
+        db.create_user(username, "password", user_id)
+    rows = [("chat_history", {
+        "user_id": 1,
+        "user_message": f"第{i}个问题：怎么才能更高效地复习数学和英语？",
+        "ai_response": ANSWER
+    }) for i in range(20)]
+    for user_id, count in ((1, 30), (2, 5000)):
+        rows += [("study_sessions", {
+            "user_id": user_id,
+            "goal_id": None,
+            "subject": rng.choice(SUBJECTS),
+            "duration_minutes": rng.randint(10, 120),
+            "notes": "复习了错题本" if i % 3 else ""
+        }) for i in range(count)]
+    db.insert_rows(rows)
+    for i in range(20):
+        db.create_learning_goal(
+            1, f"每天背{i * 10}个英语单词", "坚持三十天，考试前完成整本词汇书的第一轮复习",
+            "english", 1 + i % 3, "2024-06-30"
+        )
+
+
+def plain(value):
+    """把结果集转换为dict列表，两种序列化方式处理相同的数据"""
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, ResultSet)):
+        return [plain(item) for item in value]
+    if isinstance(value, Record):
+        return value.to_dict()
+    return value
+
+
+def endpoint_payloads(db):
+    """与各接口返回的结构一致"""
+    history = db.get_chat_history(1)
+    chat = [*history, {"user_message": "怎么复习物理？", "ai_response": ANSWER,
+                       "timestamp": "2024-05-01 12:00:00"}][-10:]
+    return [
+        ("/api/chat", {"success": True, "response": ANSWER, "history": chat}),
+        ("/api/chat/history", {"success": True, "history": history}),
+        ("/api/study/sessions (30条)", {"success": True, "sessions": db.get_study_sessions(1)}),
+        ("/api/study/sessions (5000条)", {"success": True, "sessions": db.get_study_sessions(2)}),
+        ("/api/study/statistics", {"success": True, "statistics": db.get_study_statistics(1)}),
+        ("/api/goals", {"success": True, "goals": db.get_user_goals(1)}),
+    ]
+
+
+def time_per_call(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    app = Flask(__name__)
+    baseline = DefaultJSONProvider(app)
+    fast = responses.FastJSONProvider(app)
+    encoder = "orjson" if responses.orjson is not None else "标准库(紧凑)"
+    print(f"快速序列化: {encoder}, brotli: {'可用' if responses.brotli is not None else '未安装'}, 每项重复 {repeat} 次")
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SQLiteDatabase(os.path.join(tmp, 'bench.db'))
+        populate(db)
+        endpoints = [(name, plain(payload)) for name, payload in endpoint_payloads(db)]
+
+    print(f"\n{'接口':<30}{'默认µs':>10}{'快速µs':>10}{'默认字节':>11}{'新字节':>10}{'gzip':>9}{'br':>9}")
+
+    for name, payload in endpoints:
+        n = max(repeat // 50, 3) if len(str(payload)) > 100000 else repeat
+        old_us = time_per_call(lambda: baseline.dumps(payload).encode('utf-8'), n)
+        new_us = time_per_call(lambda: responses.dumps_bytes(payload), n)
+        old_bytes = len(baseline.dumps(payload).encode('utf-8'))
+        raw = responses.dumps_bytes(payload)
+        gz = len(gzip.compress(raw, compresslevel=6))
+        br = len(responses.brotli.compress(raw, quality=5)) if responses.brotli is not None else '-'
+        print(f"{name:<30}{old_us:>10.1f}{new_us:>10.1f}{old_bytes:>11}{len(raw):>10}{gz:>9}{br:>9}")
+
+    print("\n默认字节: Flask 2.3 默认输出（忽略 JSON_AS_ASCII，中文转义为 \\uXXXX）；"
+          f"小于 {responses.COMPRESS_MIN_SIZE} 字节的响应不压缩。")
+
+
+if __name__ == '__main__':
+    main()
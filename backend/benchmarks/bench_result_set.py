@@ -0,0 +1,122 @@
+"""查询结果表示方式基准
+
+用法: python benchmarks/bench_result_set.py [学习记录条数] [聊天记录条数]
+在临时SQLite文件上读取大量学习记录和聊天记录并序列化为JSON响应，对比:
+  dict列表  原来的 [dict(row) ...] + Flask默认序列化
+  ResultSet 元组结果集 + responses.dumps_bytes
+  流式      逐行迭代 + 分块序列化（对应 json_list_response 的流式输出）
+分别报告耗时、tracemalloc 统计的内存峰值，以及查询结果读出后常驻的内存（不含序列化）。
+"""
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from database.sqlite_database import SQLiteDatabase
+import responses
+
+SESSIONS_SQL = 'SELECT * FROM study_sessions WHERE user_id = ? ORDER BY id DESC'
+CHAT_SQL = 'SELECT id, user_message, ai_response, timestamp FROM chat_history WHERE user_id = ? ORDER BY id'
+
+
+def populate(db, sessions, chats):
+    conn = db.get_connection()
+    conn.executemany(
+        'INSERT INTO study_sessions (user_id, subject, duration_minutes, notes) VALUES (1, ?, ?, ?)',
+        ((["数学", "英语", "编程"][i % 3], 10 + i % 110, "复习了错题本") for i in range(sessions))
+    )
+    conn.executemany(
+        'INSERT INTO chat_history (user_id, user_message, ai_response) VALUES (1, ?, ?)',
+        ((f"第{i}个问题：怎么复习数学？", "建议先把目标拆成小任务，每完成一个就休息五分钟。" * 3) for i in range(chats))
+    )
+    conn.commit()
+    conn.close()
+
+
+def fetch_dicts(db, sql):
+    conn = db.get_connection()
+    try:
+        return [dict(row) for row in conn.execute(sql, (1,)).fetchall()]
+    finally:
+        conn.close()
+
+
+def fetch_result_set(db, sql):
+    conn = db.get_connection()
+    try:
+        return db.query(conn, sql, (1,))
+    finally:
+        conn.close()
+
+
+def dict_rows(db, sql, provider):
+    return provider.dumps({"success": True, "rows": fetch_dicts(db, sql)}).encode('utf-8')
+
+
+def result_set(db, sql, provider):
+    return responses.dumps_bytes({"success": True, "rows": fetch_result_set(db, sql)})
+
+
+def streamed(db, sql, provider):
+    size = 0
+    for chunk in responses._stream_chunks("rows", db.iter_query(sql, (1,)), {"success": True}):
+        size += len(chunk)
+    return size
+
+
+def retained(fetch, db, sql):
+    """读出的结果在内存中常驻的大小（MB）"""
+    if fetch is None:
+        return None
+    tracemalloc.start()
+    rows = fetch(db, sql)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+    return current / 1024 / 1024
+
+
+def measure(fn, *args):
+    fn(*args)
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed * 1000, peak / 1024 / 1024
+
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    provider = DefaultJSONProvider(Flask(__name__))
+    print(f"序列化: {'orjson' if responses.orjson is not None else '标准库'}；学习记录 {sessions} 条，聊天记录 {chats} 条\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DB_GROUP_COMMIT'] = '0'
+        db = SQLiteDatabase(os.path.join(tmp, 'bench.db'))
+        populate(db, sessions, chats)
+        print(f"{'数据':<10}{'方式':<12}{'耗时ms':>10}{'内存峰值MB':>14}{'结果常驻MB':>14}")
+        variants = (("dict列表", dict_rows, fetch_dicts),
+                    ("ResultSet", result_set, fetch_result_set),
+                    ("流式", streamed, None))
+        for label, sql in (("学习记录", SESSIONS_SQL), ("聊天记录", CHAT_SQL)):
+            baseline = None
+            for name, fn, fetch in variants:
+                ms, mb = measure(fn, db, sql, provider)
+                kept = retained(fetch, db, sql)
+                kept_text = f"{kept:>14.1f}" if kept is not None else f"{'-':>14}"
+                note = "" if baseline is None else f"  ({baseline[0] / ms:.1f}x 速度, 峰值 {mb / baseline[1]:.0%})"
+                baseline = baseline or (ms, mb)
+                print(f"{label:<10}{name:<12}{ms:>10.1f}{mb:>14.1f}{kept_text}{note}")
+
+
+if __name__ == '__main__':
+    main()
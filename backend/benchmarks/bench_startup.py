@@ -0,0 +1,86 @@
+"""进程冷启动基准
+
+用法: python benchmarks/bench_startup.py [--runs N] [--budget-ms MS]
+每次在全新的解释器中测量:
+  1. import app 的耗时（工作进程启动/扩容时的冷启动开销）
+  2. 第一个访问数据库的请求耗时（包含延迟的数据库连接和表结构初始化）
+并列出导入最慢的模块。设置 --budget-ms 后，import 中位数超出预算时以非零状态退出，可用于CI。
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PROBE = '''
+import sys, time, json
+sys.path.insert(0, %r)
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+LOADED = set(sys.modules)
+client = app.app.test_client()
+client.get('/api/goals/progress?user_id=1')
+first_request = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_request_ms": (first_request - imported) * 1000,
+    "drivers_after_import": [m for m in ("psycopg2", "sqlite3", "numpy", "requests") if m in LOADED]
+}))
+'''
+
+
+def run_probe(workdir):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE % BACKEND_DIR],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(workdir, top=10):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import sys; sys.path.insert(0, {BACKEND_DIR!r}); import app'],
+        cwd=workdir, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # 名称前的缩进表示导入层级，只保留app及其直接导入的模块
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            rows.append((int(cumulative_us), int(self_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="后端冷启动基准")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = [run_probe(workdir) for _ in range(args.runs)]
+        imports = [r["import_ms"] for r in results]
+        first_requests = [r["first_request_ms"] for r in results]
+        print(f"import app:   中位数 {statistics.median(imports):.1f}ms  (最小 {min(imports):.1f}ms, {args.runs} 次)")
+        print(f"首个数据库请求: 中位数 {statistics.median(first_requests):.1f}ms")
+        print(f"导入后已加载的重依赖: {results[-1]['drivers_after_import'] or '无'}")
+        print("导入最慢的顶层模块 (累计ms):")
+        for cumulative_us, self_us, name in slowest_imports(workdir):
+            print(f"  {cumulative_us / 1000:8.1f}  {name}")
+
+    if args.budget_ms is not None and statistics.median(imports) > args.budget_ms:
+        print(f"❌ 启动耗时超出预算 {args.budget_ms}ms")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import os
+import time
+import fcntl
+import threading
+from lazy_init import LazyProxy
+from database import db
+
+
+class ChatRetentionTask:
+    """聊天记录保留策略：定期把过期记录分批压缩归档，批次之间休眠以免影响在线写入"""
+
+    def __init__(self, retention_days=None, batch_size=None, pause=None, interval=None):
+        self.retention_days = retention_days if retention_days is not None else \
+            int(os.getenv('CHAT_RETENTION_DAYS', '180'))
+        self.batch_size = batch_size or int(os.getenv('CHAT_ARCHIVE_BATCH_SIZE', '500'))
+        self.pause = pause if pause is not None else float(os.getenv('CHAT_ARCHIVE_PAUSE', '0.5'))
+        self.interval = interval or int(os.getenv('CHAT_ARCHIVE_INTERVAL', '3600'))
+        self.lock_path = os.getenv('CHAT_ARCHIVE_LOCK', 'chat_retention.lock')
+        self.metrics = {"runs": 0, "archived": 0, "last_run": None}
+        self._pid = None
+        self._thread = None
+        self._lock_file = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self):
+        """启动后台归档线程（每个进程一个）；CHAT_RETENTION_DAYS=0 时不启用"""
+        if self.retention_days <= 0:
+            return
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(target=self._loop, name="chat-retention", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _acquire_lock(self):
+        """同一台机器上只让一个进程执行归档"""
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            if self._acquire_lock():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print(f"❌ 聊天记录归档失败: {e}")
+                finally:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._stopping.wait(self.interval)
+
+    def run_once(self):
+        """归档所有过期记录，返回归档条数"""
+        total = 0
+        while not self._stopping.is_set():
+            archived = db.archive_chat_history(self.retention_days, self.batch_size)
+            total += archived
+            if archived < self.batch_size:
+                break
+            self._stopping.wait(self.pause)
+        self.metrics["runs"] += 1
+        self.metrics["archived"] += total
+        self.metrics["last_run"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        if total:
+            print(f"📦 已归档 {total} 条超过 {self.retention_days} 天的聊天记录")
+        return total
+
+
+# 全局归档任务实例：第一次使用时创建
+chat_retention = LazyProxy(ChatRetentionTask, 'chat_retention')
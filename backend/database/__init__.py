@@ -1,21 +1,28 @@
 import os
-from .sqlite_database import SQLiteDatabase
-from .postgresql_database import PostgreSQLDatabase
+from lazy_init import LazyProxy
 
 def create_database():
-    """智能创建数据库实例"""
+    """智能创建数据库实例（只导入实际使用的数据库驱动）"""
+    shards = os.getenv('DATABASE_SHARDS')
+    if shards:
+        # 分片模式不回退到SQLite，避免数据写到错误的位置
+        from .sharding import ShardedDatabase, parse_shards
+        print("🧩 使用分片数据库")
+        return ShardedDatabase(parse_shards(shards), os.getenv('DATABASE_DIRECTORY_URL'))
+    
     database_url = os.getenv('DATABASE_URL')
     
     if database_url and database_url.startswith('postgresql://'):
         print("🚀 使用 PostgreSQL 数据库 (生产环境)")
         try:
+            from .postgresql_database import PostgreSQLDatabase
             return PostgreSQLDatabase(database_url)
         except Exception as e:
             print(f"❌ PostgreSQL 连接失败，回退到 SQLite: {e}")
-            return SQLiteDatabase()
     else:
         print("💻 使用 SQLite 数据库 (开发环境)")
-        return SQLiteDatabase()
+    from .sqlite_database import SQLiteDatabase
+    return SQLiteDatabase()
 
-# 创建全局数据库实例
-db = create_database()
\ No newline at end of file
+# 全局数据库实例：第一次访问时才连接并初始化表结构（每个进程一次）
+db = LazyProxy(create_database, 'database')
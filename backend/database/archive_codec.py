@@ -0,0 +1,39 @@
+import json
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def pack_messages(messages):
+    """把一批聊天记录压缩为一个归档块，优先使用zstd，未安装时使用zlib"""
+    raw = json.dumps(messages, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=10).compress(raw)
+    return 'zlib', zlib.compress(raw, 9)
+
+
+def unpack_messages(codec, payload):
+    """解压归档块，返回聊天记录列表"""
+    payload = bytes(payload)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("读取zstd归档需要安装zstandard")
+        raw = zstandard.ZstdDecompressor().decompress(payload)
+    elif codec == 'zlib':
+        raw = zlib.decompress(payload)
+    else:
+        raise ValueError(f"未知的归档编码: {codec}")
+    return json.loads(raw.decode('utf-8'))
+
+
+def group_by_user(rows):
+    """按用户分组，归档块内的记录按ID升序"""
+    groups = {}
+    for row in rows:
+        groups.setdefault(row["user_id"], []).append(row)
+    for messages in groups.values():
+        messages.sort(key=lambda row: row["id"])
+    return groups
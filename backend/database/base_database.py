@@ -1,13 +1,273 @@
 from abc import ABC, abstractmethod
+import os
+import re
 import hashlib
+import threading
+from datetime import datetime, timedelta
+from .group_commit import GroupCommitWriter
+
+_IDENTIFIER = re.compile(r'^[a-z_][a-z0-9_]*$')
+# 创建组提交写入器的锁：并发的第一次写入只创建一个写入器
+_group_writer_lock = threading.Lock()
+
+class BucketFenced(Exception):
+    """写入的分桶已被迁移工具封锁：本次写入已回滚，由分片路由等迁移完成后重试"""
+    
+    def __init__(self, bucket):
+        super().__init__(f"分桶 {bucket} 正在迁移，已拒绝写入")
+        self.bucket = bucket
 
 class BaseDatabase(ABC):
     """数据库抽象基类"""
     
+    _group_writer = None
+    placeholder = '?'
+    # 分片时为分桶数量，写入时检查分桶封锁；0 表示未分片
+    fence_buckets = 0
+    # 检查封锁时对封锁行加的锁（PostgreSQL用 FOR SHARE 和迁移工具加封锁互斥）
+    share_lock = ''
+    
     def hash_password(self, password):
         """统一的密码哈希方法"""
         return hashlib.sha256(password.encode()).hexdigest()
     
+    @staticmethod
+    def check_identifier(name):
+        """校验拼接进SQL的表名/列名"""
+        if not _IDENTIFIER.match(name):
+            raise ValueError(f"非法的标识符: {name}")
+        return name
+    
+    def build_insert(self, table, row, placeholder, expressions=None):
+        """生成单行INSERT语句；expressions为 {列名: SQL表达式}，表达式中的参数排在row的值之后"""
+        expressions = expressions or {}
+        columns = ', '.join(self.check_identifier(c) for c in [*row, *expressions])
+        values = ', '.join([placeholder] * len(row) + list(expressions.values()))
+        return f"INSERT INTO {self.check_identifier(table)} ({columns}) VALUES ({values})"
+    
+    def close(self):
+        """释放当前进程持有的数据库连接（每次操作单独连接的实现无需处理）"""
+        pass
+    
+    @abstractmethod
+    def transaction(self):
+        """返回一个上下文管理器：借出连接，正常结束时提交、出错时回滚"""
+        pass
+    
+    def _sql(self, sql):
+        """把以 ? 占位、% 取模的通用SQL转换为当前驱动的格式"""
+        if self.placeholder == '%s':
+            return sql.replace('%', '%%').replace('?', '%s')
+        return sql
+    
+    @abstractmethod
+    def set_id_floor(self, table, floor, ceiling=None):
+        """保证表之后自动生成的ID大于floor；指定ceiling时ID用到ceiling之后插入报错
+        （分片时为每个分片划分互不重叠的ID区间）"""
+        pass
+    
+    def export_bucket(self, table, key, num_buckets, bucket, batch_size=500):
+        """按 key % num_buckets = bucket 分批读出整行（dict），用于分片迁移"""
+        self.check_identifier(table)
+        self.check_identifier(key)
+        sql = self._sql(
+            f'SELECT * FROM {table} WHERE {key} % ? = ? AND id > ? ORDER BY id LIMIT ?'
+        )
+        after_id = -1
+        while True:
+            with self.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (num_buckets, bucket, after_id, batch_size))
+                columns = [desc[0] for desc in cursor.description]
+                rows = [dict(zip(columns, values)) for values in cursor.fetchall()]
+                cursor.close()
+            if not rows:
+                return
+            yield from rows
+            after_id = rows[-1]["id"]
+    
+    def delete_bucket(self, table, key, num_buckets, bucket):
+        """删除 key % num_buckets = bucket 的所有行，返回删除条数"""
+        self.check_identifier(table)
+        self.check_identifier(key)
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self._sql(f'DELETE FROM {table} WHERE {key} % ? = ?'), (num_buckets, bucket))
+            count = cursor.rowcount
+            cursor.close()
+        return count
+    
+    # ========== 分桶封锁（分片迁移使用） ==========
+    def init_fences(self, num_buckets):
+        """建立分桶封锁表（每个分桶一行），之后本库的每次写入都检查所在分桶是否被封锁"""
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS shard_fences (
+                    bucket INTEGER PRIMARY KEY,
+                    fenced INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.executemany(
+                self._sql('INSERT INTO shard_fences (bucket) VALUES (?) ON CONFLICT DO NOTHING'),
+                [(bucket,) for bucket in range(num_buckets)]
+            )
+            cursor.close()
+        self.fence_buckets = num_buckets
+    
+    def set_fence(self, bucket, fenced):
+        """封锁/解除封锁一个分桶；封锁时等待正在写入该分桶的事务结束，之后的写入都会被拒绝"""
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self._sql('UPDATE shard_fences SET fenced = ? WHERE bucket = ?'), (int(fenced), bucket))
+            cursor.close()
+    
+    def check_fence(self, cursor, user_id):
+        """在写事务中、写入语句之后调用：用户所在分桶被封锁时抛出 BucketFenced
+        
+        SQLite此时已持有写锁；PostgreSQL对封锁行加共享锁。迁移工具修改封锁行时会等这些事务提交，
+        因此封锁生效之后开始复制，不会漏掉已经通过路由检查、还在排队或执行中的写入。
+        """
+        if not self.fence_buckets or user_id is None:
+            return
+        bucket = int(user_id) % self.fence_buckets
+        cursor.execute(self._sql('SELECT fenced FROM shard_fences WHERE bucket = ?') + self.share_lock, (bucket,))
+        row = cursor.fetchone()
+        if row is not None and row[0]:
+            raise BucketFenced(bucket)
+    
+    def fenced_buckets(self, cursor):
+        """被封锁的分桶集合（涉及多个用户的写入在事务中调用，跳过这些分桶的数据）"""
+        if not self.fence_buckets:
+            return set()
+        cursor.execute('SELECT bucket, fenced FROM shard_fences' + self.share_lock)
+        return {bucket for bucket, fenced in cursor.fetchall() if fenced}
+    
+    # ========== 目标推荐（离线任务使用） ==========
+    def iter_recommendation_signals(self, user_ids=None, batch_size=1000):
+        """产出 (user_id, kind, name, value)：每个用户各科目的累计学习分钟数（kind='subject'）
+        和各分类的目标数（kind='category'）；user_ids为None时读取全部用户"""
+        where = ''
+        params = ()
+        if user_ids is not None:
+            if not user_ids:
+                return
+            where = f"WHERE user_id IN ({', '.join(['?'] * len(user_ids))})"
+            params = tuple(user_ids)
+        queries = (
+            ('subject', f'SELECT user_id, subject, SUM(duration_minutes) FROM study_sessions {where} GROUP BY user_id, subject'),
+            ('category', f'SELECT user_id, category, COUNT(*) FROM learning_goals {where} GROUP BY user_id, category'),
+        )
+        for kind, sql in queries:
+            with self.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.execute(self._sql(sql), params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for user_id, name, value in rows:
+                        yield user_id, kind, name, value
+                cursor.close()
+    
+    def get_active_users_since(self, since=None, overlap=60):
+        """返回 (用户ID列表, 新水位)：since之后有新学习记录或目标变化的用户
+
+        水位取数据库自己的当前时间（字符串），下次调用时原样传回；
+        查询时向前多取overlap秒，覆盖水位之前开始、之后才提交的事务。
+        """
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT CURRENT_TIMESTAMP')
+            now = cursor.fetchone()[0]
+            if isinstance(now, str):
+                now = datetime.fromisoformat(now)
+            user_ids = []
+            if since is not None:
+                start = datetime.fromisoformat(since) - timedelta(seconds=overlap)
+                # SQLite按字符串比较时间，PostgreSQL直接传带时区的时间
+                param = start if start.tzinfo is not None else start.strftime('%Y-%m-%d %H:%M:%S')
+                cursor.execute(self._sql('''
+                    SELECT user_id FROM study_sessions WHERE created_at >= ?
+                    UNION
+                    SELECT user_id FROM learning_goals WHERE updated_at >= ?
+                '''), (param, param))
+                user_ids = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+        return user_ids, now.isoformat(sep=' ')
+    
+    def save_goal_recommendations(self, recommendations):
+        """替换一批用户的推荐：{user_id: [(kind, name, score, based_on_kind, based_on_name), ...]}"""
+        if not recommendations:
+            return
+        user_ids = list(recommendations)
+        rows = [(user_id, *item) for user_id, items in recommendations.items() for item in items]
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                self._sql(f"DELETE FROM goal_recommendations WHERE user_id IN ({', '.join(['?'] * len(user_ids))})"),
+                tuple(user_ids)
+            )
+            cursor.executemany(self._sql('''
+                INSERT INTO goal_recommendations (user_id, kind, name, score, based_on_kind, based_on_name)
+                VALUES (?, ?, ?, ?, ?, ?)
+            '''), rows)
+            for user_id in user_ids:
+                self.check_fence(cursor, user_id)
+            cursor.close()
+    
+    def delete_stale_goal_recommendations(self, before):
+        """删除水位before（get_active_users_since返回）之前生成的推荐，返回删除行数
+
+        全量构建会重新写入所有仍有学习数据的用户，之后调用本方法清理其余用户的旧推荐；迁移中的分桶不处理。
+        """
+        before = datetime.fromisoformat(before)
+        param = before if before.tzinfo is not None else before.strftime('%Y-%m-%d %H:%M:%S')
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            sql = 'DELETE FROM goal_recommendations WHERE created_at < ?'
+            params = [param]
+            fenced = sorted(self.fenced_buckets(cursor))
+            if fenced:
+                sql += f" AND user_id % {int(self.fence_buckets)} NOT IN ({', '.join(['?'] * len(fenced))})"
+                params += fenced
+            cursor.execute(self._sql(sql), tuple(params))
+            deleted = cursor.rowcount
+            cursor.close()
+        return deleted
+    
+    def get_metrics(self):
+        """数据库层运行指标（用于健康检查）"""
+        metrics = {"backend": type(self).__name__}
+        if self._group_writer is not None:
+            metrics["group_commit"] = dict(self._group_writer.metrics)
+        return metrics
+    
+    def group_insert(self, table, row):
+        """通过组提交插入一行并返回新行ID；DB_GROUP_COMMIT=0 时直接单独提交"""
+        if os.getenv('DB_GROUP_COMMIT', '1') == '0':
+            return self.insert_rows([(table, row)])[0]
+        writer = self._group_writer
+        if writer is None:
+            with _group_writer_lock:
+                writer = self._group_writer
+                if writer is None:
+                    writer = self._group_writer = GroupCommitWriter(self.insert_rows)
+        return writer.submit(table, row)
+    
+    def existing_row_id(self, cursor, table, row):
+        """带client_id的聊天记录已经保存过时返回它的ID（任务至少执行一次，重放时不重复插入）"""
+        if table != 'chat_history' or not row.get("client_id"):
+            return None
+        cursor.execute(self._sql('SELECT id FROM chat_history WHERE client_id = ?'), (row["client_id"],))
+        found = cursor.fetchone()
+        return found[0] if found else None
+    
+    @abstractmethod
+    def insert_rows(self, items):
+        """在一个事务中插入多行，items为[(table, row_dict), ...]，按顺序返回行ID"""
+        pass
+    
     @abstractmethod
     def create_connection(self):
         pass
@@ -17,7 +277,8 @@ class BaseDatabase(ABC):
         pass
     
     @abstractmethod
-    def create_user(self, username, password):
+    def create_user(self, username, password, user_id=None):
+        """创建用户并返回ID；user_id不为空时使用指定的ID（分片时由全局分配）"""
         pass
     
     @abstractmethod
@@ -25,7 +286,8 @@ class BaseDatabase(ABC):
         pass
     
     @abstractmethod
-    def add_chat_message(self, user_id, user_message, ai_response):
+    def add_chat_message(self, user_id, user_message, ai_response, client_id=None):
+        """保存一轮对话并返回ID；client_id相同的记录只保存一次"""
         pass
     
     @abstractmethod
@@ -33,7 +295,33 @@ class BaseDatabase(ABC):
         pass
     
     @abstractmethod
-    def create_learning_goal(self, user_id, title, description, category, priority, target_date):
+    def get_chat_messages(self, user_id, after_id=0, limit=500):
+        """按ID升序获取用户ID大于after_id的聊天记录（用于增量索引）"""
+        pass
+    
+    @abstractmethod
+    def get_chat_messages_by_ids(self, user_id, chat_ids):
+        """按ID获取用户的聊天记录"""
+        pass
+    
+    @abstractmethod
+    def search_chat_history(self, user_id, query, limit=20, offset=0):
+        """全文搜索用户的聊天记录，按相关度排序"""
+        pass
+    
+    @abstractmethod
+    def archive_chat_history(self, older_than_days, batch_size=500):
+        """把超过保留期的一批聊天记录按用户压缩移入归档表（每个用户一个归档块，最多batch_size条），
+        返回归档条数；少于batch_size条时表示已没有过期记录"""
+        pass
+    
+    @abstractmethod
+    def get_archived_chat_history(self, user_id, limit=50, before_id=None):
+        """读取用户已归档的聊天记录（ID小于before_id的最近limit条，按时间正序）"""
+        pass
+    
+    @abstractmethod
+    def create_learning_goal(self, user_id, title, description, category, priority, target_date, goal_id=None):
         pass
     
     @abstractmethod
@@ -60,6 +348,15 @@ class BaseDatabase(ABC):
     def get_study_sessions(self, user_id, days=7):
         pass
     
+    def iter_study_sessions(self, user_id, days=7):
+        """逐行遍历学习记录，用于流式输出大量记录；默认实现一次性读取"""
+        return iter(self.get_study_sessions(user_id, days))
+    
     @abstractmethod
     def get_study_statistics(self, user_id, days=30):
+        pass
+    
+    @abstractmethod
+    def get_goal_recommendations(self, user_id):
+        """读取离线任务为用户生成的推荐目标（按得分降序）"""
         pass
\ No newline at end of file
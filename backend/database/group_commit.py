@@ -0,0 +1,109 @@
+import os
+import time
+import threading
+
+
+class _PendingWrite:
+    """等待组提交的一行插入"""
+    __slots__ = ('table', 'row', 'event', 'result', 'error')
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GroupCommitWriter:
+    """组提交写入器：把并发请求的插入合并到一个事务中提交
+
+    flush_fn(items) 接收 [(table, row), ...]，在一个事务里插入并按顺序返回行ID。
+    submit() 会阻塞到所在批次提交完成，因此调用方拿到ID时数据已经持久化；
+    超时只会发生在这一行还没进入批次时，此时撤回这一行，不会写入。
+    """
+
+    def __init__(self, flush_fn, max_batch=None, max_delay=None, timeout=30):
+        self.flush_fn = flush_fn
+        self.max_batch = max_batch or int(os.getenv('DB_GROUP_COMMIT_MAX_BATCH', '256'))
+        if max_delay is None:
+            max_delay = float(os.getenv('DB_GROUP_COMMIT_DELAY_MS', '2')) / 1000
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.metrics = {"batches": 0, "rows": 0, "max_batch_size": 0}
+        self._cond = threading.Condition()
+        self._pending = []
+        self._pid = None
+        self._thread = None
+
+    def _ensure_started(self):
+        """启动后台刷写线程（fork之后在子进程中重新启动）"""
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._cond:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._pending = []
+            self._thread = threading.Thread(
+                target=self._flush_loop, name="group-commit", daemon=True
+            )
+            self._thread.start()
+
+    def submit(self, table, row):
+        """提交一行插入，返回新行ID"""
+        self._ensure_started()
+        item = _PendingWrite(table, row)
+        with self._cond:
+            self._pending.append(item)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify()
+        if not item.event.wait(self.timeout):
+            with self._cond:
+                queued = item in self._pending
+                if queued:
+                    self._pending.remove(item)
+            if queued:
+                # 还没进入任何批次，撤回后这一行不会再写入
+                raise TimeoutError(f"组提交超时: {table}")
+            # 已经在提交中的批次里：等待提交结果，避免报错后这一行仍然写入
+            item.event.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # 短暂等待更多并发写入加入本批次
+                deadline = time.monotonic() + self.max_delay
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            ids = self.flush_fn([(item.table, item.row) for item in batch])
+        except Exception as e:
+            if len(batch) > 1:
+                # 批次失败时逐行重试，避免一行错误拖累整批
+                print(f"⚠️ 组提交失败，逐行重试: {e}")
+                for item in batch:
+                    self._flush([item])
+                return
+            batch[0].error = e
+        else:
+            for item, row_id in zip(batch, ids):
+                item.result = row_id
+            self.metrics["batches"] += 1
+            self.metrics["rows"] += len(batch)
+            self.metrics["max_batch_size"] = max(self.metrics["max_batch_size"], len(batch))
+        for item in batch:
+            item.event.set()
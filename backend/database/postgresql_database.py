@@ -1,28 +1,176 @@
 # database/postgresql_database.py
 import os
+import time
+import threading
+from contextlib import contextmanager
 import psycopg2
+import psycopg2.pool
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from urllib.parse import urlparse
-from .base_database import BaseDatabase
+from .base_database import BaseDatabase, BucketFenced
+from .text_search import index_text, tsquery_expression
+from .archive_codec import pack_messages, unpack_messages, group_by_user
+from .result_set import ResultSet, iter_records
+from .statements import StatementRegistry
+from .replicas import ReplicaSet, RecentWrites
+
+# 数据库层使用的所有SQL：每个连接第一次用到时PREPARE，之后只发送EXECUTE
+STATEMENTS = StatementRegistry()
+STATEMENTS.register('create_user',
+    'INSERT INTO users (username, password_hash) VALUES (%s, %s) RETURNING id')
+STATEMENTS.register('create_user_with_id',
+    'INSERT INTO users (id, username, password_hash) VALUES (%s, %s, %s) RETURNING id')
+STATEMENTS.register('verify_user',
+    'SELECT id, username FROM users WHERE username = %s AND password_hash = %s')
+# 聊天记录的全文索引列：问题权重A、回答权重B，参数为分词后的问题和回答
+SEARCH_VECTOR = "setweight(to_tsvector('simple', %s::text), 'A') || setweight(to_tsvector('simple', %s::text), 'B')"
+# 新记录在INSERT时写入索引列，只有加上该列之前的旧记录需要补建
+STATEMENTS.register('index_chat_message',
+    f'''UPDATE chat_history SET search_vector = {SEARCH_VECTOR}
+       WHERE id = %s''', ('text', 'text', 'integer'))
+STATEMENTS.register('unindexed_chat_messages',
+    '''SELECT id, user_message, ai_response FROM chat_history 
+       WHERE search_vector IS NULL LIMIT %s FOR UPDATE SKIP LOCKED''')
+STATEMENTS.register('get_chat_history',
+    '''SELECT user_message, ai_response, timestamp, client_id 
+       FROM chat_history 
+       WHERE user_id = %s 
+       ORDER BY timestamp DESC LIMIT %s''')
+STATEMENTS.register('get_chat_messages',
+    '''SELECT id, user_message, ai_response, timestamp 
+       FROM chat_history 
+       WHERE user_id = %s AND id > %s 
+       ORDER BY id LIMIT %s''')
+STATEMENTS.register('get_chat_messages_by_ids',
+    '''SELECT id, user_message, ai_response, timestamp 
+       FROM chat_history 
+       WHERE user_id = %s AND id = ANY(%s)''', ('integer', 'integer[]'))
+STATEMENTS.register('search_chat_history',
+    '''SELECT id, user_message, ai_response, timestamp, 
+              ts_rank_cd(search_vector, q) AS rank
+       FROM chat_history, to_tsquery('simple', %s) q
+       WHERE user_id = %s AND search_vector @@ q
+       ORDER BY rank DESC, id DESC LIMIT %s OFFSET %s''')
+STATEMENTS.register('next_expired_chat_user',
+    '''SELECT user_id FROM chat_history 
+       WHERE timestamp < CURRENT_TIMESTAMP - %s * INTERVAL '1 day' 
+         AND user_id <> ALL(%s) AND mod(user_id, %s) <> ALL(%s) 
+       ORDER BY timestamp LIMIT 1''', ('integer', 'integer[]', 'integer', 'integer[]'))
+STATEMENTS.register('select_expired_chat_history',
+    '''SELECT id, user_id, user_message, ai_response, timestamp 
+       FROM chat_history 
+       WHERE user_id = %s AND timestamp < CURRENT_TIMESTAMP - %s * INTERVAL '1 day' 
+       ORDER BY id LIMIT %s 
+       FOR UPDATE SKIP LOCKED''', ('integer', 'integer', 'integer'))
+STATEMENTS.register('insert_chat_archive',
+    '''INSERT INTO chat_archive 
+       (user_id, first_id, last_id, first_timestamp, last_timestamp, message_count, codec, payload) 
+       VALUES (%s, %s, %s, %s, %s, %s, %s, %s)''')
+STATEMENTS.register('delete_chat_history',
+    'DELETE FROM chat_history WHERE id = ANY(%s)', ('integer[]',))
+STATEMENTS.register('get_archived_chat_history',
+    '''SELECT codec, payload FROM chat_archive 
+       WHERE user_id = %s AND (%s IS NULL OR first_id < %s) 
+       ORDER BY last_id DESC''', ('integer', 'integer', 'integer'))
+STATEMENTS.register('create_learning_goal',
+    '''INSERT INTO learning_goals 
+       (user_id, title, description, category, priority, target_date) 
+       VALUES (%s, %s, %s, %s, %s, %s) RETURNING id''')
+STATEMENTS.register('create_learning_goal_with_id',
+    '''INSERT INTO learning_goals 
+       (id, user_id, title, description, category, priority, target_date) 
+       VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id''')
+STATEMENTS.register('get_user_goals_by_status',
+    '''SELECT * FROM learning_goals 
+       WHERE user_id = %s AND status = %s 
+       ORDER BY priority DESC, created_at DESC''')
+STATEMENTS.register('get_user_goals',
+    '''SELECT * FROM learning_goals 
+       WHERE user_id = %s 
+       ORDER BY priority DESC, created_at DESC''')
+STATEMENTS.register('update_goal_status',
+    'UPDATE learning_goals SET status = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING user_id')
+STATEMENTS.register('delete_goal',
+    'DELETE FROM learning_goals WHERE id = %s RETURNING user_id')
+STATEMENTS.register('get_goal_progress',
+    '''SELECT 
+           COUNT(*) as total_goals,
+           SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed_goals,
+           SUM(CASE WHEN status = 'active' THEN 1 ELSE 0 END) as active_goals
+       FROM learning_goals 
+       WHERE user_id = %s''')
+STATEMENTS.register('get_study_sessions',
+    '''SELECT * FROM study_sessions 
+       WHERE user_id = %s AND session_date >= CURRENT_DATE - %s * INTERVAL '1 day'
+       ORDER BY session_date DESC, created_at DESC''', ('integer', 'integer'))
+STATEMENTS.register('get_study_total',
+    '''SELECT COALESCE(SUM(duration_minutes), 0) as total_minutes 
+       FROM study_sessions 
+       WHERE user_id = %s AND session_date >= CURRENT_DATE - %s * INTERVAL '1 day' ''', ('integer', 'integer'))
+STATEMENTS.register('get_subject_breakdown',
+    '''SELECT subject, SUM(duration_minutes) as total_minutes 
+       FROM study_sessions 
+       WHERE user_id = %s AND session_date >= CURRENT_DATE - %s * INTERVAL '1 day'
+       GROUP BY subject 
+       ORDER BY total_minutes DESC''', ('integer', 'integer'))
+STATEMENTS.register('get_goal_recommendations',
+    '''SELECT kind, name, score, based_on_kind, based_on_name, created_at 
+       FROM goal_recommendations 
+       WHERE user_id = %s 
+       ORDER BY score DESC''')
+
+
+class StatementConnection(psycopg2.extensions.connection):
+    """记录本连接上已经PREPARE过的语句名和借出它的连接池；discard为True时归还连接池时关闭"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.discard = False
+        self.pool = None
+
 
 class PostgreSQLDatabase(BaseDatabase):
-    def __init__(self, database_url):
+    placeholder = '%s'
+    share_lock = ' FOR SHARE'
+    
+    def __init__(self, database_url, replica_urls=None):
         self.database_url = database_url
-        self.connection = self.create_connection()
+        self.pool_min = int(os.getenv('DB_POOL_MIN', '1'))
+        self.pool_max = int(os.getenv('DB_POOL_MAX', '10'))
+        # 经过PgBouncer等事务级连接池时服务端预处理语句不可用，可设置 DB_PREPARED_STATEMENTS=0 关闭
+        self.prepare_statements = os.getenv('DB_PREPARED_STATEMENTS', '1') != '0'
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        
+        # 只读副本（逗号分隔）：按用户的只读查询在健康的副本之间轮询；
+        # 用户写入后 DB_READ_YOUR_WRITES_SECONDS 秒内该用户的读请求仍走主库
+        if replica_urls is None:
+            replica_urls = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+        self.replicas = ReplicaSet(replica_urls, self.create_pool) if replica_urls else None
+        self.recent_writes = RecentWrites(float(os.getenv('DB_READ_YOUR_WRITES_SECONDS', '10')))
         self.init_database()
     
+    def connect_params(self, database_url=None):
+        """从数据库URL解析连接参数（默认为主库DATABASE_URL）"""
+        result = urlparse(database_url or self.database_url)
+        return dict(
+            database=result.path[1:],  # 去掉开头的/
+            user=result.username,
+            password=result.password,
+            host=result.hostname,
+            port=result.port,
+            sslmode='require',  # Railway需要SSL
+            connection_factory=StatementConnection
+        )
+    
     def create_connection(self):
         """创建PostgreSQL连接 - 无需本地安装"""
         try:
-            result = urlparse(self.database_url)
-            
-            conn = psycopg2.connect(
-                database=result.path[1:],  # 去掉开头的/
-                user=result.username,
-                password=result.password,
-                host=result.hostname,
-                port=result.port,
-                sslmode='require'  # Railway需要SSL
-            )
+            conn = psycopg2.connect(**self.connect_params())
             conn.autocommit = False
             print("✅ PostgreSQL 连接成功")
             return conn
@@ -30,10 +178,75 @@ class PostgreSQLDatabase(BaseDatabase):
             print(f"❌ PostgreSQL 连接失败: {e}")
             raise
     
+    def create_pool(self, database_url=None):
+        return psycopg2.pool.ThreadedConnectionPool(
+            self.pool_min, self.pool_max, **self.connect_params(database_url)
+        )
+    
+    def get_pool(self):
+        """获取当前进程的连接池；fork之后子进程会创建自己的连接池，不复用父进程的连接"""
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = self.create_pool()
+                    self._pool_pid = os.getpid()
+                    print(f"✅ PostgreSQL 连接池创建成功 (进程 {self._pool_pid}, 最多 {self.pool_max} 个连接)")
+        return self._pool
+    
+    def close(self):
+        """关闭当前进程的连接池（预加载模式下主进程fork前调用）"""
+        with self._pool_lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.closeall()
+            self._pool = None
+            self._pool_pid = None
+        if self.replicas is not None:
+            self.replicas.close()
+    
+    def acquire(self, pool=None):
+        """从连接池（默认主库）借出一个连接，用完后调用 release 归还"""
+        pool = pool or self.get_pool()
+        conn = pool.getconn()
+        conn.pool = pool
+        return conn
+    
+    def release(self, conn):
+        """归还借出的连接，归还前回滚未提交的事务"""
+        if not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        conn.pool.putconn(conn, close=bool(conn.closed) or conn.discard)
+    
+    @contextmanager
+    def transaction(self):
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            self.release(conn)
+    
+    def set_id_floor(self, table, floor, ceiling=None):
+        self.check_identifier(table)
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table,))
+            sequence = cursor.fetchone()[0]
+            cursor.execute(f'SELECT last_value FROM {sequence}')
+            last_value = cursor.fetchone()[0]
+            if last_value < floor:
+                cursor.execute('SELECT setval(%s, %s)', (sequence, floor))
+            elif ceiling is not None and last_value > ceiling:
+                raise ValueError(f"{table} 已分配的ID {last_value} 超出区间上限 {ceiling}")
+            if ceiling is not None:
+                # 区间用完时 nextval 报错，不会分配到下一个分片的区间
+                cursor.execute(f'ALTER SEQUENCE {sequence} MAXVALUE {int(ceiling)}')
+            cursor.close()
+    
     def init_database(self):
         """初始化PostgreSQL表"""
+        conn = self.acquire()
         try:
-            cursor = self.connection.cursor()
+            cursor = conn.cursor()
             
             # 用户表
             cursor.execute('''
@@ -86,185 +299,482 @@ class PostgreSQLDatabase(BaseDatabase):
                 )
             ''')
             
+            # 聊天记录归档表（按用户分批压缩存储）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS chat_archive (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                    first_id INTEGER NOT NULL,
+                    last_id INTEGER NOT NULL,
+                    first_timestamp TIMESTAMP,
+                    last_timestamp TIMESTAMP,
+                    message_count INTEGER NOT NULL,
+                    codec VARCHAR(10) NOT NULL,
+                    payload BYTEA NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # 推荐目标表（由离线任务生成）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS goal_recommendations (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                    kind VARCHAR(20) NOT NULL,
+                    name VARCHAR(100) NOT NULL,
+                    score REAL NOT NULL,
+                    based_on_kind VARCHAR(20),
+                    based_on_name VARCHAR(100),
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
             # 创建索引
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_archive_user ON chat_archive(user_id, last_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_user ON chat_history(user_id)')
+            # 归档任务按时间找出有过期记录的用户
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_timestamp ON chat_history(timestamp)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_goals_user ON learning_goals(user_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_user_date ON study_sessions(user_id, session_date)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_recommendations_user ON goal_recommendations(user_id)')
+            # 离线任务按时间水位查找有新数据的用户
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_created ON study_sessions(created_at)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_goals_updated ON learning_goals(updated_at)')
+            
+            # 聊天记录全文索引（中文按n-gram分词后使用simple配置）
+            cursor.execute('ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS search_vector tsvector')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_search ON chat_history USING GIN (search_vector)')
+            # 只包含还没有索引的旧记录，启动时查找待补建的记录不需要扫描全表
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_unindexed ON chat_history(id) WHERE search_vector IS NULL')
+            
+            # 提交方生成的唯一ID：后台任务重放时不会重复插入同一条记录
+            cursor.execute('ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS client_id VARCHAR(64)')
+            cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_client ON chat_history(client_id)')
             
-            self.connection.commit()
+            conn.commit()
             cursor.close()
+            self.backfill_search_index()
             print("✅ PostgreSQL 表初始化完成")
             
         except Exception as e:
             print(f"❌ PostgreSQL 表初始化失败: {e}")
-            self.connection.rollback()
+            conn.rollback()
+        finally:
+            self.release(conn)
     
     def execute_query(self, query, params=None, fetch=True):
         """执行查询的辅助方法"""
-        cursor = self.connection.cursor()
+        conn = self.acquire()
+        cursor = conn.cursor()
         try:
             cursor.execute(query, params)
             if fetch:
                 if cursor.description:
-                    columns = [desc[0] for desc in cursor.description]
-                    results = [dict(zip(columns, row)) for row in cursor.fetchall()]
-                    return results
+                    return ResultSet.from_cursor(cursor)
                 else:
-                    self.connection.commit()
+                    conn.commit()
                     return cursor.rowcount
             else:
-                self.connection.commit()
+                conn.commit()
                 return None
         except Exception as e:
-            self.connection.rollback()
+            conn.rollback()
             raise e
         finally:
             cursor.close()
+            self.release(conn)
+    
+    def choose_replica(self, user_id):
+        """为用户的只读查询选择副本；用户刚写入过或没有健康的副本时返回None（使用主库）"""
+        if self.replicas is None:
+            return None
+        replica = None if self.recent_writes.is_recent(user_id) else self.replicas.choose()
+        self.replicas.metrics["replica_reads" if replica is not None else "primary_reads"] += 1
+        return replica
+    
+    def execute_read(self, name, params, user_id):
+        """执行只读语句：优先发往只读副本，副本连接失败时摘除该副本并改用主库"""
+        replica = self.choose_replica(user_id)
+        if replica is not None:
+            try:
+                return self.execute_statement(name, params, pool=self.replicas.get_pool(replica))
+            except psycopg2.OperationalError as e:
+                self.replicas.mark_failed(replica, e)
+        return self.execute_statement(name, params)
+    
+    def execute_statement(self, name, params=(), fetch=True, pool=None):
+        """执行登记过的语句，返回值与 execute_query 相同"""
+        conn = self.acquire(pool)
+        cursor = conn.cursor()
+        try:
+            self.run_statement(cursor, name, params)
+            if fetch:
+                if cursor.description:
+                    return ResultSet.from_cursor(cursor)
+                else:
+                    conn.commit()
+                    return cursor.rowcount
+            else:
+                conn.commit()
+                return None
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            cursor.close()
+            self.release(conn)
+    
+    def run_statement(self, cursor, statement, params=()):
+        """在游标上执行登记的语句：该连接第一次使用时先PREPARE，之后只发送EXECUTE"""
+        if isinstance(statement, str):
+            statement = STATEMENTS.get(statement)
+        conn = cursor.connection
+        try:
+            if self.prepare_statements:
+                if statement.name not in conn.prepared:
+                    cursor.execute(statement.prepare_sql)
+                    conn.prepared.add(statement.name)
+                start = time.perf_counter()
+                cursor.execute(statement.execute_sql, params)
+            else:
+                start = time.perf_counter()
+                cursor.execute(statement.sql, params)
+        except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.FeatureNotSupported):
+            # 预处理语句丢失或表结构变化导致缓存的计划失效：归还时关闭该连接，连接池会换一个新连接
+            conn.discard = True
+            raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if STATEMENTS.record(statement, elapsed_ms):
+            self._log_slow_query(conn, statement, params, elapsed_ms)
+    
+    def _log_slow_query(self, conn, statement, params, elapsed_ms):
+        """记录慢查询及其执行计划；EXPLAIN放在保存点内，失败不影响当前事务"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SAVEPOINT explain_slow_query')
+            if self.prepare_statements:
+                cursor.execute('EXPLAIN ' + statement.execute_sql, params)
+            else:
+                cursor.execute('EXPLAIN ' + statement.sql, params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+            cursor.execute('RELEASE SAVEPOINT explain_slow_query')
+        except Exception as e:
+            plan = f"EXPLAIN 失败: {e}"
+            try:
+                cursor.execute('ROLLBACK TO SAVEPOINT explain_slow_query')
+            except Exception:
+                pass
+        finally:
+            cursor.close()
+        STATEMENTS.add_slow_query(statement, elapsed_ms, plan)
+        print(f"🐢 慢查询 {statement.name}: {elapsed_ms:.1f}ms\n{plan}")
     
-    def create_user(self, username, password):
+    def get_metrics(self):
+        metrics = super().get_metrics()
+        metrics["prepared_statements"] = self.prepare_statements
+        metrics.update(STATEMENTS.get_metrics())
+        if self.replicas is not None:
+            metrics["read_replicas"] = self.replicas.get_metrics()
+        return metrics
+    
+    def create_user(self, username, password, user_id=None):
+        conn = self.acquire()
+        cursor = None
         try:
             password_hash = self.hash_password(password)
-            cursor = self.connection.cursor()
-            cursor.execute(
-                'INSERT INTO users (username, password_hash) VALUES (%s, %s) RETURNING id',
-                (username, password_hash)
-            )
+            cursor = conn.cursor()
+            if user_id is None:
+                self.run_statement(cursor, 'create_user', (username, password_hash))
+            else:
+                self.run_statement(cursor, 'create_user_with_id', (user_id, username, password_hash))
             user_id = cursor.fetchone()[0]
-            self.connection.commit()
+            self.check_fence(cursor, user_id)
+            conn.commit()
             return user_id
         except Exception as e:
             if "unique constraint" in str(e).lower():
                 return None  # 用户名已存在
             raise e
         finally:
-            cursor.close()
+            if cursor is not None:
+                cursor.close()
+            self.release(conn)
     
     def verify_user(self, username, password):
         password_hash = self.hash_password(password)
-        results = self.execute_query(
-            'SELECT id, username FROM users WHERE username = %s AND password_hash = %s',
-            (username, password_hash)
-        )
+        results = self.execute_statement('verify_user', (username, password_hash))
         return results[0] if results else None
     
-    def add_chat_message(self, user_id, user_message, ai_response):
-        self.execute_query(
-            'INSERT INTO chat_history (user_id, user_message, ai_response) VALUES (%s, %s, %s)',
-            (user_id, user_message, ai_response),
-            fetch=False
+    def insert_rows(self, items):
+        conn = self.acquire()
+        cursor = conn.cursor()
+        try:
+            ids = []
+            for table, row in items:
+                self.recent_writes.mark(row.get("user_id"))
+                row_id = self.existing_row_id(cursor, table, row)
+                if row_id is not None:
+                    ids.append(row_id)
+                    continue
+                params = tuple(row.values())
+                expressions = None
+                if table == 'chat_history':
+                    # 索引列随行一起插入：插入后再UPDATE会给每条聊天记录多写一个行版本和一份WAL
+                    expressions = {"search_vector": SEARCH_VECTOR}
+                    params += (index_text(row["user_message"]), index_text(row["ai_response"]))
+                statement = STATEMENTS.for_sql(
+                    f'insert_{table}', self.build_insert(table, row, '%s', expressions) + ' RETURNING id'
+                )
+                self.run_statement(cursor, statement, params)
+                row_id = cursor.fetchone()[0]
+                self.check_fence(cursor, row.get("user_id"))
+                ids.append(row_id)
+            conn.commit()
+            return ids
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            self.release(conn)
+    
+    def _index_chat_message(self, cursor, chat_id, user_message, ai_response):
+        self.run_statement(
+            cursor, 'index_chat_message',
+            (index_text(user_message), index_text(ai_response), chat_id)
         )
     
+    def backfill_search_index(self, batch_size=500):
+        """为加上索引列之前的旧聊天记录补建全文索引（多个进程同时启动时跳过彼此锁定的记录）"""
+        conn = self.acquire()
+        cursor = conn.cursor()
+        try:
+            total = 0
+            while True:
+                self.run_statement(cursor, 'unindexed_chat_messages', (batch_size,))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                for chat_id, user_message, ai_response in rows:
+                    self._index_chat_message(cursor, chat_id, user_message, ai_response)
+                conn.commit()
+                total += len(rows)
+            if total:
+                print(f"✅ 已为 {total} 条聊天记录补建全文索引")
+        except psycopg2.Error as e:
+            print(f"❌ 补建全文索引失败: {e}")
+            conn.rollback()
+        finally:
+            cursor.close()
+            self.release(conn)
+    
+    def add_chat_message(self, user_id, user_message, ai_response, client_id=None):
+        return self.group_insert('chat_history', {
+            "user_id": user_id,
+            "user_message": user_message,
+            "ai_response": ai_response,
+            "client_id": client_id
+        })
+    
     def get_chat_history(self, user_id, limit=10):
-        results = self.execute_query(
-            '''SELECT user_message, ai_response, timestamp 
-               FROM chat_history 
-               WHERE user_id = %s 
-               ORDER BY timestamp DESC LIMIT %s''',
-            (user_id, limit)
-        )
+        results = self.execute_read('get_chat_history', (user_id, limit), user_id)
         return results[::-1]  # 反转顺序
     
-    def create_learning_goal(self, user_id, title, description="", category="general", priority=2, target_date=None):
-        cursor = self.connection.cursor()
+    def get_chat_messages(self, user_id, after_id=0, limit=500):
+        return self.execute_read('get_chat_messages', (user_id, after_id, limit), user_id)
+    
+    def get_chat_messages_by_ids(self, user_id, chat_ids):
+        if not chat_ids:
+            return []
+        return self.execute_read('get_chat_messages_by_ids', (user_id, list(chat_ids)), user_id)
+    
+    def search_chat_history(self, user_id, query, limit=20, offset=0):
+        expression = tsquery_expression(query)
+        if not expression:
+            return []
+        return self.execute_read('search_chat_history', (expression, user_id, limit, offset), user_id)
+    
+    def archive_chat_history(self, older_than_days, batch_size=500):
+        conn = self.acquire()
+        cursor = conn.cursor()
+        try:
+            # 迁移中的分桶不归档，避免复制期间在原分片上搬动记录
+            fenced = sorted(self.fenced_buckets(cursor))
+            # 按用户取过期记录：同一用户的记录压缩成一个归档块，块越大压缩率越高
+            rows = []
+            seen = []
+            while len(rows) < batch_size:
+                self.run_statement(cursor, 'next_expired_chat_user',
+                                   (older_than_days, seen, self.fence_buckets or 1, fenced))
+                found = cursor.fetchone()
+                if found is None:
+                    break
+                seen.append(found[0])
+                # SKIP LOCKED 让多个归档任务并发时各自处理不同的记录
+                self.run_statement(cursor, 'select_expired_chat_history', (found[0], older_than_days, batch_size))
+                columns = [desc[0] for desc in cursor.description]
+                rows.extend(dict(zip(columns, row)) for row in cursor.fetchall())
+            if not rows:
+                conn.rollback()
+                return 0
+            
+            for user_id, messages in group_by_user(rows).items():
+                codec, payload = pack_messages([
+                    {key: row[key] for key in ("id", "user_message", "ai_response", "timestamp")}
+                    for row in messages
+                ])
+                self.run_statement(
+                    cursor, 'insert_chat_archive',
+                    (user_id, messages[0]["id"], messages[-1]["id"],
+                     messages[0]["timestamp"], messages[-1]["timestamp"], len(messages),
+                     codec, psycopg2.Binary(payload))
+                )
+            
+            self.run_statement(cursor, 'delete_chat_history', ([row["id"] for row in rows],))
+            conn.commit()
+            return len(rows)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            self.release(conn)
+    
+    def get_archived_chat_history(self, user_id, limit=50, before_id=None):
+        replica = self.choose_replica(user_id)
+        if replica is not None:
+            try:
+                return self._read_archived_chat_history(
+                    self.replicas.get_pool(replica), user_id, limit, before_id
+                )
+            except psycopg2.OperationalError as e:
+                self.replicas.mark_failed(replica, e)
+        return self._read_archived_chat_history(None, user_id, limit, before_id)
+    
+    def _read_archived_chat_history(self, pool, user_id, limit, before_id):
+        conn = self.acquire(pool)
+        cursor = conn.cursor()
+        try:
+            self.run_statement(cursor, 'get_archived_chat_history', (user_id, before_id, before_id))
+            messages = []
+            # 从最新的归档块开始逐块解压，凑够条数即停止
+            while True:
+                row = cursor.fetchone()
+                if row is None:
+                    break
+                batch = [m for m in unpack_messages(*row)
+                         if before_id is None or m["id"] < before_id]
+                messages = batch + messages
+                if len(messages) >= limit:
+                    break
+            conn.commit()
+            return messages[-limit:]
+        finally:
+            cursor.close()
+            self.release(conn)
+    
+    def create_learning_goal(self, user_id, title, description="", category="general", priority=2, target_date=None, goal_id=None):
+        conn = self.acquire()
+        cursor = conn.cursor()
         try:
-            cursor.execute(
-                '''INSERT INTO learning_goals 
-                   (user_id, title, description, category, priority, target_date) 
-                   VALUES (%s, %s, %s, %s, %s, %s) RETURNING id''',
-                (user_id, title, description, category, priority, target_date)
-            )
+            self.recent_writes.mark(user_id)
+            if goal_id is None:
+                self.run_statement(
+                    cursor, 'create_learning_goal',
+                    (user_id, title, description, category, priority, target_date)
+                )
+            else:
+                self.run_statement(
+                    cursor, 'create_learning_goal_with_id',
+                    (goal_id, user_id, title, description, category, priority, target_date)
+                )
             goal_id = cursor.fetchone()[0]
-            self.connection.commit()
+            self.check_fence(cursor, user_id)
+            conn.commit()
             return goal_id
         finally:
             cursor.close()
+            self.release(conn)
     
     def get_user_goals(self, user_id, status=None):
         if status:
-            return self.execute_query(
-                '''SELECT * FROM learning_goals 
-                   WHERE user_id = %s AND status = %s 
-                   ORDER BY priority DESC, created_at DESC''',
-                (user_id, status)
-            )
+            return self.execute_read('get_user_goals_by_status', (user_id, status), user_id)
         else:
-            return self.execute_query(
-                '''SELECT * FROM learning_goals 
-                   WHERE user_id = %s 
-                   ORDER BY priority DESC, created_at DESC''',
-                (user_id,)
-            )
+            return self.execute_read('get_user_goals', (user_id,), user_id)
+    
+    def _write_goal(self, name, params):
+        """按目标ID修改目标，并记录目标所属用户的写入时间"""
+        conn = self.acquire()
+        cursor = conn.cursor()
+        try:
+            self.run_statement(cursor, name, params)
+            for (user_id,) in cursor.fetchall():
+                self.recent_writes.mark(user_id)
+                self.check_fence(cursor, user_id)
+            conn.commit()
+        finally:
+            cursor.close()
+            self.release(conn)
     
     def update_goal_status(self, goal_id, status):
         try:
-            self.execute_query(
-                'UPDATE learning_goals SET status = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s',
-                (status, goal_id),
-                fetch=False
-            )
+            self._write_goal('update_goal_status', (status, goal_id))
             return True
-        except:
+        except BucketFenced:
+            raise
+        except Exception as e:
+            print(f"更新目标状态失败: {e}")
             return False
     
     def delete_goal(self, goal_id):
         try:
-            self.execute_query('DELETE FROM learning_goals WHERE id = %s', (goal_id,), fetch=False)
+            self._write_goal('delete_goal', (goal_id,))
             return True
-        except:
+        except BucketFenced:
+            raise
+        except Exception as e:
+            print(f"删除目标失败: {e}")
             return False
     
     def get_goal_progress(self, user_id):
-        results = self.execute_query('''
-            SELECT 
-                COUNT(*) as total_goals,
-                SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed_goals,
-                SUM(CASE WHEN status = 'active' THEN 1 ELSE 0 END) as active_goals
-            FROM learning_goals 
-            WHERE user_id = %s
-        ''', (user_id,))
+        results = self.execute_read('get_goal_progress', (user_id,), user_id)
         return results[0] if results else {"total_goals": 0, "completed_goals": 0, "active_goals": 0}
     
     def add_study_session(self, user_id, subject, duration_minutes, goal_id=None, notes=""):
-        cursor = self.connection.cursor()
+        return self.group_insert('study_sessions', {
+            "user_id": user_id,
+            "goal_id": goal_id,
+            "subject": subject,
+            "duration_minutes": duration_minutes,
+            "notes": notes
+        })
+    
+    def get_study_sessions(self, user_id, days=7):
+        return self.execute_read('get_study_sessions', (user_id, days), user_id)
+    
+    def iter_study_sessions(self, user_id, days=7):
+        # 服务端游标分批取数，大结果集不会一次性传到客户端；流式读取中途无法切换到主库重试
+        replica = self.choose_replica(user_id)
+        pool = self.replicas.get_pool(replica) if replica is not None else None
+        conn = self.acquire(pool)
+        # 服务端游标只能用于普通SQL，不能声明在预处理语句上
+        cursor = conn.cursor(name='iter_study_sessions')
+        cursor.itersize = 500
         try:
-            cursor.execute(
-                '''INSERT INTO study_sessions 
-                   (user_id, goal_id, subject, duration_minutes, notes) 
-                   VALUES (%s, %s, %s, %s, %s) RETURNING id''',
-                (user_id, goal_id, subject, duration_minutes, notes)
-            )
-            session_id = cursor.fetchone()[0]
-            self.connection.commit()
-            return session_id
+            cursor.execute(STATEMENTS.get('get_study_sessions').sql, (user_id, days))
+            yield from iter_records(cursor)
         finally:
             cursor.close()
-    
-    def get_study_sessions(self, user_id, days=7):
-        return self.execute_query(
-            '''SELECT * FROM study_sessions 
-               WHERE user_id = %s AND session_date >= CURRENT_DATE - INTERVAL '%s days'
-               ORDER BY session_date DESC, created_at DESC''',
-            (user_id, days)
-        )
+            self.release(conn)
     
     def get_study_statistics(self, user_id, days=30):
-        total_result = self.execute_query(
-            '''SELECT COALESCE(SUM(duration_minutes), 0) as total_minutes 
-               FROM study_sessions 
-               WHERE user_id = %s AND session_date >= CURRENT_DATE - INTERVAL '%s days''',
-            (user_id, days)
-        )
-        
-        subject_results = self.execute_query(
-            '''SELECT subject, SUM(duration_minutes) as total_minutes 
-               FROM study_sessions 
-               WHERE user_id = %s AND session_date >= CURRENT_DATE - INTERVAL '%s days'
-               GROUP BY subject 
-               ORDER BY total_minutes DESC''',
-            (user_id, days)
-        )
+        total_result = self.execute_read('get_study_total', (user_id, days), user_id)
+        subject_results = self.execute_read('get_subject_breakdown', (user_id, days), user_id)
         
         return {
             "total_minutes": total_result[0]["total_minutes"] if total_result else 0,
             "subject_breakdown": subject_results
-        }
\ No newline at end of file
+        }
+    
+    def get_goal_recommendations(self, user_id):
+        return self.execute_read('get_goal_recommendations', (user_id,), user_id)
@@ -0,0 +1,185 @@
+import os
+import mmap
+import time
+import zlib
+import struct
+import itertools
+import threading
+
+# 副本健康检查：是否处于恢复（只读）状态，以及回放延迟（秒）；已回放完收到的全部WAL时视为无延迟
+REPLICA_STATUS_SQL = '''
+    SELECT pg_is_in_recovery(),
+           CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END
+'''
+
+
+class RecentWrites:
+    """按用户记录最近一次写入的时间，用于"读自己的写"
+
+    时间戳保存在匿名共享内存里：预加载模式下主进程创建数据库实例后再fork，
+    所有工作进程看到同一份记录，在任一进程写入后其他进程也会把该用户的读请求发往主库。
+    用户按哈希分到固定数量的槽位，冲突只会让少数读请求多走主库。
+    """
+    _SLOT = struct.Struct('d')
+
+    def __init__(self, window, slots=65536):
+        self.window = window
+        self.slots = slots
+        self._buffer = mmap.mmap(-1, slots * self._SLOT.size)
+
+    def _offset(self, user_id):
+        try:
+            slot = int(user_id) % self.slots
+        except (TypeError, ValueError):
+            slot = zlib.crc32(str(user_id).encode('utf-8')) % self.slots
+        return slot * self._SLOT.size
+
+    def mark(self, user_id):
+        if user_id is not None:
+            self._SLOT.pack_into(self._buffer, self._offset(user_id), time.time())
+
+    def is_recent(self, user_id):
+        if user_id is None:
+            return False
+        last_write, = self._SLOT.unpack_from(self._buffer, self._offset(user_id))
+        return time.time() - last_write < self.window
+
+
+class Replica:
+    """一个只读副本：每个进程各自的连接池，以及最近一次健康检查的结果"""
+    __slots__ = ('url', 'name', 'healthy', 'lag', 'last_error', 'failures', '_pool', '_pool_pid')
+
+    def __init__(self, url, name):
+        self.url = url
+        self.name = name
+        # 第一次健康检查通过之前不接收读请求
+        self.healthy = False
+        self.lag = None
+        self.last_error = None
+        self.failures = 0
+        self._pool = None
+        self._pool_pid = None
+
+
+class ReplicaSet:
+    """只读副本集合：在健康的副本之间轮询分配读请求，后台定期检查连通性和复制延迟
+
+    pool_factory(url) 创建连接池；副本连接失败或延迟超过 max_lag 秒时暂时摘除，恢复后自动加回。
+    """
+
+    def __init__(self, urls, pool_factory, max_lag=None, check_interval=None):
+        self.replicas = [Replica(url, f"replica{i}") for i, url in enumerate(urls)]
+        self.pool_factory = pool_factory
+        self.max_lag = max_lag if max_lag is not None else float(os.getenv('DB_REPLICA_MAX_LAG', '5'))
+        self.check_interval = check_interval or float(os.getenv('DB_REPLICA_CHECK_INTERVAL', '5'))
+        self.metrics = {"replica_reads": 0, "primary_reads": 0, "fallbacks": 0}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+
+    def get_pool(self, replica):
+        """获取副本在当前进程的连接池（fork之后重新创建）"""
+        if replica._pool is None or replica._pool_pid != os.getpid():
+            with self._lock:
+                if replica._pool is None or replica._pool_pid != os.getpid():
+                    replica._pool = self.pool_factory(replica.url)
+                    replica._pool_pid = os.getpid()
+        return replica._pool
+
+    def start(self):
+        """启动后台健康检查线程（每个进程一个）"""
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(target=self._loop, name="replica-health", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            self.check_all()
+            self._stopping.wait(self.check_interval)
+
+    def check_all(self):
+        for replica in self.replicas:
+            self.check(replica)
+
+    def check(self, replica):
+        pool = None
+        conn = None
+        try:
+            pool = self.get_pool(replica)
+            conn = pool.getconn()
+            cursor = conn.cursor()
+            cursor.execute(REPLICA_STATUS_SQL)
+            in_recovery, lag = cursor.fetchone()
+            cursor.close()
+            conn.rollback()
+            replica.lag = float(lag)
+            if not in_recovery:
+                # 副本被提升为主库后不再作为只读副本使用
+                self._set_health(replica, False, "不再处于只读恢复状态")
+            elif replica.lag > self.max_lag:
+                self._set_health(replica, False, f"复制延迟 {replica.lag:.1f}s 超过 {self.max_lag}s")
+            else:
+                self._set_health(replica, True, None)
+        except Exception as e:
+            self._set_health(replica, False, str(e))
+        finally:
+            if conn is not None:
+                pool.putconn(conn, close=bool(conn.closed))
+
+    def _set_health(self, replica, healthy, error):
+        if healthy != replica.healthy:
+            if healthy:
+                print(f"✅ 只读副本 {replica.name} 已加入读负载")
+            else:
+                print(f"⚠️ 只读副本 {replica.name} 已摘除: {error}")
+        replica.healthy = healthy
+        replica.last_error = error
+        if not healthy:
+            replica.failures += 1
+
+    def choose(self):
+        """轮询选择一个健康的副本；没有可用副本时返回None"""
+        self.start()
+        healthy = [r for r in self.replicas if r.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)]
+
+    def mark_failed(self, replica, error):
+        """读请求在副本上连接失败：立即摘除，等待下一次健康检查恢复"""
+        self._set_health(replica, False, str(error))
+        self.metrics["fallbacks"] += 1
+
+    def stop(self):
+        self._stopping.set()
+
+    def close(self):
+        """关闭当前进程持有的副本连接池"""
+        self.stop()
+        with self._lock:
+            for replica in self.replicas:
+                if replica._pool is not None and replica._pool_pid == os.getpid():
+                    replica._pool.closeall()
+                replica._pool = None
+                replica._pool_pid = None
+            self._thread = None
+            self._pid = None
+
+    def get_metrics(self):
+        return dict(self.metrics, replicas=[{
+            "name": r.name,
+            "healthy": r.healthy,
+            "lag_seconds": r.lag,
+            "failures": r.failures,
+            "last_error": r.last_error
+        } for r in self.replicas])
@@ -0,0 +1,86 @@
+from collections.abc import Mapping, Sequence
+
+
+class Record(Mapping):
+    """一行查询结果：只保存值元组，列名到下标的映射由整个结果集共享
+
+    支持 record["列名"]、get()、keys()/items()、dict(record)，可以直接替代原来的dict行。
+    """
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def to_dict(self):
+        return dict(zip(self._index, self._values))
+
+    def __repr__(self):
+        return f"Record({self.to_dict()!r})"
+
+
+class ResultSet(Sequence):
+    """紧凑的查询结果集：列名只保存一份，每行是一个元组
+
+    按下标访问或遍历时才创建轻量的Record；切片返回共享列信息的新结果集。
+    序列化时由 responses 直接把元组转换为JSON对象，不再保留整份dict列表。
+    """
+    __slots__ = ('columns', 'rows', '_index')
+
+    def __init__(self, columns, rows, index=None):
+        self.columns = tuple(columns)
+        self.rows = rows
+        self._index = index if index is not None else {name: i for i, name in enumerate(self.columns)}
+
+    @classmethod
+    def from_cursor(cls, cursor):
+        """从已执行查询的游标读取全部结果（行须为元组/可按下标访问）"""
+        return cls([desc[0] for desc in cursor.description], cursor.fetchall())
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return ResultSet(self.columns, self.rows[i], self._index)
+        return Record(self._index, self.rows[i])
+
+    def __iter__(self):
+        index = self._index
+        for values in self.rows:
+            yield Record(index, values)
+
+    def column(self, name):
+        """取出一列的所有值"""
+        i = self._index[name]
+        return [values[i] for values in self.rows]
+
+    def to_dicts(self):
+        columns = self.columns
+        return [dict(zip(columns, values)) for values in self.rows]
+
+    def __repr__(self):
+        return f"<ResultSet {len(self.rows)} 行 x {len(self.columns)} 列>"
+
+
+def iter_records(cursor, batch_size=500):
+    """分批从游标读取结果并逐行产出Record，不在内存中保存完整结果"""
+    rows = cursor.fetchmany(batch_size)
+    # 服务端游标在第一次取数之后才有列信息
+    index = {desc[0]: i for i, desc in enumerate(cursor.description)}
+    while rows:
+        for values in rows:
+            yield Record(index, values)
+        rows = cursor.fetchmany(batch_size)
@@ -0,0 +1,573 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from .base_database import BaseDatabase, BucketFenced
+
+# 迁移一个分桶时按顺序复制的表及其分片键（删除时倒序，先删子表）
+BUCKET_TABLES = [
+    ('users', 'id'),
+    ('learning_goals', 'user_id'),
+    ('study_sessions', 'user_id'),
+    ('chat_history', 'user_id'),
+    ('chat_archive', 'user_id'),
+    ('goal_recommendations', 'user_id'),
+]
+# 自增ID的表：每个分片使用互不重叠的ID区间，迁移时可以原样复制ID
+RANGED_TABLES = ('chat_history', 'study_sessions', 'chat_archive')
+# ID不被其他数据引用的表：复制时不带ID，由目标分片重新生成
+RENUMBERED_TABLES = ('goal_recommendations',)
+# 复制时不带过去的列（由目标分片重新生成）
+DERIVED_COLUMNS = ('search_vector',)
+
+
+def open_database(url, replica_urls=None):
+    """按URL打开一个数据库：postgresql://... 或 sqlite:///文件路径"""
+    if url.startswith('postgresql://'):
+        from .postgresql_database import PostgreSQLDatabase
+        return PostgreSQLDatabase(url, replica_urls=replica_urls or [])
+    if url.startswith('sqlite:///'):
+        from .sqlite_database import SQLiteDatabase
+        return SQLiteDatabase(url[len('sqlite:///'):])
+    raise ValueError(f"不支持的数据库URL: {url}")
+
+
+def parse_shards(spec):
+    """解析 DATABASE_SHARDS：逗号分隔的分片，每个分片可以用 | 附带只读副本URL"""
+    shards = []
+    for item in spec.split(','):
+        urls = [url.strip() for url in item.split('|') if url.strip()]
+        if urls:
+            shards.append((urls[0], urls[1:]))
+    return shards
+
+
+def _is_integrity_error(error):
+    return any(cls.__name__ == 'IntegrityError' for cls in type(error).__mro__)
+
+
+class ShardDirectory:
+    """分片目录：用户名到用户ID、全局ID分配、分桶到分片的映射，保存在目录库中"""
+
+    def __init__(self, database):
+        self.database = database
+        self.init_tables()
+
+    def execute(self, conn, sql, params=()):
+        cursor = conn.cursor()
+        cursor.execute(self.database._sql(sql), params)
+        return cursor
+
+    def init_tables(self):
+        with self.database.transaction() as conn:
+            self.execute(conn, '''
+                CREATE TABLE IF NOT EXISTS shard_users (
+                    username VARCHAR(50) PRIMARY KEY,
+                    user_id BIGINT NOT NULL
+                )
+            ''')
+            self.execute(conn, '''
+                CREATE TABLE IF NOT EXISTS shard_sequences (
+                    name VARCHAR(50) PRIMARY KEY,
+                    next_id BIGINT NOT NULL
+                )
+            ''')
+            self.execute(conn, '''
+                CREATE TABLE IF NOT EXISTS shard_buckets (
+                    bucket INTEGER PRIMARY KEY,
+                    shard INTEGER NOT NULL,
+                    state VARCHAR(20) NOT NULL DEFAULT 'active'
+                )
+            ''')
+            # 迁移进度：迁移工具每完成一步加一，等待写入的请求据此判断迁移是否还在进行
+            self.execute(conn, '''
+                CREATE TABLE IF NOT EXISTS shard_moves (
+                    bucket INTEGER PRIMARY KEY,
+                    progress BIGINT NOT NULL
+                )
+            ''')
+            # 启用分片之前创建的目标，其ID不带分桶编码，单独记录所属分桶
+            self.execute(conn, '''
+                CREATE TABLE IF NOT EXISTS shard_goal_buckets (
+                    goal_id BIGINT PRIMARY KEY,
+                    bucket INTEGER NOT NULL
+                )
+            ''')
+
+    def init_buckets(self, num_buckets, num_shards):
+        """第一次启用时把分桶平均分配到各分片；已有映射时校验分桶数量没有变化"""
+        with self.database.transaction() as conn:
+            count = self.execute(conn, 'SELECT COUNT(*) FROM shard_buckets').fetchone()[0]
+            if count == 0:
+                for bucket in range(num_buckets):
+                    self.execute(conn, 'INSERT INTO shard_buckets (bucket, shard) VALUES (?, ?)',
+                                 (bucket, bucket % num_shards))
+            elif count != num_buckets:
+                raise ValueError(f"目录中已有 {count} 个分桶，与 DB_SHARD_BUCKETS={num_buckets} 不一致")
+
+    def load_buckets(self):
+        """返回 [(shard, state), ...]，下标为分桶号"""
+        with self.database.transaction() as conn:
+            rows = self.execute(conn, 'SELECT bucket, shard, state FROM shard_buckets ORDER BY bucket').fetchall()
+        return [(shard, state) for _, shard, state in rows]
+
+    def set_bucket(self, bucket, shard, state):
+        with self.database.transaction() as conn:
+            self.execute(conn, 'UPDATE shard_buckets SET shard = ?, state = ? WHERE bucket = ?',
+                         (shard, state, bucket))
+
+    def touch_move(self, bucket):
+        with self.database.transaction() as conn:
+            cursor = self.execute(conn, 'UPDATE shard_moves SET progress = progress + 1 WHERE bucket = ?', (bucket,))
+            if cursor.rowcount == 0:
+                self.execute(conn, 'INSERT INTO shard_moves (bucket, progress) VALUES (?, ?)', (bucket, 1))
+
+    def move_progress(self, bucket):
+        with self.database.transaction() as conn:
+            row = self.execute(conn, 'SELECT progress FROM shard_moves WHERE bucket = ?', (bucket,)).fetchone()
+        return row[0] if row else 0
+
+    def allocate_id(self, name):
+        """全局唯一ID：目录库中的计数器加一（行锁保证并发安全）"""
+        with self.database.transaction() as conn:
+            cursor = self.execute(conn, 'UPDATE shard_sequences SET next_id = next_id + 1 WHERE name = ?', (name,))
+            if cursor.rowcount == 0:
+                self.execute(conn, 'INSERT INTO shard_sequences (name, next_id) VALUES (?, ?)', (name, 1))
+            return self.execute(conn, 'SELECT next_id FROM shard_sequences WHERE name = ?', (name,)).fetchone()[0]
+
+    def raise_sequence(self, name, value):
+        """保证之后分配的ID大于value（接管已有数据时使用）"""
+        with self.database.transaction() as conn:
+            cursor = self.execute(conn, 'UPDATE shard_sequences SET next_id = ? WHERE name = ? AND next_id < ?',
+                                  (value, name, value))
+            if cursor.rowcount == 0 and self.execute(
+                    conn, 'SELECT 1 FROM shard_sequences WHERE name = ?', (name,)).fetchone() is None:
+                self.execute(conn, 'INSERT INTO shard_sequences (name, next_id) VALUES (?, ?)', (name, value))
+
+    def register_user(self, username, user_id):
+        """登记用户名；用户名已存在时返回False"""
+        try:
+            with self.database.transaction() as conn:
+                self.execute(conn, 'INSERT INTO shard_users (username, user_id) VALUES (?, ?)', (username, user_id))
+            return True
+        except Exception as e:
+            if _is_integrity_error(e):
+                return False
+            raise
+
+    def unregister_user(self, username):
+        with self.database.transaction() as conn:
+            self.execute(conn, 'DELETE FROM shard_users WHERE username = ?', (username,))
+
+    def lookup_user(self, username):
+        with self.database.transaction() as conn:
+            row = self.execute(conn, 'SELECT user_id FROM shard_users WHERE username = ?', (username,)).fetchone()
+        return row[0] if row else None
+
+    def set_goal_bucket(self, goal_id, bucket):
+        with self.database.transaction() as conn:
+            if self.execute(conn, 'SELECT 1 FROM shard_goal_buckets WHERE goal_id = ?', (goal_id,)).fetchone() is None:
+                self.execute(conn, 'INSERT INTO shard_goal_buckets (goal_id, bucket) VALUES (?, ?)', (goal_id, bucket))
+
+    def lookup_goal_bucket(self, goal_id):
+        with self.database.transaction() as conn:
+            row = self.execute(conn, 'SELECT bucket FROM shard_goal_buckets WHERE goal_id = ?', (goal_id,)).fetchone()
+        return row[0] if row else None
+
+
+class ShardedDatabase(BaseDatabase):
+    """按用户ID水平分片：user_id % 分桶数 决定分桶，目录库记录每个分桶所在的分片
+
+    - 用户ID、目标ID由目录库全局分配；目标ID编码了所属分桶（seq * 分桶数 + 分桶），
+      只带目标ID的接口（更新/删除目标）也能路由到正确的分片。
+    - 其余自增ID在每个分片使用互不重叠的区间，迁移分桶时原样复制。
+    - 迁移中的分桶暂停写入（写请求等待迁移完成），读请求仍然发往原分片；
+      复制前在原分片上封锁该分桶，已经通过路由、还在排队的写入会被拒绝并重新路由。
+    """
+
+    def __init__(self, shards, directory_url=None, num_buckets=None):
+        self.num_buckets = num_buckets or int(os.getenv('DB_SHARD_BUCKETS', '64'))
+        self.id_span = int(os.getenv('DB_SHARD_ID_SPAN', '100000000'))
+        self.map_ttl = float(os.getenv('DB_SHARD_MAP_TTL', '2'))
+        # 迁移持续这么多秒没有进展时（迁移工具可能已退出），等待的写入报错
+        self.freeze_wait = float(os.getenv('DB_SHARD_FREEZE_WAIT', '10'))
+        self.shards = [open_database(url, replicas) for url, replicas in shards]
+        self.directory = ShardDirectory(open_database(directory_url) if directory_url else self.shards[0])
+        self._buckets = None
+        self._buckets_loaded = 0
+        self._lock = threading.Lock()
+        self.init_database()
+
+    def create_connection(self):
+        return self.shards[0].create_connection()
+
+    @contextmanager
+    def transaction(self, user_id=None):
+        """在用户所在的分片上开启事务（分片之间没有共同的事务，必须指定用户）
+
+        分桶迁移中时等待迁移完成；事务中的写入需要自行调用 check_fence。
+        """
+        if user_id is None:
+            raise ValueError("分片数据库的事务需要指定用户ID")
+        with self.writer(user_id).transaction() as conn:
+            yield conn
+
+    def id_range(self, index):
+        """分片 index 自动分配的ID区间 (floor, ceiling]"""
+        return index * self.id_span, (index + 1) * self.id_span
+
+    def set_id_floor(self, table, floor, ceiling=None):
+        """在每个分片自己的ID区间内设置下限（floor、ceiling为相对区间起点的偏移）"""
+        for index, shard in enumerate(self.shards):
+            start, end = self.id_range(index)
+            shard.set_id_floor(table, start + floor, end if ceiling is None else min(start + ceiling, end))
+
+    def init_database(self):
+        self.directory.init_buckets(self.num_buckets, len(self.shards))
+        for index, shard in enumerate(self.shards):
+            shard.init_fences(self.num_buckets)
+        for table in RANGED_TABLES:
+            self.set_id_floor(table, 0)
+        buckets = self.buckets(refresh=True)
+        missing = {shard for shard, _ in buckets if shard >= len(self.shards)}
+        if missing:
+            raise ValueError(f"分桶映射引用了未配置的分片: {sorted(missing)}")
+        print(f"✅ 分片数据库初始化完成: {len(self.shards)} 个分片, {self.num_buckets} 个分桶")
+
+    # ========== 路由 ==========
+    def buckets(self, refresh=False):
+        """分桶映射（按 DB_SHARD_MAP_TTL 秒缓存，迁移工具修改后各进程在TTL内生效）"""
+        if refresh or self._buckets is None or time.monotonic() - self._buckets_loaded > self.map_ttl:
+            with self._lock:
+                self._buckets = self.directory.load_buckets()
+                self._buckets_loaded = time.monotonic()
+        return self._buckets
+
+    def bucket_of(self, user_id):
+        return int(user_id) % self.num_buckets
+
+    def goal_bucket(self, goal_id):
+        bucket = self.directory.lookup_goal_bucket(int(goal_id))
+        return bucket if bucket is not None else int(goal_id) % self.num_buckets
+
+    def shard_for_read(self, bucket):
+        return self.shards[self.buckets()[bucket][0]]
+
+    def shard_for_write(self, bucket):
+        """写入前确认分桶没有在迁移；迁移中时等待其完成（迁移持续有进展就一直等待）"""
+        shard, state = self.buckets()[bucket]
+        progress = None
+        deadline = None
+        while state != 'active':
+            current = self.directory.move_progress(bucket)
+            if current != progress:
+                progress = current
+                deadline = time.monotonic() + self.freeze_wait
+            elif time.monotonic() > deadline:
+                raise RuntimeError(f"分桶 {bucket} 的迁移已 {self.freeze_wait:.0f}s 没有进展，暂时无法写入")
+            time.sleep(0.1)
+            shard, state = self.buckets(refresh=True)[bucket]
+        return self.shards[shard]
+
+    def write(self, bucket, method, *args):
+        """在分桶所在的分片上执行写操作；被迁移封锁拒绝时重新路由（等迁移完成）后重试"""
+        while True:
+            shard = self.shard_for_write(bucket)
+            try:
+                return getattr(shard, method)(*args)
+            except BucketFenced as e:
+                current, state = self.buckets(refresh=True)[e.bucket]
+                if e.bucket == bucket and state == 'active' and self.shards[current] is shard:
+                    raise RuntimeError(f"分桶 {bucket} 在分片 {current} 上仍被封锁，上次迁移可能中断，请重新执行迁移") from e
+
+    def reader(self, user_id):
+        return self.shard_for_read(self.bucket_of(user_id))
+
+    def writer(self, user_id):
+        return self.shard_for_write(self.bucket_of(user_id))
+
+    # ========== 用户 ==========
+    def create_user(self, username, password, user_id=None):
+        if self.directory.lookup_user(username) is not None:
+            return None
+        user_id = user_id or self.directory.allocate_id('users')
+        if not self.directory.register_user(username, user_id):
+            return None
+        try:
+            created = self.write(self.bucket_of(user_id), 'create_user', username, password, user_id)
+        except Exception:
+            self.directory.unregister_user(username)
+            raise
+        if created is None:
+            self.directory.unregister_user(username)
+        return created
+
+    def verify_user(self, username, password):
+        user_id = self.directory.lookup_user(username)
+        if user_id is None:
+            return None
+        return self.reader(user_id).verify_user(username, password)
+
+    # ========== 聊天记录 ==========
+    def insert_rows(self, items):
+        ids = [None] * len(items)
+        by_shard = {}
+        for position, (table, row) in enumerate(items):
+            shard = self.writer(row["user_id"])
+            by_shard.setdefault(id(shard), (shard, []))[1].append(position)
+        for shard, positions in by_shard.values():
+            try:
+                row_ids = shard.insert_rows([items[p] for p in positions])
+            except BucketFenced:
+                # 这一批中有分桶刚被封锁：逐行重新路由
+                row_ids = [self.write(self.bucket_of(items[p][1]["user_id"]), 'insert_rows', [items[p]])[0]
+                           for p in positions]
+            for position, row_id in zip(positions, row_ids):
+                ids[position] = row_id
+        return ids
+
+    def add_chat_message(self, user_id, user_message, ai_response, client_id=None):
+        return self.write(self.bucket_of(user_id), 'add_chat_message', user_id, user_message, ai_response, client_id)
+
+    def get_chat_history(self, user_id, limit=10):
+        return self.reader(user_id).get_chat_history(user_id, limit)
+
+    def get_chat_messages(self, user_id, after_id=0, limit=500):
+        return self.reader(user_id).get_chat_messages(user_id, after_id, limit)
+
+    def get_chat_messages_by_ids(self, user_id, chat_ids):
+        return self.reader(user_id).get_chat_messages_by_ids(user_id, chat_ids)
+
+    def search_chat_history(self, user_id, query, limit=20, offset=0):
+        return self.reader(user_id).search_chat_history(user_id, query, limit, offset)
+
+    def archive_chat_history(self, older_than_days, batch_size=500):
+        # 有分桶迁移时暂停归档，避免归档任务和迁移同时搬动同一批记录
+        if any(state != 'active' for _, state in self.buckets(refresh=True)):
+            return 0
+        return sum(shard.archive_chat_history(older_than_days, batch_size) for shard in self.shards)
+
+    def get_archived_chat_history(self, user_id, limit=50, before_id=None):
+        return self.reader(user_id).get_archived_chat_history(user_id, limit, before_id)
+
+    # ========== 学习目标 ==========
+    def create_learning_goal(self, user_id, title, description="", category="general", priority=2, target_date=None, goal_id=None):
+        bucket = self.bucket_of(user_id)
+        if goal_id is None:
+            goal_id = self.directory.allocate_id('learning_goals') * self.num_buckets + bucket
+        return self.write(bucket, 'create_learning_goal', user_id, title, description, category, priority, target_date, goal_id)
+
+    def get_user_goals(self, user_id, status=None):
+        return self.reader(user_id).get_user_goals(user_id, status)
+
+    def update_goal_status(self, goal_id, status):
+        try:
+            bucket = self.goal_bucket(goal_id)
+        except (TypeError, ValueError):
+            return False
+        return self.write(bucket, 'update_goal_status', goal_id, status)
+
+    def delete_goal(self, goal_id):
+        try:
+            bucket = self.goal_bucket(goal_id)
+        except (TypeError, ValueError):
+            return False
+        return self.write(bucket, 'delete_goal', goal_id)
+
+    def get_goal_progress(self, user_id):
+        return self.reader(user_id).get_goal_progress(user_id)
+
+    # ========== 学习记录 ==========
+    def add_study_session(self, user_id, subject, duration_minutes, goal_id=None, notes=""):
+        return self.write(self.bucket_of(user_id), 'add_study_session', user_id, subject, duration_minutes, goal_id, notes)
+
+    def get_study_sessions(self, user_id, days=7):
+        return self.reader(user_id).get_study_sessions(user_id, days)
+
+    def iter_study_sessions(self, user_id, days=7):
+        return self.reader(user_id).iter_study_sessions(user_id, days)
+
+    def get_study_statistics(self, user_id, days=30):
+        return self.reader(user_id).get_study_statistics(user_id, days)
+
+    # ========== 目标推荐 ==========
+    def _owned(self, index, user_id):
+        """迁移中的分桶在两个分片上都有数据，只认映射指向的分片"""
+        return self.buckets()[self.bucket_of(user_id)][0] == index
+
+    def iter_recommendation_signals(self, user_ids=None, batch_size=1000):
+        for index, shard in enumerate(self.shards):
+            shard_users = user_ids
+            if user_ids is not None:
+                shard_users = [u for u in user_ids if self._owned(index, u)]
+                if not shard_users:
+                    continue
+            for signal in shard.iter_recommendation_signals(shard_users, batch_size):
+                if self._owned(index, signal[0]):
+                    yield signal
+
+    def get_active_users_since(self, since=None, overlap=60):
+        # 水位是各分片自己的数据库时间，按分片顺序保存为JSON列表
+        marks = json.loads(since) if since else [None] * len(self.shards)
+        marks += [None] * (len(self.shards) - len(marks))
+        user_ids = set()
+        watermarks = []
+        for shard, mark in zip(self.shards, marks):
+            users, watermark = shard.get_active_users_since(mark, overlap)
+            user_ids.update(users)
+            watermarks.append(watermark)
+        return sorted(user_ids), json.dumps(watermarks)
+
+    def save_goal_recommendations(self, recommendations):
+        by_shard = {}
+        for user_id, items in recommendations.items():
+            shard = self.writer(user_id)
+            by_shard.setdefault(id(shard), (shard, {}))[1][user_id] = items
+        for shard, batch in by_shard.values():
+            try:
+                shard.save_goal_recommendations(batch)
+            except BucketFenced:
+                for user_id, items in batch.items():
+                    self.write(self.bucket_of(user_id), 'save_goal_recommendations', {user_id: items})
+
+    def delete_stale_goal_recommendations(self, before):
+        marks = json.loads(before)
+        return sum(shard.delete_stale_goal_recommendations(mark) for shard, mark in zip(self.shards, marks))
+
+    def get_goal_recommendations(self, user_id):
+        return self.reader(user_id).get_goal_recommendations(user_id)
+
+    # ========== 运维 ==========
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        if self.directory.database not in self.shards:
+            self.directory.database.close()
+
+    def get_metrics(self):
+        buckets = self.buckets()
+        return {
+            "backend": type(self).__name__,
+            "num_buckets": self.num_buckets,
+            "buckets_per_shard": [sum(1 for shard, _ in buckets if shard == i) for i in range(len(self.shards))],
+            "moving_buckets": [b for b, (_, state) in enumerate(buckets) if state != 'active'],
+            "shards": [shard.get_metrics() for shard in self.shards]
+        }
+
+    def _settle(self, bucket, seconds):
+        """等待各进程的分桶映射缓存过期，期间持续更新迁移进度"""
+        deadline = time.monotonic() + seconds
+        while True:
+            self.directory.touch_move(bucket)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 1))
+
+    def move_bucket(self, bucket, target, log=print):
+        """在线迁移一个分桶到目标分片
+
+        1. 标记为迁移中并等待各进程的分桶映射缓存过期，之后该分桶的写入都会等待
+        2. 在原分片上封锁该分桶：等正在写入的事务提交，之后才执行的旧写入（如组提交队列中的）被拒绝并重新路由
+        3. 清理目标分片上可能残留的上次失败迁移的数据，按表复制该分桶的全部行（保留原ID）
+        4. 切换映射到目标分片，等待缓存过期后删除原分片上的数据（原分片上的封锁保留）
+        每完成一步都更新迁移进度，迁移有进展时等待写入的请求会一直等待。
+        """
+        source, state = self.buckets(refresh=True)[bucket]
+        if source == target:
+            log(f"分桶 {bucket} 已在分片 {target}")
+            return 0
+        if not 0 <= target < len(self.shards):
+            raise ValueError(f"分片 {target} 不存在")
+        settle = self.map_ttl + 1
+        source_db, target_db = self.shards[source], self.shards[target]
+
+        self.directory.set_bucket(bucket, source, 'moving')
+        log(f"分桶 {bucket}: 暂停写入，等待 {settle:.0f}s 让各进程生效")
+        self._settle(bucket, settle)
+        try:
+            source_db.set_fence(bucket, True)
+            target_db.set_fence(bucket, False)
+            for table, key in reversed(BUCKET_TABLES):
+                target_db.delete_bucket(table, key, self.num_buckets, bucket)
+                self.directory.touch_move(bucket)
+            copied = 0
+            for table, key in BUCKET_TABLES:
+                count = 0
+                batch = []
+                for row in source_db.export_bucket(table, key, self.num_buckets, bucket):
+                    for column in DERIVED_COLUMNS:
+                        row.pop(column, None)
+                    if table in RENUMBERED_TABLES:
+                        del row["id"]
+                    batch.append((table, row))
+                    if len(batch) >= 500:
+                        target_db.insert_rows(batch)
+                        self.directory.touch_move(bucket)
+                        count += len(batch)
+                        batch = []
+                if batch:
+                    target_db.insert_rows(batch)
+                    self.directory.touch_move(bucket)
+                    count += len(batch)
+                copied += count
+                log(f"分桶 {bucket}: {table} 复制 {count} 行")
+        except Exception:
+            source_db.set_fence(bucket, False)
+            self.directory.set_bucket(bucket, source, 'active')
+            log(f"分桶 {bucket}: 复制失败，已恢复写入原分片 {source}")
+            raise
+
+        self.directory.set_bucket(bucket, target, 'active')
+        log(f"分桶 {bucket}: 已切换到分片 {target}，等待 {settle:.0f}s 后清理原分片")
+        time.sleep(settle)
+        for table, key in reversed(BUCKET_TABLES):
+            source_db.delete_bucket(table, key, self.num_buckets, bucket)
+        self.buckets(refresh=True)
+        return copied
+
+    def adopt_existing_data(self, log=print):
+        """接管启用分片之前的数据：登记已有用户名、让全局ID从已有最大ID之后开始，
+        按用户实际所在的分片设置分桶映射，并记录ID不带分桶编码的旧目标"""
+        placement = {}
+        max_user_id = 0
+        max_goal_id = 0
+        # 先检查各分片已有的ID都在自己的区间内（否则迁移分桶时会和其他分片的ID冲突），再登记任何数据
+        for index, shard in enumerate(self.shards):
+            start, end = self.id_range(index)
+            with shard.transaction() as conn:
+                cursor = conn.cursor()
+                for table in RANGED_TABLES:
+                    cursor.execute(f'SELECT MIN(id), MAX(id) FROM {table}')
+                    low, high = cursor.fetchone()
+                    if low is not None and (low <= start or high > end):
+                        raise ValueError(
+                            f"分片 {index} 的 {table} 已有ID {low}..{high} 不在区间 ({start}, {end}] 内，无法自动接管"
+                        )
+                cursor.close()
+        for index, shard in enumerate(self.shards):
+            with shard.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT id, username FROM users')
+                users = cursor.fetchall()
+                cursor.execute('SELECT id, user_id FROM learning_goals')
+                goals = cursor.fetchall()
+                cursor.close()
+            for user_id, username in users:
+                bucket = self.bucket_of(user_id)
+                if placement.setdefault(bucket, index) != index:
+                    raise ValueError(f"分桶 {bucket} 的用户分布在多个分片上，无法自动接管")
+                self.directory.register_user(username, user_id)
+                max_user_id = max(max_user_id, user_id)
+            for goal_id, user_id in goals:
+                if goal_id % self.num_buckets != self.bucket_of(user_id):
+                    self.directory.set_goal_bucket(goal_id, self.bucket_of(user_id))
+                max_goal_id = max(max_goal_id, goal_id)
+            log(f"分片 {index}: 登记 {len(users)} 个用户, {len(goals)} 个目标")
+        for bucket, shard in placement.items():
+            self.directory.set_bucket(bucket, shard, 'active')
+        self.directory.raise_sequence('users', max_user_id)
+        self.directory.raise_sequence('learning_goals', max_goal_id // self.num_buckets + 1)
+        self.buckets(refresh=True)
+        return len(placement)
@@ -1,10 +1,16 @@
 import sqlite3
-from .base_database import BaseDatabase
+from contextlib import contextmanager
+from .base_database import BaseDatabase, BucketFenced
+from .text_search import index_text, fts5_match_expression, query_tokens, like_pattern
+from .archive_codec import pack_messages, unpack_messages, group_by_user
+from .result_set import ResultSet, iter_records
 
 class SQLiteDatabase(BaseDatabase):
     def __init__(self, db_name='learning_buddy.db'):
         self.db_name = db_name
-        self.connection = self.create_connection()
+        self.fts_enabled = False
+        # 分片时设置了ID区间的表及其上限（None为不限），由 _insert_row 显式分配ID
+        self.id_floors = {}
         self.init_database()
     
     def get_connection(self):
@@ -16,6 +22,77 @@ class SQLiteDatabase(BaseDatabase):
     def create_connection(self):
         return self.get_connection()
     
+    @contextmanager
+    def transaction(self):
+        conn = self.get_connection()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    
+    def set_id_floor(self, table, floor, ceiling=None):
+        self.check_identifier(table)
+        with self.transaction() as conn:
+            cursor = conn.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (floor, table))
+            if cursor.rowcount == 0:
+                conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, floor))
+            seq = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()[0]
+        if ceiling is not None and seq > ceiling:
+            raise ValueError(f"{table} 已分配的ID {seq} 超出区间上限 {ceiling}")
+        self.id_floors[table] = ceiling
+    
+    def _insert_row(self, conn, table, row):
+        """插入一行并返回ID
+        
+        设置了ID下限的表不使用AUTOINCREMENT分配ID：迁移分桶时复制进来的行带着来源分片区间的ID，
+        SQLite会从表中最大的rowid继续分配，之后新写入的行就落进来源分片的区间。
+        这里按 sqlite_sequence 显式分配，插入带ID的行之后把计数器恢复原值；调用方需已持有写锁。
+        """
+        if table not in self.id_floors:
+            return conn.execute(self.build_insert(table, row, '?'), tuple(row.values())).lastrowid
+        seq = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()[0]
+        if row.get("id") is None:
+            seq += 1
+            ceiling = self.id_floors[table]
+            if ceiling is not None and seq > ceiling:
+                # 继续分配会进入下一个分片的区间，迁移和按ID查找都会出错
+                raise RuntimeError(f"{table} 的ID区间已用完（上限 {ceiling}），请调大 DB_SHARD_ID_SPAN 并重新划分")
+            row = dict(row, id=seq)
+        conn.execute(self.build_insert(table, row, '?'), tuple(row.values()))
+        conn.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (seq, table))
+        return row["id"]
+    
+    def delete_bucket(self, table, key, num_buckets, bucket):
+        if table == 'chat_history' and self.fts_enabled:
+            with self.transaction() as conn:
+                conn.execute(
+                    f'DELETE FROM chat_search WHERE rowid IN (SELECT id FROM chat_history WHERE {self.check_identifier(key)} % ? = ?)',
+                    (num_buckets, bucket)
+                )
+        return super().delete_bucket(table, key, num_buckets, bucket)
+    
+    def query(self, conn, sql, params=()):
+        """执行查询并返回紧凑结果集（行直接保存为元组，不逐行创建dict）"""
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(sql, params)
+        return ResultSet.from_cursor(cursor)
+    
+    def iter_query(self, sql, params=(), batch_size=500):
+        """逐行产出查询结果，连接在遍历结束（或生成器关闭）时释放"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(sql, params)
+            yield from iter_records(cursor, batch_size)
+        finally:
+            conn.close()
+    
     def init_database(self):
         """初始化数据库表 - 使用你现有的代码"""
         conn = self.get_connection()
@@ -38,9 +115,18 @@ class SQLiteDatabase(BaseDatabase):
                     user_message TEXT NOT NULL,
                     ai_response TEXT NOT NULL,
                     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    client_id TEXT,
                     FOREIGN KEY (user_id) REFERENCES users (id)
                 )
             ''')
+            # 提交方生成的唯一ID：后台任务重放时不会重复插入同一条记录
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(chat_history)')]
+            if 'client_id' not in columns:
+                conn.execute('ALTER TABLE chat_history ADD COLUMN client_id TEXT')
+            conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_client ON chat_history(client_id)')
+            # 归档任务按时间找出有过期记录的用户，再按用户取出这些记录
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_timestamp ON chat_history(timestamp)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_user_time ON chat_history(user_id, timestamp)')
             
             # 学习目标表
             conn.execute('''
@@ -75,7 +161,44 @@ class SQLiteDatabase(BaseDatabase):
                 )
             ''')
             
+            # 聊天记录归档表（按用户分批压缩存储）
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS chat_archive (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    first_id INTEGER NOT NULL,
+                    last_id INTEGER NOT NULL,
+                    first_timestamp TIMESTAMP,
+                    last_timestamp TIMESTAMP,
+                    message_count INTEGER NOT NULL,
+                    codec TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_user ON chat_archive(user_id, last_id)')
+            
+            # 推荐目标表（由离线任务生成）
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS goal_recommendations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    score REAL NOT NULL,
+                    based_on_kind TEXT,
+                    based_on_name TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_recommendations_user ON goal_recommendations(user_id)')
+            # 离线任务按时间水位查找有新数据的用户
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_created ON study_sessions(created_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_goals_updated ON learning_goals(updated_at)')
+            
             conn.commit()
+            self.init_search_index(conn)
             print("✅ SQLite 数据库表初始化完成")
             
         except Exception as e:
@@ -83,15 +206,65 @@ class SQLiteDatabase(BaseDatabase):
         finally:
             conn.close()
     
+    def init_search_index(self, conn):
+        """创建聊天记录全文索引（FTS5，中文按n-gram分词），并为还没有索引的记录补建索引"""
+        try:
+            conn.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS chat_search 
+                USING fts5(owner, question, answer, tokenize = 'unicode61')
+            ''')
+        except sqlite3.OperationalError as e:
+            # 只有缺少FTS5模块时降级，其他错误（如数据库被锁）照常抛出
+            if 'fts5' not in str(e):
+                raise
+            print(f"⚠️ SQLite 不支持FTS5，聊天搜索将使用LIKE查询: {e}")
+            return
+        conn.commit()
+        self.fts_enabled = True
+        self.backfill_search_index(conn)
+    
+    def backfill_search_index(self, conn, batch_size=500):
+        """为还没有全文索引的聊天记录补建索引
+        
+        每一批在写锁内查找并插入，多个进程同时启动时不会为同一条记录重复建索引。
+        """
+        after_id, total = 0, 0
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                '''SELECT id, user_id, user_message, ai_response FROM chat_history 
+                   WHERE id > ? AND NOT EXISTS (SELECT 1 FROM chat_search WHERE rowid = chat_history.id) 
+                   ORDER BY id LIMIT ?''',
+                (after_id, batch_size)
+            ).fetchall()
+            for row in rows:
+                self._index_chat_message(conn, row["id"], row)
+            conn.commit()
+            total += len(rows)
+            if len(rows) < batch_size:
+                break
+            after_id = rows[-1]["id"]
+        if total:
+            print(f"✅ 已为 {total} 条聊天记录补建全文索引")
+    
+    def _index_chat_message(self, conn, chat_id, row):
+        if self.fts_enabled:
+            conn.execute(
+                'INSERT INTO chat_search (rowid, owner, question, answer) VALUES (?, ?, ?, ?)',
+                (chat_id, f'u{int(row["user_id"])}',
+                 index_text(row["user_message"]), index_text(row["ai_response"]))
+            )
+    
     # 下面是你的现有方法，保持不变
-    def create_user(self, username, password):
+    def create_user(self, username, password, user_id=None):
         conn = self.get_connection()
         try:
             password_hash = self.hash_password(password)
             cursor = conn.execute(
-                'INSERT INTO users (username, password_hash) VALUES (?, ?)',
-                (username, password_hash)
+                'INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)',
+                (user_id, username, password_hash)
             )
+            self.check_fence(conn.cursor(), cursor.lastrowid)
             conn.commit()
             return cursor.lastrowid
         except sqlite3.IntegrityError:
@@ -111,41 +284,215 @@ class SQLiteDatabase(BaseDatabase):
         finally:
             conn.close()
     
-    def add_chat_message(self, user_id, user_message, ai_response):
+    def insert_rows(self, items):
         conn = self.get_connection()
         try:
-            conn.execute(
-                'INSERT INTO chat_history (user_id, user_message, ai_response) VALUES (?, ?, ?)',
-                (user_id, user_message, ai_response)
-            )
+            if self.id_floors:
+                # 先取得写锁再读取 sqlite_sequence，避免并发写入分配到相同的ID
+                conn.execute('BEGIN IMMEDIATE')
+            ids = []
+            for table, row in items:
+                row_id = self.existing_row_id(conn.cursor(), table, row)
+                if row_id is not None:
+                    ids.append(row_id)
+                    continue
+                row_id = self._insert_row(conn, table, row)
+                self.check_fence(conn.cursor(), row.get("user_id"))
+                if table == 'chat_history':
+                    self._index_chat_message(conn, row_id, row)
+                ids.append(row_id)
             conn.commit()
+            return ids
+        except Exception:
+            conn.rollback()
+            raise
         finally:
             conn.close()
     
+    def add_chat_message(self, user_id, user_message, ai_response, client_id=None):
+        return self.group_insert('chat_history', {
+            "user_id": user_id,
+            "user_message": user_message,
+            "ai_response": ai_response,
+            "client_id": client_id
+        })
+    
     def get_chat_history(self, user_id, limit=10):
         conn = self.get_connection()
         try:
-            cursor = conn.execute(
-                '''SELECT user_message, ai_response, timestamp 
+            history = self.query(
+                conn,
+                '''SELECT user_message, ai_response, timestamp, client_id 
                    FROM chat_history 
                    WHERE user_id = ? 
                    ORDER BY timestamp DESC LIMIT ?''',
                 (user_id, limit)
             )
-            history = [dict(row) for row in cursor.fetchall()]
             return history[::-1]
         finally:
             conn.close()
     
-    def create_learning_goal(self, user_id, title, description="", category="general", priority=2, target_date=None):
+    def get_chat_messages(self, user_id, after_id=0, limit=500):
+        conn = self.get_connection()
+        try:
+            return self.query(
+                conn,
+                '''SELECT id, user_message, ai_response, timestamp 
+                   FROM chat_history 
+                   WHERE user_id = ? AND id > ? 
+                   ORDER BY id LIMIT ?''',
+                (user_id, after_id, limit)
+            )
+        finally:
+            conn.close()
+    
+    def get_chat_messages_by_ids(self, user_id, chat_ids):
+        if not chat_ids:
+            return []
+        conn = self.get_connection()
+        try:
+            return self.query(
+                conn,
+                f'''SELECT id, user_message, ai_response, timestamp 
+                    FROM chat_history 
+                    WHERE user_id = ? AND id IN ({', '.join('?' * len(chat_ids))})''',
+                (user_id, *chat_ids)
+            )
+        finally:
+            conn.close()
+    
+    def search_chat_history(self, user_id, query, limit=20, offset=0):
+        conn = self.get_connection()
+        try:
+            if self.fts_enabled:
+                expression = fts5_match_expression(user_id, query)
+                if not expression:
+                    return []
+                return self.query(
+                    conn,
+                    '''SELECT c.id, c.user_message, c.ai_response, c.timestamp,
+                              bm25(chat_search, 0.0, 2.0, 1.0) AS rank
+                       FROM chat_search 
+                       JOIN chat_history c ON c.id = chat_search.rowid
+                       WHERE chat_search MATCH ? 
+                       ORDER BY rank LIMIT ? OFFSET ?''',
+                    (expression, limit, offset)
+                )
+            else:
+                terms = query_tokens(query)
+                if not terms:
+                    return []
+                conditions = ' AND '.join(
+                    ["(user_message LIKE ? ESCAPE '\\' OR ai_response LIKE ? ESCAPE '\\')"] * len(terms)
+                )
+                params = [user_id]
+                for term in terms:
+                    params.extend([like_pattern(term)] * 2)
+                return self.query(
+                    conn,
+                    f'''SELECT id, user_message, ai_response, timestamp, 0 AS rank
+                        FROM chat_history 
+                        WHERE user_id = ? AND {conditions}
+                        ORDER BY id DESC LIMIT ? OFFSET ?''',
+                    params + [limit, offset]
+                )
+        finally:
+            conn.close()
+    
+    def archive_chat_history(self, older_than_days, batch_size=500):
+        conn = self.get_connection()
+        try:
+            # 立即获取写锁，避免多个归档任务重复处理同一批记录
+            conn.execute('BEGIN IMMEDIATE')
+            cutoff = f'-{older_than_days} days'
+            # 迁移中的分桶不归档，避免复制期间在原分片上搬动记录
+            fenced = sorted(self.fenced_buckets(conn.cursor()))
+            # 按用户取过期记录：同一用户的记录压缩成一个归档块，块越大压缩率越高
+            rows = []
+            seen = []
+            while len(rows) < batch_size:
+                found = conn.execute(
+                    f'''SELECT user_id FROM chat_history 
+                        WHERE timestamp < datetime('now', ?) 
+                          AND user_id NOT IN ({', '.join('?' * len(seen))}) 
+                          AND user_id % ? NOT IN ({', '.join('?' * len(fenced))}) 
+                        ORDER BY timestamp LIMIT 1''',
+                    (cutoff, *seen, self.fence_buckets or 1, *fenced)
+                ).fetchone()
+                if found is None:
+                    break
+                seen.append(found[0])
+                rows.extend(dict(row) for row in conn.execute(
+                    '''SELECT id, user_id, user_message, ai_response, timestamp 
+                       FROM chat_history 
+                       WHERE user_id = ? AND timestamp < datetime('now', ?) 
+                       ORDER BY id LIMIT ?''',
+                    (found[0], cutoff, batch_size)
+                ).fetchall())
+            if not rows:
+                conn.rollback()
+                return 0
+            
+            for user_id, messages in group_by_user(rows).items():
+                codec, payload = pack_messages([
+                    {key: row[key] for key in ("id", "user_message", "ai_response", "timestamp")}
+                    for row in messages
+                ])
+                self._insert_row(conn, 'chat_archive', {
+                    "user_id": user_id,
+                    "first_id": messages[0]["id"],
+                    "last_id": messages[-1]["id"],
+                    "first_timestamp": messages[0]["timestamp"],
+                    "last_timestamp": messages[-1]["timestamp"],
+                    "message_count": len(messages),
+                    "codec": codec,
+                    "payload": payload
+                })
+            
+            ids = [row["id"] for row in rows]
+            placeholders = ', '.join('?' * len(ids))
+            conn.execute(f'DELETE FROM chat_history WHERE id IN ({placeholders})', ids)
+            if self.fts_enabled:
+                conn.execute(f'DELETE FROM chat_search WHERE rowid IN ({placeholders})', ids)
+            conn.commit()
+            return len(rows)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    
+    def get_archived_chat_history(self, user_id, limit=50, before_id=None):
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute(
+                '''SELECT codec, payload FROM chat_archive 
+                   WHERE user_id = ? AND (? IS NULL OR first_id < ?) 
+                   ORDER BY last_id DESC''',
+                (user_id, before_id, before_id)
+            )
+            messages = []
+            # 从最新的归档块开始逐块解压，凑够条数即停止
+            for codec, payload in cursor:
+                batch = [m for m in unpack_messages(codec, payload)
+                         if before_id is None or m["id"] < before_id]
+                messages = batch + messages
+                if len(messages) >= limit:
+                    break
+            return messages[-limit:]
+        finally:
+            conn.close()
+    
+    def create_learning_goal(self, user_id, title, description="", category="general", priority=2, target_date=None, goal_id=None):
         conn = self.get_connection()
         try:
             cursor = conn.execute(
                 '''INSERT INTO learning_goals 
-                   (user_id, title, description, category, priority, target_date) 
-                   VALUES (?, ?, ?, ?, ?, ?)''',
-                (user_id, title, description, category, priority, target_date)
+                   (id, user_id, title, description, category, priority, target_date) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                (goal_id, user_id, title, description, category, priority, target_date)
             )
+            self.check_fence(conn.cursor(), user_id)
             conn.commit()
             return cursor.lastrowid
         finally:
@@ -155,33 +502,44 @@ class SQLiteDatabase(BaseDatabase):
         conn = self.get_connection()
         try:
             if status:
-                cursor = conn.execute(
+                return self.query(
+                    conn,
                     '''SELECT * FROM learning_goals 
                        WHERE user_id = ? AND status = ? 
                        ORDER BY priority DESC, created_at DESC''',
                     (user_id, status)
                 )
             else:
-                cursor = conn.execute(
+                return self.query(
+                    conn,
                     '''SELECT * FROM learning_goals 
                        WHERE user_id = ? 
                        ORDER BY priority DESC, created_at DESC''',
                     (user_id,)
                 )
-            goals = [dict(row) for row in cursor.fetchall()]
-            return goals
         finally:
             conn.close()
     
+    def _check_goal_fence(self, conn, goal_id):
+        if self.fence_buckets:
+            # 先取得写锁，保证检查之后到提交之前封锁不会变化
+            conn.execute('BEGIN IMMEDIATE')
+            owner = conn.execute('SELECT user_id FROM learning_goals WHERE id = ?', (goal_id,)).fetchone()
+            if owner is not None:
+                self.check_fence(conn.cursor(), owner[0])
+    
     def update_goal_status(self, goal_id, status):
         conn = self.get_connection()
         try:
+            self._check_goal_fence(conn, goal_id)
             conn.execute(
                 'UPDATE learning_goals SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
                 (status, goal_id)
             )
             conn.commit()
             return True
+        except BucketFenced:
+            raise
         except Exception as e:
             print(f"更新目标状态失败: {e}")
             return False
@@ -191,9 +549,12 @@ class SQLiteDatabase(BaseDatabase):
     def delete_goal(self, goal_id):
         conn = self.get_connection()
         try:
+            self._check_goal_fence(conn, goal_id)
             conn.execute('DELETE FROM learning_goals WHERE id = ?', (goal_id,))
             conn.commit()
             return True
+        except BucketFenced:
+            raise
         except Exception as e:
             print(f"删除目标失败: {e}")
             return False
@@ -218,33 +579,35 @@ class SQLiteDatabase(BaseDatabase):
             conn.close()
     
     def add_study_session(self, user_id, subject, duration_minutes, goal_id=None, notes=""):
-        conn = self.get_connection()
-        try:
-            cursor = conn.execute(
-                '''INSERT INTO study_sessions 
-                   (user_id, goal_id, subject, duration_minutes, notes) 
-                   VALUES (?, ?, ?, ?, ?)''',
-                (user_id, goal_id, subject, duration_minutes, notes)
-            )
-            conn.commit()
-            return cursor.lastrowid
-        finally:
-            conn.close()
+        return self.group_insert('study_sessions', {
+            "user_id": user_id,
+            "goal_id": goal_id,
+            "subject": subject,
+            "duration_minutes": duration_minutes,
+            "notes": notes
+        })
     
     def get_study_sessions(self, user_id, days=7):
         conn = self.get_connection()
         try:
-            cursor = conn.execute(
+            return self.query(
+                conn,
                 '''SELECT * FROM study_sessions 
                    WHERE user_id = ? AND session_date >= date('now', ?) 
                    ORDER BY session_date DESC, created_at DESC''',
                 (user_id, f'-{days} days')
             )
-            sessions = [dict(row) for row in cursor.fetchall()]
-            return sessions
         finally:
             conn.close()
     
+    def iter_study_sessions(self, user_id, days=7):
+        return self.iter_query(
+            '''SELECT * FROM study_sessions 
+               WHERE user_id = ? AND session_date >= date('now', ?) 
+               ORDER BY session_date DESC, created_at DESC''',
+            (user_id, f'-{days} days')
+        )
+    
     def get_study_statistics(self, user_id, days=30):
         conn = self.get_connection()
         try:
@@ -256,7 +619,8 @@ class SQLiteDatabase(BaseDatabase):
             )
             total_stats = dict(cursor.fetchone())
             
-            cursor = conn.execute(
+            subject_stats = self.query(
+                conn,
                 '''SELECT subject, SUM(duration_minutes) as total_minutes 
                    FROM study_sessions 
                    WHERE user_id = ? AND session_date >= date('now', ?)
@@ -264,11 +628,24 @@ class SQLiteDatabase(BaseDatabase):
                    ORDER BY total_minutes DESC''',
                 (user_id, f'-{days} days')
             )
-            subject_stats = [dict(row) for row in cursor.fetchall()]
             
             return {
                 "total_minutes": total_stats["total_minutes"] or 0,
                 "subject_breakdown": subject_stats
             }
         finally:
-            conn.close()
\ No newline at end of file
+            conn.close()
+    
+    def get_goal_recommendations(self, user_id):
+        conn = self.get_connection()
+        try:
+            return self.query(
+                conn,
+                '''SELECT kind, name, score, based_on_kind, based_on_name, created_at 
+                   FROM goal_recommendations 
+                   WHERE user_id = ? 
+                   ORDER BY score DESC''',
+                (user_id,)
+            )
+        finally:
+            conn.close()
@@ -0,0 +1,94 @@
+import os
+import re
+import zlib
+import time
+import threading
+from collections import deque
+
+_PLACEHOLDER = re.compile(r'%s')
+
+
+class Statement:
+    """登记的一条SQL语句：原始SQL使用 %s 占位，PREPARE时转换为 $1, $2 ..."""
+    __slots__ = ('name', 'sql', 'param_count', 'prepare_sql', 'execute_sql',
+                 'calls', 'total_ms', 'max_ms', 'slow_calls')
+
+    def __init__(self, name, sql, param_types=None):
+        self.name = name
+        self.sql = sql
+        counter = iter(range(1, sql.count('%s') + 1))
+        body = _PLACEHOLDER.sub(lambda _: f'${next(counter)}', sql)
+        self.param_count = sql.count('%s')
+        types = f" ({', '.join(param_types)})" if param_types else ''
+        self.prepare_sql = f"PREPARE {name}{types} AS {body}"
+        args = f"({', '.join(['%s'] * self.param_count)})" if self.param_count else ''
+        self.execute_sql = f"EXECUTE {name}{args}"
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.slow_calls = 0
+
+
+class StatementRegistry:
+    """按名字登记数据库层使用的SQL，统计每条语句的耗时并保留最近的慢查询及其执行计划"""
+
+    def __init__(self, slow_query_ms=None, keep_slow=20):
+        self.slow_query_ms = slow_query_ms if slow_query_ms is not None else \
+            float(os.getenv('DB_SLOW_QUERY_MS', '200'))
+        self._statements = {}
+        self._lock = threading.Lock()
+        self.slow_queries = deque(maxlen=keep_slow)
+
+    def register(self, name, sql, param_types=None):
+        statement = Statement(name, sql, param_types)
+        self._statements[name] = statement
+        return statement
+
+    def get(self, name):
+        return self._statements[name]
+
+    def for_sql(self, prefix, sql):
+        """动态生成的SQL（如按列拼出的INSERT）按内容登记，相同SQL复用同一个名字"""
+        name = f"{prefix}_{zlib.crc32(sql.encode('utf-8')):08x}"
+        statement = self._statements.get(name)
+        if statement is None:
+            with self._lock:
+                statement = self._statements.get(name) or self.register(name, sql)
+        return statement
+
+    def record(self, statement, elapsed_ms):
+        """记录一次执行耗时，超过慢查询阈值时返回True"""
+        slow = self.slow_query_ms > 0 and elapsed_ms >= self.slow_query_ms
+        with self._lock:
+            statement.calls += 1
+            statement.total_ms += elapsed_ms
+            if elapsed_ms > statement.max_ms:
+                statement.max_ms = elapsed_ms
+            if slow:
+                statement.slow_calls += 1
+        return slow
+
+    def add_slow_query(self, statement, elapsed_ms, plan):
+        self.slow_queries.append({
+            "statement": statement.name,
+            "elapsed_ms": round(elapsed_ms, 1),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "plan": plan
+        })
+
+    def get_metrics(self):
+        with self._lock:
+            statements = {
+                s.name: {
+                    "calls": s.calls,
+                    "avg_ms": round(s.total_ms / s.calls, 2),
+                    "max_ms": round(s.max_ms, 2),
+                    "slow_calls": s.slow_calls
+                }
+                for s in self._statements.values() if s.calls
+            }
+        return {
+            "slow_query_ms": self.slow_query_ms,
+            "statements": statements,
+            "slow_queries": list(self.slow_queries)
+        }
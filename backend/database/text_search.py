@@ -0,0 +1,62 @@
+import re
+
+# 中日韩文字没有空格分词，按字切分后生成一元/二元语法(n-gram)建立索引
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_RUN = re.compile(f'[{_CJK}]+|[^\\W{_CJK}]+')
+_CJK_RUN = re.compile(f'^[{_CJK}]+$')
+
+
+def _runs(text):
+    return _RUN.findall((text or '').lower())
+
+
+def index_tokens(text):
+    """生成用于建立索引的词元：中文为单字+二元组，其他语言为整词"""
+    tokens = []
+    for run in _runs(text):
+        if _CJK_RUN.match(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def query_tokens(query):
+    """生成查询词元：中文单字直接匹配，两个字以上按二元组全部匹配"""
+    tokens = []
+    for run in _runs(query):
+        if _CJK_RUN.match(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    # 去重并保持顺序
+    return list(dict.fromkeys(tokens))
+
+
+def like_pattern(term):
+    """LIKE子串匹配模式：转义 \\ % _（英文词元可能含下划线），SQL中配合 ESCAPE '\\' 使用"""
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def index_text(text):
+    """索引文本：词元以空格连接，交给FTS5 unicode61 / PostgreSQL simple 分词器"""
+    return ' '.join(index_tokens(text))
+
+
+def fts5_match_expression(user_id, query):
+    """构造FTS5 MATCH表达式，限定在当前用户的记录中"""
+    tokens = query_tokens(query)
+    if not tokens:
+        return None
+    terms = ' AND '.join(f'"{token}"' for token in tokens)
+    return f'owner:"u{int(user_id)}" AND {{question answer}}:({terms})'
+
+
+def tsquery_expression(query):
+    """构造PostgreSQL to_tsquery表达式"""
+    tokens = query_tokens(query)
+    if not tokens:
+        return None
+    return ' & '.join(f"'{token}'" for token in tokens)
@@ -1,15 +1,24 @@
 import os
-import requests
-import json
-from dotenv import load_dotenv
+import re
+import threading
+from lazy_init import LazyProxy
+from ai_providers import ProviderRouter, AIProviderError, load_providers
 
-# 加载环境变量
-load_dotenv()
+class _InflightCall:
+    """一次正在进行中的上游请求，供相同提示词的并发请求共享结果（上游失败时result为None）"""
+    __slots__ = ('event', 'result', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.waiters = 0
 
 class GitHubAIService:
     def __init__(self):
         self.github_pat = os.getenv('GITHUB_PAT')
-        self.api_url = "https://models.github.ai/inference/chat/completions"
+        # 多后端路由：按延迟/错误率选择，慢请求对冲，简单问题走快速模型
+        self.router = ProviderRouter(load_providers())
+        self.simple_prompt_chars = int(os.getenv('AI_SIMPLE_PROMPT_CHARS', '30'))
         self.fallback_responses = {
             "hello": "👋 你好！我是AI学习搭子，有什么学习问题我可以帮你吗？",
             "学习": "📚 学习需要方法！我可以帮你制定学习计划、解答问题、跟踪进度。",
@@ -19,14 +28,93 @@ class GitHubAIService:
             "计划": "🎯 告诉我你的学习目标，我来帮你制定个性化学习计划！",
             "帮助": "💡 我可以帮你：学习规划、问题解答、进度跟踪、情感支持"
         }
+        # 单飞合并：相同的规范化提示词共享同一个上游请求
+        self.coalesce_wait_timeout = float(os.getenv('AI_COALESCE_WAIT_TIMEOUT', '35'))
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self.metrics = {
+            "upstream_calls": 0,
+            "coalesced_calls": 0
+        }
+    
+    @staticmethod
+    def _normalize_prompt(user_message):
+        """规范化提示词：去掉首尾空白、合并连续空白、忽略大小写"""
+        return re.sub(r'\s+', ' ', user_message.strip()).lower()
+    
+    def get_metrics(self):
+        """获取AI服务调用统计"""
+        with self._inflight_lock:
+            metrics = dict(self.metrics, inflight=len(self._inflight))
+        metrics["routing"] = self.router.get_metrics()
+        return metrics
+    
+    def is_simple_prompt(self, user_message, context_prompt=None):
+        """简短、单行、不含代码的问题交给更便宜更快的模型"""
+        return (not context_prompt
+                and len(user_message) <= self.simple_prompt_chars
+                and '\n' not in user_message
+                and '`' not in user_message)
     
-    def generate_response(self, user_message):
-        """使用GitHub Models API生成回复"""
+    @staticmethod
+    def _format_context(context, max_chars=300):
+        """把检索到的历史对话整理成提示词片段"""
+        parts = []
+        for item in context:
+            answer = item["ai_response"]
+            if len(answer) > max_chars:
+                answer = answer[:max_chars] + "…"
+            parts.append(f"学生：{item['user_message']}\n学习搭子：{answer}")
+        return "以下是这位学生之前与你的相关对话，回答时可以参考并保持前后一致：\n\n" + "\n\n".join(parts)
+    
+    def generate_response(self, user_message, context=None):
+        """通过已配置的AI后端生成回复，并发的相同提示词只请求一次上游
+
+        context为检索到的历史对话列表（含user_message/ai_response），会作为参考附加到提示词中。
+        """
+        
+        # 如果没有配置任何AI后端，使用备用回复
+        if not self.router.providers:
+            return self._get_fallback_response(user_message)
+        
+        context_prompt = self._format_context(context) if context else None
+        key = self._normalize_prompt(user_message)
+        if context_prompt:
+            # 带个人历史的请求只与上下文完全相同的请求合并
+            key += "\x00" + context_prompt
+        with self._inflight_lock:
+            call = self._inflight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InflightCall()
+                self._inflight[key] = call
+                self.metrics["upstream_calls"] += 1
+            else:
+                call.waiters += 1
         
-        # 如果没有配置GitHub PAT，使用备用回复
-        if not self.github_pat:
+        if not is_leader:
+            # 等待领头请求完成；超时或领头请求失败时使用自己的备用回复，只统计真正拿到共享结果的请求
+            if call.event.wait(self.coalesce_wait_timeout) and call.result is not None:
+                with self._inflight_lock:
+                    self.metrics["coalesced_calls"] += 1
+                return call.result
             return self._get_fallback_response(user_message)
         
+        try:
+            call.result = self._request_completion(user_message, context_prompt)
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+            call.event.set()
+        
+        if call.result is None:
+            return self._get_fallback_response(user_message)
+        if call.waiters:
+            print(f"🔗 合并了 {call.waiters} 个相同的并发请求")
+        return call.result
+    
+    def _request_completion(self, user_message, context_prompt=None):
+        """向AI后端发送一次请求，失败时返回None（备用回复由调用方按各自的问题生成，不共享）"""
         try:
             # 构建系统提示词
             system_prompt = """你是一名亲切、专业的AI学习伙伴，名叫"学习搭子"。请根据用户需求选择语气回答。
@@ -39,56 +127,23 @@ class GitHubAIService:
 
 请保持回复专业、温暖、易于理解，适当使用emoji让对话更生动。"""
             
-            # 准备请求数据
-            payload = {
-                "model": "openai/gpt-4o",  # 使用GPT-4o模型
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                "max_tokens": 800,
-                "temperature": 0.7
-            }
-            
-            # 设置请求头
-            headers = {
-                "Accept": "application/vnd.github+json",
-                "Authorization": f"Bearer {self.github_pat}",
-                "X-GitHub-Api-Version": "2022-11-28",
-                "Content-Type": "application/json"
-            }
+            messages = [{"role": "system", "content": system_prompt}]
+            if context_prompt:
+                messages.append({"role": "system", "content": context_prompt})
+            messages.append({"role": "user", "content": user_message})
             
-            # 发送请求
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                data=json.dumps(payload),
-                timeout=30  # 30秒超时
+            ai_content, provider = self.router.complete(
+                messages, simple=self.is_simple_prompt(user_message, context_prompt)
             )
-            
-            # 检查响应状态
-            if response.status_code == 200:
-                result = response.json()
-                if 'choices' in result and len(result['choices']) > 0:
-                    ai_content = result['choices'][0]['message']['content']
-                    print(f"✅ AI回复生成成功: {len(ai_content)}字符")
-                    return ai_content
-                else:
-                    print(f"❌ API响应格式异常: {result}")
-                    return self._get_fallback_response(user_message)
-            else:
-                print(f"❌ API请求失败: {response.status_code} - {response.text}")
-                return self._get_fallback_response(user_message)
+            print(f"✅ AI回复生成成功 [{provider}]: {len(ai_content)}字符")
+            return ai_content
                 
-        except requests.exceptions.Timeout:
-            print("⏰ API请求超时")
-            return self._get_fallback_response(user_message)
-        except requests.exceptions.RequestException as e:
-            print(f"🌐 网络请求错误: {e}")
-            return self._get_fallback_response(user_message)
+        except AIProviderError as e:
+            print(f"❌ AI后端请求失败: {e}")
+            return None
         except Exception as e:
             print(f"🤖 AI服务未知错误: {e}")
-            return self._get_fallback_response(user_message)
+            return None
     
     def _get_fallback_response(self, user_message):
         """备用回复逻辑"""
@@ -96,12 +151,12 @@ class GitHubAIService:
         
         for key in self.fallback_responses:
             if key in message_lower:
-                if self.github_pat:
+                if self.router.providers:
                     return f"{self.fallback_responses[key]}\n\n💡 提示：AI服务暂时不可用，这是备用回复"
                 else:
                     return f"{self.fallback_responses[key]}\n\n💡 提示：请配置GITHUB_PAT环境变量获得完整AI功能"
         
-        if self.github_pat:
+        if self.router.providers:
             return f"""🤖 我理解你说的是："{user_message}"
 
 由于AI服务暂时不可用，我无法提供详细回答。目前我可以：
@@ -118,5 +173,5 @@ class GitHubAIService:
 
 💡 如需更智能的对话，请在.env文件中配置GITHUB_PAT环境变量。"""
 
-# 创建全局AI服务实例
-github_ai_service = GitHubAIService()
\ No newline at end of file
+# 全局AI服务实例：第一次使用时加载环境变量并创建
+github_ai_service = LazyProxy(GitHubAIService, 'github_ai_service')
\ No newline at end of file
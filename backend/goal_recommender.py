@@ -0,0 +1,340 @@
+import os
+import json
+import math
+import time
+import fcntl
+import threading
+from array import array
+from lazy_init import LazyProxy
+from database import db
+
+# 一个目标按一小时的学习量计权，和科目学习分钟数放在同一尺度上
+GOAL_WEIGHT_MINUTES = 60
+
+
+def item_key(kind, name):
+    return f"{kind}:{name}"
+
+
+def split_item(key):
+    kind, _, name = key.partition(':')
+    return kind, name
+
+
+def collect_signals(signals, vocab=None):
+    """把 (user_id, kind, name, value) 转为稀疏三元组
+
+    返回 (用户ID列表, 物品列表, 行号, 列号, 权重)；vocab给定时只保留模型中已有的物品。
+    学习分钟数和目标数取对数，避免少数学习时间很长的学生主导相似度。
+    """
+    import numpy as np
+    users = {}
+    items = {} if vocab is None else vocab
+    rows, cols, weights = array('q'), array('q'), array('f')
+    for user_id, kind, name, value in signals:
+        name = (name or '').strip()
+        if not name or not value:
+            continue
+        key = item_key(kind, name)
+        column = items.get(key)
+        if column is None:
+            if vocab is not None:
+                continue
+            column = items[key] = len(items)
+        rows.append(users.setdefault(user_id, len(users)))
+        cols.append(column)
+        minutes = value if kind == 'subject' else value * GOAL_WEIGHT_MINUTES
+        weights.append(math.log1p(float(minutes)))
+    return (list(users), sorted(items, key=items.get),
+            np.frombuffer(rows, dtype=np.int64), np.frombuffer(cols, dtype=np.int64),
+            np.frombuffer(weights, dtype=np.float32))
+
+
+def _sort_by_user(rows, cols, weights, num_users):
+    """按用户排序三元组，返回 (rows, cols, weights, indptr)：第u个用户的元素位于 indptr[u]:indptr[u+1]"""
+    import numpy as np
+    order = np.argsort(rows, kind='stable')
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=num_users))))
+    return rows[order], cols[order], weights[order], indptr
+
+
+def cooccurrence(rows, cols, weights, num_users, num_items, block_size):
+    """稀疏累加 X^T X：只把每个用户已有物品两两相乘
+
+    计算量与 Σ(每个用户的物品数²) 成正比，和物品总数无关；按 block_size 个用户一块生成物品对。
+    """
+    import numpy as np
+    rows, cols, weights, indptr = _sort_by_user(rows, cols, weights, num_users)
+    gram = np.zeros(num_items * num_items, dtype=np.float64)
+    for start in range(0, num_users, block_size):
+        lo, hi = indptr[start], indptr[min(start + block_size, num_users)]
+        if lo == hi:
+            continue
+        # 每个元素与同一用户的所有元素（含自身）配对
+        user_start = indptr[rows[lo:hi]]
+        user_size = indptr[rows[lo:hi] + 1] - user_start
+        left = np.repeat(np.arange(lo, hi), user_size)
+        offsets = np.arange(len(left)) - np.repeat(np.cumsum(user_size) - user_size, user_size)
+        right = np.repeat(user_start, user_size) + offsets
+        gram += np.bincount(cols[left] * num_items + cols[right],
+                            weights=weights[left].astype(np.float64) * weights[right],
+                            minlength=num_items * num_items)
+    return gram.reshape(num_items, num_items)
+
+
+def iter_dense_blocks(rows, cols, weights, num_users, num_items, block_size):
+    """按用户分块把稀疏三元组展开为稠密矩阵块 (起始行, 块)，每块只占 block_size x 物品数 的内存"""
+    import numpy as np
+    rows, cols, weights, indptr = _sort_by_user(rows, cols, weights, num_users)
+    for start in range(0, num_users, block_size):
+        stop = min(start + block_size, num_users)
+        lo, hi = indptr[start], indptr[stop]
+        block = np.zeros((stop - start, num_items), dtype=np.float32)
+        np.add.at(block, (rows[lo:hi] - start, cols[lo:hi]), weights[lo:hi])
+        yield start, block
+
+
+class GoalRecommender:
+    """目标推荐（"相似的同学还在学什么"）：离线计算，结果写入 goal_recommendations 表
+
+    - 全量构建：读取所有用户的 科目学习分钟数 / 目标分类 组成 用户x物品 稀疏矩阵，
+      只对每个用户已有的物品两两累加 X^T X 得到物品之间的余弦相似度，再为每个用户打分取前N个没学过的物品，
+      最后删除本次没有重新生成的用户（已经没有学习数据）的旧推荐；
+    - 增量更新：按数据库时间水位找出有新学习记录或目标变化的用户，只为这些用户重新打分；
+      相似度矩阵保存在本地文件，每 RECOMMEND_FULL_INTERVAL 秒全量重建一次。
+
+    相似度矩阵是稠密的，内存和模型文件大小为 物品数² x 4 字节（RECOMMEND_MAX_ITEMS=2000 时约16MB，
+    构建时另需两倍大小的累加矩阵）；计算量按每个用户的物品数计算，与物品总数基本无关。
+    """
+
+    def __init__(self, model_path=None, interval=None, full_interval=None, top_n=None):
+        self.enabled = os.getenv('RECOMMEND', '1') != '0'
+        self.model_path = model_path or os.getenv('RECOMMEND_MODEL_PATH', 'goal_recommender.npz')
+        self.state_path = os.path.splitext(self.model_path)[0] + '.json'
+        self.lock_path = os.getenv('RECOMMEND_LOCK', 'goal_recommender.lock')
+        self.interval = interval or int(os.getenv('RECOMMEND_INTERVAL', '300'))
+        self.full_interval = full_interval or int(os.getenv('RECOMMEND_FULL_INTERVAL', '86400'))
+        self.top_n = top_n or int(os.getenv('RECOMMEND_TOP_N', '5'))
+        # 学习人数太少的科目/分类不参与推荐（噪声大，也避免暴露个别学生的数据）
+        self.min_users = int(os.getenv('RECOMMEND_MIN_USERS', '3'))
+        self.max_items = int(os.getenv('RECOMMEND_MAX_ITEMS', '2000'))
+        self.block_size = int(os.getenv('RECOMMEND_BLOCK_SIZE', '2048'))
+        self.batch_size = int(os.getenv('RECOMMEND_BATCH_SIZE', '500'))
+        self.metrics = {
+            "runs": 0,
+            "full_builds": 0,
+            "users_updated": 0,
+            "items": 0,
+            "last_run": None,
+            "last_duration": None
+        }
+        self._pid = None
+        self._thread = None
+        self._lock_file = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    # ========== 后台任务 ==========
+    def start(self):
+        """启动后台推荐线程（每个进程一个）；RECOMMEND=0 时不启用"""
+        if not self.enabled:
+            return
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(target=self._loop, name="goal-recommender", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _acquire_lock(self):
+        """同一台机器上只让一个进程计算推荐"""
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                self.run_locked()
+            except Exception as e:
+                print(f"❌ 目标推荐计算失败: {e}")
+            self._stopping.wait(self.interval)
+
+    def run_locked(self, full=False):
+        """持有锁时执行一次，返回更新的用户数；其他进程正在计算时返回None"""
+        if not self._acquire_lock():
+            return None
+        try:
+            return self.run_once(full)
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def run_once(self, full=False):
+        """模型不存在或已过期时全量构建，否则增量更新；返回更新的用户数"""
+        started = time.time()
+        state = self._load_state()
+        if full or state is None or started - state["built_at"] > self.full_interval:
+            updated = self.build()
+        else:
+            updated = self.update(state)
+        self.metrics["runs"] += 1
+        self.metrics["last_run"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.metrics["last_duration"] = round(time.time() - started, 2)
+        return updated
+
+    # ========== 模型 ==========
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return state if os.path.exists(self.model_path) else None
+
+    @staticmethod
+    def _temp_path(path):
+        """每次写入使用不同的临时文件，同时写入时不会改名到别人写了一半的文件"""
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _save_state(self, state):
+        tmp = self._temp_path(self.state_path)
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp, self.state_path)
+
+    def _load_model(self):
+        import numpy as np
+        with np.load(self.model_path) as model:
+            return [str(item) for item in model["items"]], model["similarity"], model["popular"]
+
+    def _save_model(self, items, similarity, popular):
+        import numpy as np
+        tmp = self._temp_path(self.model_path)
+        with open(tmp, 'wb') as f:
+            np.savez(f, items=np.array(items, dtype=str), similarity=similarity, popular=popular)
+        os.replace(tmp, self.model_path)
+
+    def build(self):
+        """全量构建相似度矩阵并为所有用户生成推荐，返回更新的用户数"""
+        import numpy as np
+        # 先取水位：构建期间新写入的数据由下一次增量更新处理
+        _, watermark = db.get_active_users_since(None)
+        users, items, rows, cols, weights = collect_signals(db.iter_recommendation_signals())
+
+        # 只保留学习人数足够的物品，按人数取前 max_items 个
+        counts = np.bincount(cols, minlength=len(items))
+        ranked = np.argsort(-counts, kind='stable')
+        keep = ranked[counts[ranked] >= self.min_users][:self.max_items]
+        remap = np.full(len(items), -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        mask = remap[cols] >= 0
+        rows, cols, weights = rows[mask], remap[cols[mask]], weights[mask]
+        items = [items[i] for i in keep]
+        # keep 按人数降序排列，重新编号后 0..n-1 即热门顺序
+        popular = np.arange(len(items))
+
+        gram = cooccurrence(rows, cols, weights, len(users), len(items), self.block_size)
+        norms = np.sqrt(np.diag(gram))
+        norms[norms == 0] = 1.0
+        similarity = (gram / np.outer(norms, norms)).astype(np.float32)
+        np.fill_diagonal(similarity, 0.0)
+
+        updated = 0
+        for start, block in iter_dense_blocks(rows, cols, weights, len(users), len(items), self.batch_size):
+            updated += self._save(users[start:start + len(block)], block, items, similarity, popular)
+        # 本次没有重新生成推荐的用户（如目标已全部删除）：删除构建开始之前生成的旧推荐
+        removed = db.delete_stale_goal_recommendations(watermark)
+        self._save_model(items, similarity, popular)
+        self._save_state({"watermark": watermark, "built_at": time.time(), "items": len(items)})
+        self.metrics["full_builds"] += 1
+        self.metrics["items"] = len(items)
+        self.metrics["users_updated"] += updated
+        print(f"🧭 目标推荐全量构建完成: {len(users)} 个用户, {len(items)} 个科目/分类, 清理 {removed} 条过期推荐")
+        return updated
+
+    def update(self, state):
+        """只为水位之后有新数据的用户重新生成推荐，返回更新的用户数"""
+        user_ids, watermark = db.get_active_users_since(state["watermark"])
+        updated = 0
+        if user_ids:
+            items, similarity, popular = self._load_model()
+            vocab = {key: i for i, key in enumerate(items)}
+            for start in range(0, len(user_ids), self.batch_size):
+                batch = user_ids[start:start + self.batch_size]
+                users, _, rows, cols, weights = collect_signals(
+                    db.iter_recommendation_signals(batch), dict(vocab)
+                )
+                # 只有模型之外的新科目的用户也要写入（得到热门推荐）
+                known = set(users)
+                users += [user_id for user_id in batch if user_id not in known]
+                for offset, block in iter_dense_blocks(rows, cols, weights, len(users), len(items), self.batch_size):
+                    updated += self._save(users[offset:offset + len(block)], block, items, similarity, popular)
+            print(f"🧭 目标推荐增量更新: {updated} 个用户")
+        self._save_state(dict(state, watermark=watermark))
+        self.metrics["users_updated"] += updated
+        self.metrics["items"] = state.get("items", 0)
+        return updated
+
+    # ========== 打分 ==========
+    def score(self, block, items, similarity, popular):
+        """为一块用户（稠密矩阵，每行一个用户）各选出前N个推荐
+
+        得分是用户已学物品与候选物品相似度的加权平均；已学过的物品不推荐，
+        相似推荐不足N个时用热门物品补足。返回每个用户的 [(kind, name, score, based_on_kind, based_on_name)]
+        """
+        import numpy as np
+        totals = block.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1.0
+        # 每个用户只取已学物品对应的相似度行相加，不做整块矩阵乘法
+        scores = np.zeros(block.shape, dtype=np.float32)
+        for row in range(len(block)):
+            own = np.flatnonzero(block[row])
+            if len(own):
+                scores[row] = block[row, own] @ similarity[own]
+        scores /= totals
+        owned = block > 0
+        scores[owned] = 0.0
+        top_n = min(self.top_n, len(items))
+        if top_n == 0:
+            return [[] for _ in range(len(block))]
+        top = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+        results = []
+        for row, candidates in enumerate(top):
+            candidates = candidates[np.argsort(-scores[row, candidates])]
+            own = np.flatnonzero(owned[row])
+            chosen = []
+            for item in candidates:
+                if scores[row, item] <= 0:
+                    break
+                # 推荐理由：对这个物品得分贡献最大的已学物品
+                source = own[np.argmax(block[row, own] * similarity[own, item])]
+                chosen.append((*split_item(items[item]), round(float(scores[row, item]), 4),
+                               *split_item(items[source])))
+            picked = {(kind, name) for kind, name, *_ in chosen}
+            for item in popular:
+                if len(chosen) >= top_n:
+                    break
+                kind, name = split_item(items[item])
+                if not owned[row, item] and (kind, name) not in picked:
+                    chosen.append((kind, name, 0.0, None, None))
+            results.append(chosen)
+        return results
+
+    def _save(self, user_ids, block, items, similarity, popular):
+        recommendations = dict(zip(user_ids, self.score(block, items, similarity, popular)))
+        db.save_goal_recommendations(recommendations)
+        return len(recommendations)
+
+
+# 全局推荐任务实例：第一次使用时创建
+goal_recommender = LazyProxy(GoalRecommender, 'goal_recommender')
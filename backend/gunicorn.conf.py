@@ -0,0 +1,90 @@
+"""Gunicorn 生产环境配置
+
+启动: gunicorn -c gunicorn.conf.py app:app  （或 python serve.py）
+
+- 预加载: 主进程导入应用后再fork工作进程，只读的代码和配置以写时复制方式共享；
+  数据库表结构在主进程初始化一次，主进程随后关闭自己的连接，每个工作进程fork后创建自己的连接池。
+- 回收: 每个工作进程处理 MAX_REQUESTS 个请求（加随机抖动）后平滑重启，限制内存增长。
+- 实时推送: 每个SSE连接占用一个线程。线程池为 GUNICORN_THREADS（普通请求）+ LIVE_MAX_STREAMS（推送连接），
+  应用把同时处理的普通请求限制在 GUNICORN_THREADS 个，推送连接再多也不会占用普通请求的线程；
+  推送连接的线程大部分时间在等待事件，不使用数据库连接。
+- 工作进程数: 默认按容器实际可用的CPU（cgroup配额）计算 2*CPU+1，最多 4 个；可用 WEB_CONCURRENCY 指定。
+  每个工作进程有自己的数据库连接池、后台任务队列和后台线程，PostgreSQL 最多占用
+  WEB_CONCURRENCY × DB_POOL_MAX 个连接（多台机器时再乘以机器数），需小于数据库的 max_connections。
+- 平滑重载: kill -HUP <主进程> 会按新配置逐个替换工作进程，不中断请求；
+  由于开启了预加载，更新代码需要 kill -USR2 <主进程> 启动新主进程，确认正常后再 kill -QUIT 旧主进程。
+"""
+import os
+import gc
+import math
+import multiprocessing
+
+
+def available_cpus():
+    """容器可用的CPU数：优先读取cgroup配额（cpu_count() 返回的是宿主机的核数）"""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else multiprocessing.cpu_count()
+    try:
+        # cgroup v2: "配额 周期" 或 "max 周期"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        quota = None if quota == 'max' else int(quota)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: 配额为 -1 表示不限
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                quota = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = f.read()
+            quota = quota if quota > 0 else None
+        except (OSError, ValueError):
+            quota = None
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota / int(period))))
+    return cpus
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', min(available_cpus() * 2 + 1, 4)))
+threads = int(os.getenv('GUNICORN_THREADS', '4')) + int(os.getenv('LIVE_MAX_STREAMS', '32'))
+worker_class = 'gthread'
+
+preload_app = True
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', str(max(max_requests // 10, 1))))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+accesslog = '-' if os.getenv('GUNICORN_ACCESS_LOG') == '1' else None
+errorlog = '-'
+
+
+def when_ready(server):
+    """主进程就绪（应用已预加载）后、fork工作进程之前执行"""
+    from database import db
+
+    # 在主进程完成一次表结构初始化，然后关闭主进程的连接，避免连接被子进程继承
+    db.get_instance()
+    db.close()
+    # 冻结已有对象，避免GC写入对象头导致写时复制的内存页被复制
+    gc.freeze()
+    server.log.info(f"应用已预加载，启动 {workers} 个工作进程 x {threads} 线程")
+
+
+def post_fork(server, worker):
+    """工作进程fork之后执行：连接池、后台线程都会在第一次使用时按新的进程号重新创建
+
+    后台任务队列在这里直接启动，不等第一个请求，以便尽快接管日志中已退出进程留下的任务。
+    """
+    from job_queue import job_queue
+
+    job_queue.start()
+    server.log.info(f"工作进程 {worker.pid} 已启动")
+
+
+def worker_exit(server, worker):
+    """工作进程退出前排空后台任务队列"""
+    from job_queue import job_queue
+
+    if job_queue.initialized:
+        job_queue.shutdown(timeout=graceful_timeout / 2)
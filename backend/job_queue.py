@@ -0,0 +1,368 @@
+import os
+import json
+import time
+import heapq
+import queue
+import atexit
+import itertools
+import threading
+from lazy_init import LazyProxy
+
+
+def _process_start_time(pid):
+    """进程启动时间（开机后的时钟周期数）；读不到 /proc 时返回None"""
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # 第2个字段是括号里的进程名（可能含空格），启动时间是第22个字段
+    return int(stat[stat.rindex(b')') + 2:].split()[19])
+
+
+def _process_alive(pid, started=None):
+    """进程是否仍在运行；记录了启动时间时同时比较，避免进程号被新进程复用后误判为存活"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    if started is None:
+        return True
+    current = _process_start_time(pid)
+    return current is None or current == started
+
+
+# 从任务参数中复制到日志独立列（带索引）的字段，pending_payloads 只能按这些字段过滤
+ROUTING_FIELDS = ('user_id', 'client_id')
+
+
+class JobQueue:
+    """进程内后台任务队列，使用本地SQLite日志保证任务至少执行一次"""
+
+    def __init__(self, journal_path=None, maxsize=None, workers=None,
+                 max_attempts=5, put_timeout=0.05):
+        self.journal_path = journal_path or os.getenv('JOB_QUEUE_DB', 'job_queue.db')
+        self.maxsize = maxsize or int(os.getenv('JOB_QUEUE_MAXSIZE', '1000'))
+        self.worker_count = workers or int(os.getenv('JOB_QUEUE_WORKERS', '2'))
+        self.max_attempts = max_attempts
+        self.put_timeout = put_timeout
+        # 超过重试次数的任务在日志中保留这么多天（便于排查），之后删除
+        self.dead_retention_days = float(os.getenv('JOB_DEAD_RETENTION_DAYS', '7'))
+        self.handlers = {}
+        self.metrics = {
+            "enqueued": 0,
+            "completed": 0,
+            "retried": 0,
+            "failed": 0,
+            "spilled": 0,
+            "rejected": 0
+        }
+        self._lock = threading.Lock()
+        self._pid = None
+        self._started = None
+        self._reset_runtime()
+
+    def _reset_runtime(self):
+        """重置运行时状态（线程、内存队列）"""
+        self._queue = queue.Queue(self.maxsize)
+        self._threads = []
+        self._pending_ids = set()
+        # 等待重试的任务：(到期时间, 序号, 任务) 小顶堆
+        self._delayed = []
+        self._delay_seq = itertools.count()
+        self._pruned_at = 0.0
+        self._accepting = True
+        self._stopping = threading.Event()
+        self._journal_local = threading.local()
+
+    # ========== 任务日志 ==========
+    def _journal(self):
+        """每个线程使用独立的日志连接"""
+        conn = getattr(self._journal_local, 'conn', None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.journal_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    attempts INTEGER DEFAULT 0,
+                    status TEXT DEFAULT 'pending',
+                    last_error TEXT,
+                    owner INTEGER,
+                    owner_started INTEGER,
+                    user_id TEXT,
+                    client_id TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]
+            if 'owner' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN owner INTEGER')
+            if 'owner_started' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN owner_started INTEGER')
+            for field in ROUTING_FIELDS:
+                if field not in columns:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {field} TEXT')
+                    # 旧版本写入的任务只有JSON参数，升级时补一次
+                    conn.execute(f"UPDATE jobs SET {field} = CAST(json_extract(payload, '$.{field}') AS TEXT)")
+            # 未完成的任务按类型和用户查找（请求路径上读取还没写入数据库的数据）
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(name, user_id) WHERE status = 'pending'"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_client ON jobs(client_id) WHERE status = 'pending'"
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, owner)')
+            conn.commit()
+            self._journal_local.conn = conn
+        return conn
+
+    def _journal_insert(self, name, payload):
+        conn = self._journal()
+        routing = [None if payload.get(field) is None else str(payload[field]) for field in ROUTING_FIELDS]
+        cursor = conn.execute(
+            f'''INSERT INTO jobs (name, payload, owner, owner_started, {', '.join(ROUTING_FIELDS)})
+                VALUES (?, ?, ?, ?, {', '.join('?' * len(ROUTING_FIELDS))})''',
+            (name, json.dumps(payload, ensure_ascii=False, default=str), os.getpid(), self._started, *routing)
+        )
+        conn.commit()
+        return cursor.lastrowid
+
+    def _journal_ack(self, job_id):
+        conn = self._journal()
+        conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        conn.commit()
+
+    def _journal_fail(self, job_id, attempts, error, dead):
+        conn = self._journal()
+        conn.execute(
+            'UPDATE jobs SET attempts = ?, last_error = ?, status = ? WHERE id = ?',
+            (attempts, error, 'dead' if dead else 'pending', job_id)
+        )
+        conn.commit()
+
+    def _journal_load_pending(self, limit):
+        """读取日志中属于本进程、尚未进入内存队列的待处理任务
+
+        多个工作进程共享同一个日志文件，每个任务记录所属进程的进程号和启动时间；
+        所属进程已退出的任务由当前进程接管，避免同一任务被两个进程同时执行。
+        """
+        conn = self._journal()
+        pid = os.getpid()
+        owners = conn.execute(
+            """SELECT DISTINCT owner, owner_started FROM jobs
+               WHERE status = 'pending' AND (owner IS NULL OR owner != ? OR owner_started IS NOT ?)""",
+            (pid, self._started)
+        ).fetchall()
+        for owner, started in owners:
+            # 进程号相同但启动时间不同：上一个使用这个进程号的进程留下的任务
+            if owner is None or owner == pid or not _process_alive(owner, started):
+                conn.execute(
+                    """UPDATE jobs SET owner = ?, owner_started = ?
+                       WHERE status = 'pending' AND owner IS ? AND owner_started IS ?""",
+                    (pid, self._started, owner, started)
+                )
+        conn.commit()
+        rows = conn.execute(
+            '''SELECT id, name, payload, attempts FROM jobs
+               WHERE status = 'pending' AND owner = ? ORDER BY id LIMIT ?''',
+            (pid, limit + len(self._pending_ids))
+        ).fetchall()
+        return [row for row in rows if row[0] not in self._pending_ids][:limit]
+
+    def _journal_prune(self):
+        """删除保留期已过的失败任务（完成的任务在确认时已删除），每小时最多执行一次"""
+        now = time.monotonic()
+        if now - self._pruned_at < 3600:
+            return
+        self._pruned_at = now
+        conn = self._journal()
+        deleted = conn.execute(
+            "DELETE FROM jobs WHERE status = 'dead' AND created_at < datetime('now', ?)",
+            (f'-{self.dead_retention_days} days',)
+        ).rowcount
+        conn.commit()
+        if deleted:
+            print(f"🧹 已清理 {deleted} 个超过保留期的失败任务")
+
+    # ========== 生命周期 ==========
+    def register(self, name, handler):
+        """注册任务处理函数，handler接收payload字典"""
+        self.handlers[name] = handler
+
+    def start(self):
+        """启动工作线程（fork之后会在子进程中重新启动）"""
+        if self._pid == os.getpid() and self._threads:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._threads:
+                return
+            if self._pid is not None and self._pid != os.getpid():
+                self._reset_runtime()
+            self._pid = os.getpid()
+            self._started = _process_start_time(self._pid)
+            for i in range(self.worker_count):
+                thread = threading.Thread(
+                    target=self._worker_loop, name=f"job-worker-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            print(f"✅ 后台任务队列启动: {self.worker_count} 个工作线程")
+
+    def enqueue(self, name, payload, durable=True):
+        """提交任务。
+
+        durable任务先写入本地日志，内存队列满时留在日志中由工作线程稍后取回；
+        非durable任务在队列满时返回False，调用方应自行同步处理（背压）。
+        """
+        if name not in self.handlers:
+            raise KeyError(f"未注册的任务类型: {name}")
+        if not self._accepting:
+            self.metrics["rejected"] += 1
+            return False
+        self.start()
+
+        job_id = None
+        if durable:
+            with self._lock:
+                job_id = self._journal_insert(name, payload)
+                self._pending_ids.add(job_id)
+        try:
+            self._queue.put((job_id, name, payload, 0), timeout=self.put_timeout)
+        except queue.Full:
+            if job_id is None:
+                self.metrics["rejected"] += 1
+                return False
+            with self._lock:
+                self._pending_ids.discard(job_id)
+            self.metrics["spilled"] += 1
+        self.metrics["enqueued"] += 1
+        return True
+
+    def pending_payloads(self, name, **fields):
+        """日志中尚未完成的某类任务的参数（按提交顺序），可按 ROUTING_FIELDS 中的字段过滤
+
+        用于读取已经提交、还没由后台任务写入数据库的数据；同一台机器上的所有工作进程共享日志，都能读到。
+        """
+        sql = "SELECT payload FROM jobs WHERE name = ? AND status = 'pending'"
+        params = [name]
+        for field, value in fields.items():
+            if field not in ROUTING_FIELDS:
+                raise ValueError(f"不能按字段 {field} 查找任务")
+            sql += f" AND {field} = ?"
+            params.append(str(value))
+        rows = self._journal().execute(sql + ' ORDER BY id', params).fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    def shutdown(self, timeout=10):
+        """停止接收新任务，在超时时间内排空内存队列；未完成的durable任务保留在日志中"""
+        if not self._threads or self._pid != os.getpid() or not self._accepting:
+            return
+        self._accepting = False
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.time()))
+        remaining = self._queue.unfinished_tasks + len(self._delayed)
+        if remaining:
+            print(f"⚠️ 后台任务队列关闭时仍有 {remaining} 个任务未完成，将在下次启动时重放")
+        else:
+            print("✅ 后台任务队列已排空")
+
+    def get_metrics(self):
+        return dict(self.metrics, queued=self._queue.qsize(), delayed=len(self._delayed))
+
+    # ========== 工作线程 ==========
+    def _worker_loop(self):
+        while not self._stopping.is_set():
+            self._release_due()
+            try:
+                job = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                self._recover_spilled()
+                continue
+            try:
+                self._run(*job)
+            finally:
+                self._queue.task_done()
+
+    def _recover_spilled(self):
+        """队列空闲时把日志中的积压任务（溢出或上次未完成的）放回内存队列"""
+        if not self._accepting:
+            return
+        with self._lock:
+            try:
+                self._journal_prune()
+                rows = self._journal_load_pending(max(1, self.maxsize // 2))
+            except Exception as e:
+                print(f"❌ 读取任务日志失败: {e}")
+                return
+            for job_id, name, payload, attempts in rows:
+                try:
+                    self._queue.put_nowait((job_id, name, json.loads(payload), attempts))
+                except queue.Full:
+                    break
+                self._pending_ids.add(job_id)
+
+    def _run(self, job_id, name, payload, attempts):
+        handler = self.handlers.get(name)
+        try:
+            if handler is None:
+                raise KeyError(f"未注册的任务类型: {name}")
+            handler(payload)
+        except Exception as e:
+            attempts += 1
+            dead = attempts >= self.max_attempts
+            print(f"❌ 后台任务失败 [{name}] 第{attempts}次: {e}")
+            if job_id is not None:
+                self._journal_fail(job_id, attempts, str(e), dead)
+            if dead:
+                self.metrics["failed"] += 1
+                self._forget(job_id)
+                return
+            self.metrics["retried"] += 1
+            # 退避期间不占用工作线程：记下到期时间，到期后由工作线程放回队列
+            due = time.monotonic() + min(2 ** attempts * 0.1, 5)
+            with self._lock:
+                heapq.heappush(self._delayed, (due, next(self._delay_seq), (job_id, name, payload, attempts)))
+            return
+
+        if job_id is not None:
+            self._journal_ack(job_id)
+            self._forget(job_id)
+        self.metrics["completed"] += 1
+
+    def _release_due(self):
+        """把退避到期的任务放回内存队列；队列满时durable任务留在日志中等待回收"""
+        now = time.monotonic()
+        with self._lock:
+            while self._delayed and self._delayed[0][0] <= now:
+                job = heapq.heappop(self._delayed)[2]
+                try:
+                    self._queue.put_nowait(job)
+                except queue.Full:
+                    if job[0] is None:
+                        self.metrics["failed"] += 1
+                    self._pending_ids.discard(job[0])
+
+    def _forget(self, job_id):
+        if job_id is not None:
+            with self._lock:
+                self._pending_ids.discard(job_id)
+
+
+def _shutdown_job_queue():
+    if job_queue.initialized:
+        job_queue.shutdown()
+
+# 全局任务队列实例：第一次使用时创建
+job_queue = LazyProxy(JobQueue, 'job_queue')
+atexit.register(_shutdown_job_queue)
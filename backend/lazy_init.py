@@ -0,0 +1,60 @@
+import os
+import threading
+
+_env_lock = threading.Lock()
+_env_loaded = False
+
+
+def load_environment():
+    """加载 .env 环境变量（每个进程只执行一次）"""
+    global _env_loaded
+    if _env_loaded:
+        return
+    with _env_lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _env_loaded = True
+
+
+class LazyProxy:
+    """延迟创建的全局实例代理：第一次访问属性时才加载环境变量并调用工厂函数
+
+    创建过程加锁，保证每个进程只创建一次；reset() 用于fork后让子进程重新创建。
+    """
+
+    def __init__(self, factory, name=None):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_name', name or getattr(factory, '__name__', 'instance'))
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def get_instance(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                instance = self._instance
+                if instance is None:
+                    load_environment()
+                    instance = self._factory()
+                    object.__setattr__(self, '_instance', instance)
+        return instance
+
+    @property
+    def initialized(self):
+        return self._instance is not None
+
+    def reset(self):
+        """丢弃已创建的实例，下次访问时重新创建"""
+        with self._lock:
+            object.__setattr__(self, '_instance', None)
+
+    def __getattr__(self, name):
+        return getattr(self.get_instance(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.get_instance(), name, value)
+
+    def __repr__(self):
+        state = repr(self._instance) if self._instance is not None else '未创建'
+        return f"<LazyProxy {self._name}: {state}>"
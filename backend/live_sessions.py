@@ -0,0 +1,414 @@
+import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import threading
+from lazy_init import LazyProxy
+from database import db
+
+
+class LiveSession:
+    """一条进行中的学习会话（进程内存表中的一行）"""
+    __slots__ = ('id', 'user_id', 'subject', 'goal_id', 'notes',
+                 'started_at', 'last_heartbeat', 'active_seconds')
+
+    def __init__(self, id, user_id, subject, goal_id, notes, started_at, last_heartbeat, active_seconds):
+        self.id = id
+        self.user_id = user_id
+        self.subject = subject
+        self.goal_id = goal_id
+        self.notes = notes
+        self.started_at = started_at
+        self.last_heartbeat = last_heartbeat
+        self.active_seconds = active_seconds
+
+    def elapsed(self, now, max_gap):
+        """累计学习时长（秒）：已记录的时长加上最近一次心跳之后的时间（最多 max_gap）"""
+        return self.active_seconds + min(max(now - self.last_heartbeat, 0), max_gap)
+
+    def to_dict(self, now, max_gap):
+        return {
+            "session_id": self.id,
+            "subject": self.subject,
+            "goal_id": self.goal_id,
+            "notes": self.notes,
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(self.started_at)),
+            "elapsed_seconds": int(self.elapsed(now, max_gap))
+        }
+
+
+class LiveSessionManager:
+    """服务端计时的实时学习会话
+
+    - 心跳只在内存中登记（同一会话只保留最新一次），后台线程每 LIVE_FLUSH_INTERVAL 秒把这一批心跳写入状态文件；
+    - 状态文件是本机共享的SQLite（LIVE_SESSIONS_DB），多个工作进程看到同一份会话，心跳可以落在任一进程；
+    - 每个进程在内存表里保存有推送订阅的用户的活跃会话，每轮写入后从状态文件重新载入，
+      用户的会话开始、结束或学习记录变化时（revision 增加）向该用户所有打开的页面推送（SSE）；
+    - 超过 LIVE_IDLE_TIMEOUT 秒没有心跳的会话（页面已关闭）自动结束，已累计的时长保存为学习记录。
+    """
+
+    def __init__(self, store_path=None, heartbeat_interval=None, flush_interval=None, idle_timeout=None):
+        self.store_path = store_path or os.getenv('LIVE_SESSIONS_DB', 'live_sessions.db')
+        self.heartbeat_interval = heartbeat_interval or float(os.getenv('LIVE_HEARTBEAT_INTERVAL', '30'))
+        self.flush_interval = flush_interval or float(os.getenv('LIVE_FLUSH_INTERVAL', '3'))
+        self.idle_timeout = idle_timeout or float(os.getenv('LIVE_IDLE_TIMEOUT', '120'))
+        self.min_seconds = float(os.getenv('LIVE_MIN_SECONDS', '60'))
+        # 每个SSE连接占用一个线程：gunicorn 在 GUNICORN_THREADS 个普通请求线程之外为推送连接另加
+        # LIVE_MAX_STREAMS 个线程（见 gunicorn.conf.py），连接定期断开让浏览器自动重连
+        self.max_streams = int(os.getenv('LIVE_MAX_STREAMS', '32'))
+        self.stream_seconds = float(os.getenv('LIVE_STREAM_SECONDS', '300'))
+        # 两次心跳间隔超过 max_gap（页面休眠、断网）时只计入 max_gap
+        self.max_gap = self.heartbeat_interval * 2
+        self.metrics = {
+            "started": 0,
+            "stopped": 0,
+            "expired": 0,
+            "heartbeats": 0,
+            "flushes": 0,
+            "events": 0
+        }
+        self._lock = threading.Lock()
+        self._pid = None
+        self._reset_runtime()
+
+    def _reset_runtime(self):
+        """重置运行时状态（线程、内存表、订阅）"""
+        self._pending = {}
+        self._table = {}
+        self._revisions = {}
+        self._subscribers = {}
+        self._thread = None
+        self._stopping = threading.Event()
+        self._local = threading.local()
+
+    # ========== 状态文件 ==========
+    def _store(self):
+        """每个线程使用独立的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.store_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS live_sessions (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    goal_id INTEGER,
+                    notes TEXT,
+                    started_at REAL NOT NULL,
+                    last_heartbeat REAL NOT NULL,
+                    active_seconds REAL DEFAULT 0
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_live_sessions_user ON live_sessions(user_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_live_sessions_heartbeat ON live_sessions(last_heartbeat)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS live_revisions (
+                    user_id TEXT PRIMARY KEY,
+                    revision INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            self._local.conn = conn
+        return conn
+
+    def _bump_revision(self, conn, user_key):
+        conn.execute('''
+            INSERT INTO live_revisions (user_id, revision) VALUES (?, 1)
+            ON CONFLICT(user_id) DO UPDATE SET revision = revision + 1
+        ''', (user_key,))
+
+    def _load(self, user_keys):
+        """从状态文件读取一批用户的活跃会话和版本号"""
+        conn = self._store()
+        marks = ','.join('?' * len(user_keys))
+        sessions = {key: [] for key in user_keys}
+        for row in conn.execute(f'''
+            SELECT id, user_id, subject, goal_id, notes, started_at, last_heartbeat, active_seconds
+            FROM live_sessions WHERE user_id IN ({marks}) ORDER BY started_at
+        ''', user_keys):
+            sessions[row[1]].append(LiveSession(*row))
+        revisions = dict(conn.execute(
+            f'SELECT user_id, revision FROM live_revisions WHERE user_id IN ({marks})', user_keys
+        ).fetchall())
+        return sessions, revisions
+
+    # ========== 后台线程 ==========
+    def start(self):
+        """启动后台写入线程（每个进程一个，fork之后在子进程中重新启动）"""
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            if self._pid is not None:
+                # fork继承来的内存表、订阅和连接属于父进程
+                self._reset_runtime()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name="live-sessions", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def stop(self):
+        self._stopping.set()
+
+    def _loop(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                self.flush()
+                self.expire_idle()
+                self.refresh()
+            except Exception as e:
+                print(f"❌ 实时学习会话写入失败: {e}")
+
+    def flush(self):
+        """把内存中积累的一批心跳写入状态文件，返回写入条数
+
+        时长按状态文件中的上一次心跳计算，多个进程收到同一会话的心跳时不会重复计时。
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        conn = self._store()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('''
+                UPDATE live_sessions
+                SET active_seconds = active_seconds + MIN(MAX(? - last_heartbeat, 0), ?),
+                    last_heartbeat = MAX(last_heartbeat, ?)
+                WHERE id = ? AND user_id = ?
+            ''', [(ts, self.max_gap, ts, session_id, user_key)
+                  for session_id, (user_key, ts) in pending.items()])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self.metrics["flushes"] += 1
+        return len(pending)
+
+    def expire_idle(self):
+        """结束长时间没有心跳的会话（页面已关闭），返回结束的会话数"""
+        cutoff = time.time() - self.idle_timeout
+        rows = self._store().execute(
+            'SELECT id FROM live_sessions WHERE last_heartbeat < ?', (cutoff,)
+        ).fetchall()
+        expired = 0
+        for (session_id,) in rows:
+            if self._finish(session_id, None, None, final_heartbeat=False) is not None:
+                expired += 1
+        self.metrics["expired"] += expired
+        return expired
+
+    def refresh(self):
+        """重新载入有订阅者的用户的会话，版本号变化时推送给这些用户"""
+        with self._lock:
+            user_keys = list(self._subscribers)
+        if not user_keys:
+            return
+        sessions, revisions = self._load(user_keys)
+        for user_key in user_keys:
+            self._update_table(user_key, sessions[user_key], revisions.get(user_key, 0))
+
+    def _update_table(self, user_key, sessions, revision):
+        with self._lock:
+            if user_key not in self._subscribers:
+                return
+            changed = self._revisions.get(user_key) != revision
+            self._table[user_key] = sessions
+            self._revisions[user_key] = revision
+        if changed:
+            self._publish(user_key)
+
+    # ========== 会话操作 ==========
+    def start_session(self, user_id, subject, goal_id=None, notes=''):
+        """开始一次学习会话，返回会话信息"""
+        self.start()
+        now = time.time()
+        session = LiveSession(uuid.uuid4().hex, str(user_id), subject, goal_id, notes, now, now, 0.0)
+        conn = self._store()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('''
+                INSERT INTO live_sessions
+                (id, user_id, subject, goal_id, notes, started_at, last_heartbeat, active_seconds)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', tuple(getattr(session, name) for name in LiveSession.__slots__))
+            self._bump_revision(conn, session.user_id)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self.metrics["started"] += 1
+        self._reload(session.user_id)
+        print(f"⏱️ 用户 {user_id} 开始学习: {subject}")
+        return session.to_dict(now, self.max_gap)
+
+    def heartbeat(self, user_id, session_id):
+        """登记一次心跳（只写内存，由后台线程批量写入）"""
+        self.start()
+        with self._lock:
+            self._pending[session_id] = (str(user_id), time.time())
+            self.metrics["heartbeats"] += 1
+
+    def stop_session(self, user_id, session_id, notes=None):
+        """结束学习会话并保存学习记录；会话不存在（已结束）时返回None"""
+        self.start()
+        with self._lock:
+            self._pending.pop(session_id, None)
+        result = self._finish(session_id, str(user_id), notes, final_heartbeat=True)
+        if result is not None:
+            self.metrics["stopped"] += 1
+        return result
+
+    def _finish(self, session_id, user_key, notes, final_heartbeat):
+        """从状态文件中取出会话（只有一个进程能取到）并保存为学习记录"""
+        conn = self._store()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('''
+                SELECT id, user_id, subject, goal_id, notes, started_at, last_heartbeat, active_seconds
+                FROM live_sessions WHERE id = ?
+            ''', (session_id,)).fetchone()
+            if row is None or (user_key is not None and row[1] != user_key):
+                conn.execute('ROLLBACK')
+                return None
+            conn.execute('DELETE FROM live_sessions WHERE id = ?', (session_id,))
+            self._bump_revision(conn, row[1])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        session = LiveSession(*row)
+        seconds = session.elapsed(time.time(), self.max_gap) if final_heartbeat else session.active_seconds
+        duration_minutes = int(round(seconds / 60))
+        study_session_id = None
+        if seconds >= self.min_seconds and duration_minutes > 0:
+            study_session_id = db.add_study_session(
+                session.user_id, session.subject, duration_minutes, session.goal_id,
+                notes if notes is not None else session.notes
+            )
+            if not study_session_id:
+                print(f"❌ 实时学习会话 {session_id} 保存失败（{duration_minutes} 分钟）")
+        print(f"⏹️ 用户 {session.user_id} 结束学习: {session.subject} {duration_minutes} 分钟")
+        self._reload(session.user_id)
+        return {
+            "duration_minutes": duration_minutes if study_session_id else 0,
+            "session_id": study_session_id
+        }
+
+    def touch(self, user_id):
+        """用户的学习记录在会话之外发生变化（如手动添加）时通知所有页面"""
+        conn = self._store()
+        self._bump_revision(conn, str(user_id))
+        self._reload(str(user_id))
+
+    def _reload(self, user_key):
+        """本进程修改后立即刷新该用户的内存表并推送，其他进程在下一轮写入后推送"""
+        with self._lock:
+            subscribed = user_key in self._subscribers
+        if subscribed:
+            sessions, revisions = self._load([user_key])
+            self._update_table(user_key, sessions[user_key], revisions.get(user_key, 0))
+
+    def snapshot(self, user_id):
+        """用户当前的活跃会话；有订阅的用户直接读内存表"""
+        user_key = str(user_id)
+        with self._lock:
+            sessions = self._table.get(user_key)
+            revision = self._revisions.get(user_key)
+        if sessions is None:
+            loaded, revisions = self._load([user_key])
+            sessions, revision = loaded[user_key], revisions.get(user_key, 0)
+        now = time.time()
+        items = [s.to_dict(now, self.max_gap) for s in sessions]
+        return {
+            "sessions": items,
+            "active_seconds": sum(item["elapsed_seconds"] for item in items),
+            "revision": revision,
+            "heartbeat_interval": self.heartbeat_interval
+        }
+
+    # ========== 推送（SSE） ==========
+    def _publish(self, user_key):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_key, ()))
+        if not subscribers:
+            return
+        event = self._format_event(self.snapshot(user_key))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+                self.metrics["events"] += 1
+            except queue.Full:
+                # 页面来不及接收时丢弃旧事件，下一次推送包含完整状态
+                pass
+
+    @staticmethod
+    def _format_event(payload):
+        data = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+        return f"event: live\ndata: {data}\n\n".encode('utf-8')
+
+    def _stream_count(self):
+        return sum(len(s) for s in self._subscribers.values())
+
+    def stream(self, user_id):
+        """订阅用户的会话变化，返回SSE事件生成器；本进程推送连接已满时返回None
+
+        订阅在生成器开始执行后才登记：响应还没开始发送就被关闭时（客户端断开、之后的钩子出错），
+        生成器不会执行，也就不会留下订阅。
+        """
+        self.start()
+        user_key = str(user_id)
+        with self._lock:
+            if self._stream_count() >= self.max_streams:
+                return None
+
+        def generate():
+            subscriber = queue.Queue(maxsize=16)
+            try:
+                sessions, revisions = self._load([user_key])
+                with self._lock:
+                    # 并发建立的连接可能同时通过了上面的检查
+                    if self._stream_count() >= self.max_streams:
+                        return
+                    self._subscribers.setdefault(user_key, set()).add(subscriber)
+                    self._table[user_key] = sessions[user_key]
+                    self._revisions[user_key] = revisions.get(user_key, 0)
+                retry = int(self.flush_interval * 1000)
+                yield f"retry: {retry}\n".encode('utf-8') + self._format_event(self.snapshot(user_key))
+                deadline = time.monotonic() + self.stream_seconds
+                while time.monotonic() < deadline:
+                    try:
+                        yield subscriber.get(timeout=15)
+                    except queue.Empty:
+                        # 保持连接并尽快发现已关闭的页面
+                        yield b": ping\n\n"
+            finally:
+                self._unsubscribe(user_key, subscriber)
+
+        return generate()
+
+    def _unsubscribe(self, user_key, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(user_key)
+            if subscribers is None:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[user_key]
+                self._table.pop(user_key, None)
+                self._revisions.pop(user_key, None)
+
+    def get_metrics(self):
+        with self._lock:
+            streams = self._stream_count()
+            pending = len(self._pending)
+        return dict(self.metrics, streams=streams, pending_heartbeats=pending)
+
+
+# 全局实时会话实例：第一次使用时创建
+live_sessions = LazyProxy(LiveSessionManager, 'live_sessions')
@@ -0,0 +1,327 @@
+import os
+import sys
+import time
+import hmac
+import pstats
+import cProfile
+import inspect
+import functools
+import threading
+from collections import Counter
+from flask import Blueprint, Response, request, jsonify, current_app
+from lazy_init import LazyProxy
+
+_local = threading.local()
+# 安装时间线包装的锁：并发的分析请求不会重复包装同一个方法
+_tracing_lock = threading.Lock()
+
+
+def check_admin_token(token):
+    """PROFILE_ADMIN_TOKEN 未配置时所有分析入口都关闭"""
+    expected = os.getenv('PROFILE_ADMIN_TOKEN', '')
+    if not expected or not token:
+        return False
+    # compare_digest 不接受非ASCII字符串，按字节比较
+    return hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8'))
+
+
+def request_token():
+    # 只接受请求头：放在查询参数里会进入访问日志和Referer
+    return request.headers.get('X-Profile-Token')
+
+
+# ========== 单个请求的分析 ==========
+class RequestProfile:
+    """一次请求的cProfile统计和调用时间线（数据库、AI服务、JSON序列化）"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self.depth = 0
+        self.profiler = cProfile.Profile()
+
+    def now_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def open(self, kind, name):
+        span = {"kind": kind, "name": name, "depth": self.depth, "start_ms": self.now_ms()}
+        self.spans.append(span)
+        self.depth += 1
+        return span
+
+    def close(self, span):
+        self.depth -= 1
+        span["duration_ms"] = self.now_ms() - span["start_ms"]
+
+    def report(self, top=40):
+        total_ms = self.now_ms()
+        by_kind = Counter()
+        for span in self.spans:
+            if span["depth"] == 0:
+                by_kind[span["kind"]] += span.get("duration_ms", 0)
+        stats = pstats.Stats(self.profiler).stats
+        functions = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+        return {
+            "total_ms": round(total_ms, 2),
+            "by_kind": {kind: round(ms, 2) for kind, ms in by_kind.items()},
+            # 不属于任何数据库/AI/序列化调用的时间：视图函数本身、框架和Python开销
+            "other_ms": round(total_ms - sum(by_kind.values()), 2),
+            "timeline": [dict(span, start_ms=round(span["start_ms"], 2),
+                              duration_ms=round(span.get("duration_ms", 0), 2))
+                         for span in self.spans],
+            "functions": [{
+                "function": f"{func} ({os.path.basename(filename)}:{line})",
+                "calls": calls,
+                "own_ms": round(own * 1000, 2),
+                "cumulative_ms": round(cumulative * 1000, 2)
+            } for (filename, line, func), (_, calls, own, cumulative, _) in functions]
+        }
+
+
+def _traced_generator(profile, span, generator):
+    """生成器（如流式读取的查询）的时间记在同一个span上，只累计每次取下一项的时间；
+    取下一项期间的调用仍记为该span的子调用"""
+    span["duration_ms"] = 0.0
+    span["items"] = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            depth, profile.depth = profile.depth, span["depth"] + 1
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                profile.depth = depth
+                span["duration_ms"] += (time.perf_counter() - start) * 1000
+            span["items"] += 1
+            yield item
+    finally:
+        generator.close()
+
+
+def _traced(kind, name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = getattr(_local, 'profile', None)
+        if profile is None:
+            return func(*args, **kwargs)
+        span = profile.open(kind, name)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            profile.close(span)
+        if inspect.isgenerator(result):
+            return _traced_generator(profile, span, result)
+        return result
+    wrapper._profiling_traced = True
+    return wrapper
+
+
+def trace_calls(instance, kind, names=None, skip=()):
+    """把实例的方法替换为记录时间线的包装（只在被分析的请求中记录，其余请求直接调用）
+
+    包装安装后一直保留，不会还原；已经包装过的实例和方法跳过。
+    """
+    if instance.__dict__.get('_profiling_traced'):
+        return
+    with _tracing_lock:
+        if instance.__dict__.get('_profiling_traced'):
+            return
+        if names is None:
+            cls = type(instance)
+            names = [name for name in dir(cls)
+                     if not name.startswith('_') and name not in skip and callable(getattr(cls, name))]
+        for name in names:
+            method = getattr(instance, name)
+            if not getattr(method, '_profiling_traced', False):
+                setattr(instance, name, _traced(kind, name, method))
+        instance.__dict__['_profiling_traced'] = True
+
+
+def _install_tracing(app):
+    """第一次分析请求时为数据库、AI服务和JSON序列化安装时间线记录"""
+    from database import db
+    from github_ai_service import github_ai_service
+    # 这些方法只借出、归还连接，计时没有意义
+    trace_calls(db.get_instance(), 'db', skip=('transaction', 'acquire', 'release', 'close', 'get_metrics'))
+    service = github_ai_service.get_instance()
+    trace_calls(service, 'ai', names=('generate_response', '_request_completion'))
+    trace_calls(service.router, 'ai', names=('complete',))
+    trace_calls(app.json, 'json', names=('dumps', 'response'))
+
+
+# ========== 持续采样 ==========
+class SamplingProfiler:
+    """低开销的持续采样：后台线程每隔 PROFILE_SAMPLE_INTERVAL 秒读取正在处理请求的线程的调用栈，
+    按 "请求;函数;函数 次数" 的折叠格式累计（可直接用 flamegraph.pl / speedscope 生成火焰图），
+    每 PROFILE_DUMP_INTERVAL 秒写入 PROFILE_DIR/stacks-<进程号>.folded。
+    """
+
+    def __init__(self, interval=None, dump_interval=None, output_dir=None):
+        self.enabled = os.getenv('PROFILE_SAMPLING', '0') == '1'
+        self.interval = interval or float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.01'))
+        self.dump_interval = dump_interval or float(os.getenv('PROFILE_DUMP_INTERVAL', '60'))
+        self.output_dir = output_dir or os.getenv('PROFILE_DIR', 'profiles')
+        self.max_stacks = int(os.getenv('PROFILE_MAX_STACKS', '20000'))
+        self.metrics = {"samples": 0, "dumps": 0}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._reset_runtime()
+
+    def _reset_runtime(self):
+        self._stacks = Counter()
+        self._active = {}
+        self._names = {}
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        """启动采样线程（每个进程一个，fork之后在子进程中重新启动）"""
+        if not self.enabled or (self._pid == os.getpid() and self._thread is not None):
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._reset_runtime()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def enter(self, label):
+        """当前线程开始处理请求"""
+        if self.enabled:
+            self._active[threading.get_ident()] = label
+
+    def exit(self):
+        self._active.pop(threading.get_ident(), None)
+
+    def _loop(self):
+        next_dump = time.monotonic() + self.dump_interval
+        while not self._stopping.wait(self.interval):
+            try:
+                self.sample()
+                if time.monotonic() >= next_dump:
+                    self.dump()
+                    next_dump = time.monotonic() + self.dump_interval
+            except Exception as e:
+                print(f"❌ 采样分析失败: {e}")
+
+    def _frame_name(self, code):
+        name = self._names.get(code)
+        if name is None:
+            name = self._names[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return name
+
+    def sample(self):
+        frames = sys._current_frames()
+        for ident, label in list(self._active.items()):
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                names.append(self._frame_name(frame.f_code))
+                frame = frame.f_back
+            names.append(label)
+            stack = ';'.join(reversed(names))
+            with self._lock:
+                if stack not in self._stacks and len(self._stacks) >= self.max_stacks:
+                    stack = f"{label};[其他调用栈]"
+                self._stacks[stack] += 1
+            self.metrics["samples"] += 1
+
+    def folded(self, reset=False):
+        """当前进程累计的折叠调用栈文本"""
+        with self._lock:
+            stacks = self._stacks
+            if reset:
+                self._stacks = Counter()
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def dump(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"stacks-{os.getpid()}.folded")
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(self.folded())
+        os.replace(path + '.tmp', path)
+        self.metrics["dumps"] += 1
+        return path
+
+
+# 全局采样分析器实例：第一次使用时创建
+sampling_profiler = LazyProxy(SamplingProfiler, 'sampling_profiler')
+
+
+# ========== 管理接口 ==========
+profiling_api = Blueprint('profiling', __name__)
+
+
+@profiling_api.route('/api/admin/profile/stacks', methods=['GET'])
+def get_sampled_stacks():
+    """当前工作进程的采样调用栈（折叠格式），reset=1 时读取后清零"""
+    if not check_admin_token(request_token()):
+        return jsonify({"success": False, "error": "无权访问"}), 403
+    if not sampling_profiler.enabled:
+        return jsonify({"success": False, "error": "未开启持续采样（PROFILE_SAMPLING=1）"}), 400
+    stacks = sampling_profiler.folded(reset=request.args.get('reset') == '1')
+    return Response(stacks, mimetype='text/plain')
+
+
+# ========== 请求钩子 ==========
+def _before_request():
+    sampling_profiler.start()
+    sampling_profiler.enter(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+    if request.blueprint != 'profiling' and check_admin_token(request_token()):
+        _install_tracing(current_app)
+        profile = RequestProfile()
+        _local.profile = profile
+        profile.profiler.enable()
+
+
+def _after_request(response):
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return response
+    # SSE连接不会结束，不做分析
+    if response.mimetype == 'text/event-stream':
+        _finish()
+        return response
+    # 流式响应在这里读完，序列化时间计入分析
+    body_size = len(response.get_data())
+    _finish()
+    report = profile.report()
+    report["response"] = {
+        "status": response.status_code,
+        "mimetype": response.mimetype,
+        "bytes": body_size
+    }
+    return jsonify({"success": True, "profile": report})
+
+
+def _finish(exc=None):
+    profile = getattr(_local, 'profile', None)
+    if profile is not None:
+        profile.profiler.disable()
+        _local.profile = None
+
+
+def _teardown_request(exc=None):
+    _finish()
+    sampling_profiler.exit()
+
+
+def init_profiling(app):
+    """注册分析钩子：需要在其他请求钩子之前注册，使分析覆盖整个请求
+
+    - 持续采样：PROFILE_SAMPLING=1 开启；
+    - 单个请求分析：带上 X-Profile-Token 请求头且与 PROFILE_ADMIN_TOKEN 一致时，
+      响应替换为该请求的cProfile统计和时间线。
+    """
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.register_blueprint(profiling_api)
@@ -0,0 +1,81 @@
+"""分片运维工具（使用与服务相同的 DATABASE_SHARDS / DATABASE_DIRECTORY_URL 配置）
+
+用法:
+  python rebalance_shards.py status                  查看分桶分布
+  python rebalance_shards.py move BUCKET SHARD       把一个分桶在线迁移到指定分片
+  python rebalance_shards.py balance [--dry-run]     把分桶平均分配到所有分片（新增分片后使用）
+  python rebalance_shards.py adopt                   接管启用分片之前的已有数据（只需执行一次）
+
+迁移期间服务保持在线：被迁移分桶的写请求会等待迁移完成，读请求不受影响。
+"""
+import sys
+import argparse
+from lazy_init import load_environment
+
+
+def plan_balance(buckets, num_shards):
+    """计算把分桶平均分配到各分片所需的最少迁移 [(bucket, from, to), ...]"""
+    owned = {shard: [] for shard in range(num_shards)}
+    for bucket, (shard, _) in enumerate(buckets):
+        owned.setdefault(shard, []).append(bucket)
+    base, extra = divmod(len(buckets), num_shards)
+    quota = {shard: base + (1 if shard < extra else 0) for shard in range(num_shards)}
+    surplus = []
+    for shard, items in owned.items():
+        keep = quota.get(shard, 0)
+        surplus.extend((bucket, shard) for bucket in items[keep:])
+    moves = []
+    for shard in range(num_shards):
+        while len(owned[shard]) < quota[shard] and surplus:
+            bucket, source = surplus.pop()
+            owned[shard].append(bucket)
+            moves.append((bucket, source, shard))
+    return moves
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分片运维工具")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status')
+    move = commands.add_parser('move')
+    move.add_argument('bucket', type=int)
+    move.add_argument('shard', type=int)
+    balance = commands.add_parser('balance')
+    balance.add_argument('--dry-run', action='store_true')
+    commands.add_parser('adopt')
+    args = parser.parse_args()
+
+    load_environment()
+    from database import create_database
+    from database.sharding import ShardedDatabase
+    db = create_database()
+    if not isinstance(db, ShardedDatabase):
+        print("❌ 未配置 DATABASE_SHARDS")
+        sys.exit(1)
+
+    if args.command == 'status':
+        buckets = db.buckets(refresh=True)
+        for shard in range(len(db.shards)):
+            owned = [b for b, (s, _) in enumerate(buckets) if s == shard]
+            print(f"分片 {shard}: {len(owned)} 个分桶 {owned}")
+        moving = [b for b, (_, state) in enumerate(buckets) if state != 'active']
+        if moving:
+            print(f"⚠️ 迁移中（上次迁移可能中断，可重新执行move）: {moving}")
+    elif args.command == 'move':
+        copied = db.move_bucket(args.bucket, args.shard)
+        print(f"✅ 分桶 {args.bucket} 迁移完成，共复制 {copied} 行")
+    elif args.command == 'balance':
+        moves = plan_balance(db.buckets(refresh=True), len(db.shards))
+        for bucket, source, target in moves:
+            print(f"分桶 {bucket}: 分片 {source} -> {target}")
+            if not args.dry_run:
+                db.move_bucket(bucket, target)
+        print(f"✅ 共 {len(moves)} 个分桶{'需要' if args.dry_run else '已'}迁移")
+    elif args.command == 'adopt':
+        count = db.adopt_existing_data()
+        print(f"✅ 已接管 {count} 个分桶的已有数据")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
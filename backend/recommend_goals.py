@@ -0,0 +1,29 @@
+"""目标推荐离线任务（服务运行时后台线程会定期执行，也可以用定时任务单独运行）
+
+用法:
+  python recommend_goals.py            增量更新：只为上次运行之后有新学习记录/目标变化的用户重新生成推荐
+  python recommend_goals.py --full     全量重建相似度矩阵并为所有用户生成推荐
+"""
+import sys
+import argparse
+from lazy_init import load_environment
+
+
+def main():
+    parser = argparse.ArgumentParser(description="目标推荐离线任务")
+    parser.add_argument('--full', action='store_true', help="全量重建")
+    args = parser.parse_args()
+
+    load_environment()
+    from database import db
+    from goal_recommender import goal_recommender
+    updated = goal_recommender.run_locked(full=args.full)
+    if updated is None:
+        print("⚠️ 已有进程正在计算推荐")
+        sys.exit(1)
+    print(f"✅ 已更新 {updated} 个用户的推荐，耗时 {goal_recommender.metrics['last_duration']}s")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import os
+import json
+import zlib
+import gzip
+import decimal
+import uuid
+import dataclasses
+from itertools import islice, chain
+from datetime import date
+from flask import Response, request
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+from database.result_set import ResultSet, Record
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+STREAM_MIN_ITEMS = int(os.getenv('STREAM_MIN_ITEMS', '500'))
+_COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+
+def _default(o):
+    """与Flask默认行为一致的类型转换（日期使用HTTP日期格式）"""
+    if isinstance(o, ResultSet):
+        return o.to_dicts()
+    if isinstance(o, Record):
+        return o.to_dict()
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj):
+    """序列化为UTF-8字节：安装了orjson时使用orjson，否则使用标准库的紧凑格式"""
+    if orjson is not None:
+        return orjson.dumps(
+            obj, default=_default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        )
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONProvider(JSONProvider):
+    """jsonify使用的JSON序列化：中文不转义、无多余空白、可选orjson加速"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype='application/json')
+
+
+def negotiate_encoding():
+    """根据Accept-Encoding选择压缩算法，优先brotli"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """after_request钩子：超过阈值的JSON/文本响应按客户端支持进行gzip/brotli压缩"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers
+            or not response.mimetype.startswith(_COMPRESSIBLE_TYPES)):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    encoding = negotiate_encoding()
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=5))
+    elif encoding == 'gzip':
+        response.set_data(gzip.compress(data, compresslevel=6))
+    else:
+        return response
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _batches(items, size):
+    if isinstance(items, ResultSet):
+        for start in range(0, len(items), size):
+            yield items[start:start + size]
+        return
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _stream_chunks(key, items, extra, chunk_size=100):
+    """逐块生成 {"...extra", key: [item, ...]} 的JSON文本，每块只调用一次序列化"""
+    head = dumps_bytes(extra)
+    yield head[:-1] + (b',' if len(head) > 2 else b'') + dumps_bytes(key) + b':['
+    first = True
+    for batch in _batches(items, chunk_size):
+        body = dumps_bytes(batch)[1:-1]
+        yield body if first else b',' + body
+        first = False
+    yield b']}'
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def json_list_response(key, items, **extra):
+    """返回包含列表的JSON响应；列表较大时流式输出，避免在内存中拼出完整响应
+
+    items也可以是迭代器（如数据库的逐行读取）：先读取至多 STREAM_MIN_ITEMS 条，
+    不足时按普通响应返回，否则接着流式输出剩余部分。
+    """
+    if not isinstance(items, (list, tuple, ResultSet)):
+        iterator = iter(items)
+        head = list(islice(iterator, STREAM_MIN_ITEMS))
+        items = head if len(head) < STREAM_MIN_ITEMS else chain(head, iterator)
+
+    if isinstance(items, (list, tuple, ResultSet)) and len(items) < STREAM_MIN_ITEMS:
+        return Response(dumps_bytes(dict(extra, **{key: items})), mimetype='application/json')
+
+    chunks = _stream_chunks(key, items, extra)
+    # 流式响应只用gzip逐块压缩；客户端不接受gzip（如只接受br）时不压缩
+    compressed = bool(request.accept_encodings['gzip'])
+    if compressed:
+        chunks = _gzip_stream(chunks)
+    response = Response(chunks, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if compressed:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def init_responses(app):
+    """为应用启用快速JSON序列化和响应压缩"""
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
@@ -0,0 +1,209 @@
+import os
+import zlib
+import math
+import fcntl
+import threading
+from collections import Counter, OrderedDict
+import numpy as np
+from lazy_init import LazyProxy
+from database import db
+from database.text_search import index_tokens
+
+
+class HashingEmbedder:
+    """特征哈希向量化：词元(中文n-gram/英文单词)哈希到固定维度，带符号避免碰撞偏差"""
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token, count in Counter(index_tokens(text)).items():
+            h = zlib.crc32(token.encode('utf-8'))
+            sign = 1.0 if h & 0x80000000 else -1.0
+            vector[h % self.dim] += sign * (1.0 + math.log(count))
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+
+class UserVectorIndex:
+    """单个用户的向量索引：向量和聊天记录ID分别存为定长二进制文件，查询时内存映射"""
+
+    def __init__(self, directory, user_id, dim):
+        self.dim = dim
+        self.vec_path = os.path.join(directory, f"{user_id}.f32")
+        self.ids_path = os.path.join(directory, f"{user_id}.ids")
+        self.lock_path = os.path.join(directory, f"{user_id}.lock")
+
+    def exists(self):
+        return os.path.exists(self.ids_path)
+
+    def __len__(self):
+        if not self.exists():
+            return 0
+        return min(os.path.getsize(self.ids_path) // 8,
+                   os.path.getsize(self.vec_path) // (self.dim * 4))
+
+    def load(self):
+        """内存映射加载 (ids, vectors)"""
+        n = len(self)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.dim), dtype=np.float32)
+        ids = np.memmap(self.ids_path, dtype=np.int64, mode='r', shape=(n,))
+        vectors = np.memmap(self.vec_path, dtype=np.float32, mode='r', shape=(n, self.dim))
+        return ids, vectors
+
+    def append(self, chat_ids, vectors):
+        """追加向量，跳过已经索引过的聊天记录；文件锁保证多进程追加时ID与向量保持对齐"""
+        chat_ids = np.asarray(chat_ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(chat_ids), self.dim)
+        with open(self.ids_path, 'ab') as ids_file, open(self.vec_path, 'ab') as vec_file:
+            fcntl.flock(ids_file, fcntl.LOCK_EX)
+            try:
+                # 先截断到对齐长度，丢弃上次中断留下的半条记录
+                n = len(self)
+                ids_file.truncate(n * 8)
+                vec_file.truncate(n * self.dim * 4)
+                # 回填和增量索引可能同时处理同一条记录，任务重放也会重复投递
+                if n and len(chat_ids):
+                    keep = ~np.isin(chat_ids, np.fromfile(self.ids_path, dtype=np.int64, count=n))
+                    chat_ids, vectors = chat_ids[keep], vectors[keep]
+                vec_file.write(vectors.tobytes())
+                vec_file.flush()
+                ids_file.write(chat_ids.tobytes())
+                ids_file.flush()
+            finally:
+                fcntl.flock(ids_file, fcntl.LOCK_UN)
+
+
+class SemanticMemory:
+    """基于本地向量检索的对话记忆：为当前问题找出学生之前最相关的几轮对话"""
+
+    def __init__(self, index_dir=None, dim=None):
+        self.index_dir = index_dir or os.getenv('VECTOR_INDEX_DIR', 'vector_index')
+        self.embedder = HashingEmbedder(dim or int(os.getenv('VECTOR_DIM', '512')))
+        self.min_score = float(os.getenv('SEMANTIC_MIN_SCORE', '0.25'))
+        self.enabled = os.getenv('SEMANTIC_MEMORY', '1') != '0'
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_size = 256
+        # 本进程已提交回填任务、尚未完成的用户
+        self._backfilling = set()
+
+    def _index(self, user_id):
+        os.makedirs(self.index_dir, exist_ok=True)
+        return UserVectorIndex(self.index_dir, int(user_id), self.embedder.dim)
+
+    def _embed_exchange(self, user_message, ai_response):
+        # 问题比回答更能代表这一轮对话的主题
+        question = self.embedder.embed(user_message)
+        answer = self.embedder.embed(ai_response)
+        vector = 0.7 * question + 0.3 * answer
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _load(self, user_id):
+        """带缓存的内存映射加载，文件增长后重新映射"""
+        index = self._index(user_id)
+        n = len(index)
+        with self._lock:
+            cached = self._cache.get(index.ids_path)
+            if cached is not None and len(cached[0]) == n:
+                self._cache.move_to_end(index.ids_path)
+                return cached
+        loaded = index.load()
+        with self._lock:
+            self._cache[index.ids_path] = loaded
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return loaded
+
+    def index_message(self, user_id, chat_id, user_message, ai_response):
+        """增量索引一条聊天记录（后台任务；重复投递时跳过）"""
+        index = self._index(user_id)
+        if not index.exists():
+            self.backfill(user_id)
+        # 回填已经包含这条记录时 append 会跳过
+        index.append([chat_id], [self._embed_exchange(user_message, ai_response)])
+
+    def request_backfill(self, user_id):
+        """提交回填任务（每个用户同时只提交一个）"""
+        from job_queue import job_queue
+        key = int(user_id)
+        with self._lock:
+            if key in self._backfilling:
+                return
+            self._backfilling.add(key)
+        try:
+            queued = job_queue.enqueue('chat.backfill', {"user_id": key}, durable=False)
+        except Exception:
+            queued = False
+        if not queued:
+            # 队列已满：下一次检索时再提交
+            with self._lock:
+                self._backfilling.discard(key)
+
+    def backfill(self, user_id, batch_size=500):
+        """为用户已有的聊天记录建立索引（后台任务）
+
+        同一用户的回填用文件锁串行执行；索引先写入临时文件，完成后改名，索引文件存在即表示回填已完成。
+        """
+        index = self._index(user_id)
+        try:
+            with open(index.lock_path, 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                if index.exists():
+                    return
+                building = UserVectorIndex(self.index_dir, f"{int(user_id)}.building", self.embedder.dim)
+                for path in (building.ids_path, building.vec_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                # 没有历史记录的用户也创建空索引
+                building.append([], [])
+                after_id = 0
+                while True:
+                    rows = db.get_chat_messages(user_id, after_id, batch_size)
+                    if not rows:
+                        break
+                    building.append(
+                        [row["id"] for row in rows],
+                        [self._embed_exchange(row["user_message"], row["ai_response"]) for row in rows]
+                    )
+                    after_id = rows[-1]["id"]
+                # ID文件最后改名：exists() 以它为准
+                os.replace(building.vec_path, index.vec_path)
+                os.replace(building.ids_path, index.ids_path)
+        finally:
+            with self._lock:
+                self._backfilling.discard(int(user_id))
+
+    def retrieve(self, user_id, query, k=3):
+        """返回与问题最相关的k轮历史对话"""
+        if not self.enabled:
+            return []
+        try:
+            if not self._index(user_id).exists():
+                # 第一次检索时在后台回填，回填完成前不做语义检索
+                self.request_backfill(user_id)
+                return []
+            ids, vectors = self._load(user_id)
+            if len(ids) == 0:
+                return []
+            scores = vectors @ self.embedder.embed(query)
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            chat_ids = list(dict.fromkeys(int(ids[i]) for i in top if scores[i] >= self.min_score))
+            if not chat_ids:
+                return []
+            rows = {row["id"]: row for row in db.get_chat_messages_by_ids(user_id, chat_ids)}
+            return [rows[chat_id] for chat_id in chat_ids if chat_id in rows]
+        except Exception as e:
+            print(f"⚠️ 历史对话检索失败: {e}")
+            return []
+
+
+# 全局对话记忆实例：第一次使用时创建
+semantic_memory = LazyProxy(SemanticMemory, 'semantic_memory')
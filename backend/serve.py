@@ -0,0 +1,38 @@
+"""生产环境启动器
+
+用法: python serve.py [--workers N] [--threads N] [--max-requests N] [--port PORT]
+参数会转换为 gunicorn.conf.py 读取的环境变量，然后以预加载模式启动 gunicorn。
+"""
+import os
+import sys
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI学习搭子生产环境启动器")
+    parser.add_argument('--workers', type=int, help="工作进程数 (WEB_CONCURRENCY)")
+    parser.add_argument('--threads', type=int, help="每个工作进程的线程数 (GUNICORN_THREADS)")
+    parser.add_argument('--max-requests', type=int, help="工作进程处理多少请求后回收 (GUNICORN_MAX_REQUESTS)")
+    parser.add_argument('--port', type=int, help="监听端口 (PORT)")
+    args = parser.parse_args()
+
+    overrides = {
+        'WEB_CONCURRENCY': args.workers,
+        'GUNICORN_THREADS': args.threads,
+        'GUNICORN_MAX_REQUESTS': args.max_requests,
+        'PORT': args.port,
+    }
+    for key, value in overrides.items():
+        if value is not None:
+            os.environ[key] = str(value)
+
+    os.chdir(BACKEND_DIR)
+    command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app']
+    print(f"🚀 启动生产服务: {' '.join(command[1:])}")
+    os.execv(sys.executable, command)
+
+
+if __name__ == '__main__':
+    main()
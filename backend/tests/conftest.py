@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 后端模块按 backend/ 目录下的顶层模块导入（与 app.py 相同）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
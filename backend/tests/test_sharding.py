@@ -0,0 +1,98 @@
+import time
+import threading
+import pytest
+from database.base_database import BucketFenced
+from database.sharding import ShardedDatabase
+
+ID_SPAN = 1000
+
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_SHARD_ID_SPAN', str(ID_SPAN))
+    monkeypatch.setenv('DB_SHARD_MAP_TTL', '0')
+    monkeypatch.setenv('DB_GROUP_COMMIT', '0')
+    shards = [(f"sqlite:///{tmp_path / f'shard{i}.db'}", []) for i in range(2)]
+    db = ShardedDatabase(shards, num_buckets=4)
+    yield db
+    db.close()
+
+
+def create_user_in_bucket(db, bucket):
+    for n in range(100):
+        user_id = db.create_user(f"user{bucket}_{n}", "secret")
+        if db.bucket_of(user_id) == bucket:
+            return user_id
+    raise AssertionError(f"没有分配到分桶 {bucket} 的用户")
+
+
+def shard_ids(shard, table):
+    with shard.transaction() as conn:
+        return [row[0] for row in conn.execute(f'SELECT id FROM {table}')]
+
+
+def test_move_to_lower_shard_keeps_id_ranges(sharded):
+    db = sharded
+    moved = create_user_in_bucket(db, 1)
+    staying = create_user_in_bucket(db, 0)
+    assert db.buckets()[1][0] == 1 and db.buckets()[0][0] == 0
+    moved_session = db.add_study_session(moved, "数学", 30)
+    moved_chat = db.add_chat_message(moved, "问题", "回答")
+    assert moved_session >= ID_SPAN and moved_chat >= ID_SPAN
+
+    db.move_bucket(1, 0, log=lambda message: None)
+
+    # 复制进来的行保留原ID，之后分片0新写入的行仍在分片0自己的区间
+    assert [s["id"] for s in db.get_study_sessions(moved)] == [moved_session]
+    new_ids = [
+        db.add_study_session(staying, "英语", 20),
+        db.add_study_session(moved, "物理", 10),
+        db.add_chat_message(staying, "问题", "回答"),
+        db.add_chat_message(moved, "问题", "回答"),
+    ]
+    assert all(row_id < ID_SPAN for row_id in new_ids)
+
+    # 往返迁移不会出现主键冲突
+    db.move_bucket(1, 1, log=lambda message: None)
+    db.move_bucket(0, 1, log=lambda message: None)
+    for table in ('study_sessions', 'chat_history'):
+        ids = shard_ids(db.shards[1], table)
+        assert len(ids) == len(set(ids)) == 3
+    assert len(db.get_study_sessions(moved)) == 2
+    assert len(db.get_study_sessions(staying)) == 1
+
+
+def test_writes_during_move_wait_and_stale_routes_are_fenced(sharded):
+    db = sharded
+    user_id = create_user_in_bucket(db, 1)
+    source = db.shards[1]
+    mover = threading.Thread(target=db.move_bucket, args=(1, 0), kwargs={"log": lambda message: None})
+    mover.start()
+    while db.buckets(refresh=True)[1][1] != 'moving':
+        time.sleep(0.01)
+
+    # 迁移中的写入等待迁移完成后写到目标分片
+    session_id = db.add_study_session(user_id, "数学", 30)
+    mover.join()
+    assert db.buckets()[1] == (0, 'active')
+    assert [s["id"] for s in db.get_study_sessions(user_id)] == [session_id]
+
+    # 仍按旧路由写到原分片的写入被拒绝
+    with pytest.raises(BucketFenced):
+        source.add_study_session(user_id, "数学", 30)
+    assert shard_ids(source, 'study_sessions') == []
+
+
+def test_exhausted_id_range_fails_instead_of_spilling(sharded):
+    db = sharded
+    user_id = create_user_in_bucket(db, 0)
+    db.set_id_floor('study_sessions', ID_SPAN - 1)
+    assert db.add_study_session(user_id, "数学", 30) == ID_SPAN
+
+    # 再分配就会进入分片1的区间
+    with pytest.raises(RuntimeError):
+        db.add_study_session(user_id, "数学", 30)
+    assert shard_ids(db.shards[0], 'study_sessions') == [ID_SPAN]
+
+    with db.transaction(user_id) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM study_sessions').fetchone()[0] == 1
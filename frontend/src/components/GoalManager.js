@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { Card, Form, Input, Button, List, Tag, DatePicker, Select, message, Modal, Progress } from 'antd';
-import { PlusOutlined, EditOutlined, DeleteOutlined, CheckOutlined } from '@ant-design/icons';
+import { PlusOutlined, EditOutlined, DeleteOutlined, CheckOutlined, BulbOutlined } from '@ant-design/icons';
 import axios from 'axios';
 
 const { TextArea } = Input;
@@ -10,6 +10,7 @@ const GoalManager = ({ currentUser , onGoalsUpdate}) => {
   const [goals, setGoals] = useState([]);
   const [progress, setProgress] = useState({});
   const [showForm, setShowForm] = useState(false);
+  const [recommendations, setRecommendations] = useState([]);
   const [form] = Form.useForm();
 
   const API_BASE = 'http://localhost:5000/api';
@@ -62,10 +63,23 @@ const GoalManager = ({ currentUser , onGoalsUpdate}) => {
     }
   };
 
+  // 加载推荐方向（后台任务根据相似同学的学习情况定期生成）
+  const loadRecommendations = async () => {
+    try {
+      const response = await axios.get(`${API_BASE}/goals/recommendations?user_id=${currentUser.id}`);
+      if (response.data.success) {
+        setRecommendations(response.data.recommendations);
+      }
+    } catch (error) {
+      console.error('加载推荐失败:', error);
+    }
+  };
+
   useEffect(() => {
     if (currentUser) {
       loadGoals();
       loadProgress();
+      loadRecommendations();
     }
   }, [currentUser]);
 
@@ -139,6 +153,34 @@ const GoalManager = ({ currentUser , onGoalsUpdate}) => {
     return <Tag color={info.color}>{info.text}优先级</Tag>;
   };
 
+  const categoryNames = {
+    exam: '考试准备',
+    skill: '技能学习',
+    language: '语言学习',
+    career: '职业发展',
+    general: '通用学习'
+  };
+
+  // 推荐项的显示名称和理由
+  const describeItem = (kind, name) => (kind === 'category' ? `${categoryNames[name] || name}类目标` : name);
+  const getRecommendationReason = (item) => {
+    if (!item.based_on_name) {
+      return '最近很多同学都在学';
+    }
+    const source = item.based_on_kind === 'category'
+      ? `有${describeItem(item.based_on_kind, item.based_on_name)}`
+      : `在学${item.based_on_name}`;
+    return `和你一样${source}的同学也在学`;
+  };
+
+  // 用推荐项预填新建目标表单
+  const adoptRecommendation = (item) => {
+    form.setFieldsValue(item.kind === 'category'
+      ? { category: item.name }
+      : { title: `学习${item.name}`, category: 'general' });
+    setShowForm(true);
+  };
+
   // 获取状态标签
   const getStatusTag = (status) => {
     const statusMap = {
@@ -184,6 +226,29 @@ const GoalManager = ({ currentUser , onGoalsUpdate}) => {
         )}
       </Card>
 
+      {/* 推荐方向 */}
+      {recommendations.length > 0 && (
+        <Card title="💡 推荐学习方向" style={{ marginBottom: 16 }}>
+          <List
+            dataSource={recommendations}
+            renderItem={(item) => (
+              <List.Item
+                actions={[
+                  <Button type="link" icon={<BulbOutlined />} onClick={() => adoptRecommendation(item)}>
+                    设为目标
+                  </Button>
+                ]}
+              >
+                <List.Item.Meta
+                  title={describeItem(item.kind, item.name)}
+                  description={getRecommendationReason(item)}
+                />
+              </List.Item>
+            )}
+          />
+        </Card>
+      )}
+
       {/* 创建目标表单 */}
       <Card 
         title={
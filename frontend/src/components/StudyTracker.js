@@ -1,6 +1,6 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Card, Form, Input, Button, List, Select, InputNumber, message } from 'antd';
-import { ClockCircleOutlined, BookOutlined } from '@ant-design/icons';
+import { ClockCircleOutlined, BookOutlined, PlayCircleOutlined, PauseCircleOutlined } from '@ant-design/icons';
 import axios from 'axios';
 
 const { Option } = Select;
@@ -11,7 +11,11 @@ const StudyTracker = ({ currentUser, goals }) => {
   const [statistics, setStatistics] = useState({});
   const [form] = Form.useForm();
   const [availableGoals, setAvailableGoals] = useState([]);
-
+  const [live, setLive] = useState({ sessions: [], heartbeat_interval: 30 });
+  const [liveSubject, setLiveSubject] = useState();
+  const [liveGoal, setLiveGoal] = useState();
+  const [now, setNow] = useState(Date.now());
+  const liveRevision = useRef(null);
 
   const API_BASE = 'http://localhost:5000/api';
 
@@ -53,6 +57,92 @@ const StudyTracker = ({ currentUser, goals }) => {
     }
   }, [currentUser]);
 
+  // 订阅服务端推送：本用户任一页面开始/结束计时或添加记录后，所有页面同步更新（不再轮询）
+  useEffect(() => {
+    if (!currentUser) return undefined;
+    let poller = null;
+    const applyLive = (data) => {
+      setLive({ ...data, receivedAt: Date.now() });
+      if (liveRevision.current !== null && liveRevision.current !== data.revision) {
+        loadSessions();
+        loadStatistics();
+      }
+      liveRevision.current = data.revision;
+    };
+    const pollLive = async () => {
+      try {
+        const response = await axios.get(`${API_BASE}/study/live?user_id=${currentUser.id}`);
+        applyLive(response.data);
+      } catch (error) {
+        console.error('加载计时状态失败:', error);
+      }
+    };
+    const source = new EventSource(`${API_BASE}/study/live/stream?user_id=${currentUser.id}`);
+    source.addEventListener('live', (event) => applyLive(JSON.parse(event.data)));
+    source.onerror = () => {
+      // 服务端推送连接已满（503）时浏览器不会重连，改为定时拉取
+      if (source.readyState === EventSource.CLOSED && poller === null) {
+        pollLive();
+        poller = setInterval(pollLive, 10000);
+      }
+    };
+    return () => {
+      source.close();
+      if (poller !== null) clearInterval(poller);
+      liveRevision.current = null;
+    };
+  }, [currentUser]);
+
+  // 有进行中的会话时发送心跳（任一页面打开即保持计时），并每秒刷新显示的时长
+  useEffect(() => {
+    if (!currentUser || live.sessions.length === 0) return undefined;
+    const sendHeartbeats = () => live.sessions.forEach((session) => {
+      axios.post(`${API_BASE}/study/live/heartbeat`, {
+        user_id: currentUser.id,
+        session_id: session.session_id
+      }).catch((error) => console.error('发送心跳失败:', error));
+    });
+    const heartbeat = setInterval(sendHeartbeats, live.heartbeat_interval * 1000);
+    const ticker = setInterval(() => setNow(Date.now()), 1000);
+    return () => {
+      clearInterval(heartbeat);
+      clearInterval(ticker);
+    };
+  }, [currentUser, live]);
+
+  // 开始计时
+  const startLiveSession = async () => {
+    try {
+      await axios.post(`${API_BASE}/study/live/start`, {
+        user_id: currentUser.id,
+        subject: liveSubject,
+        goal_id: liveGoal
+      });
+      message.success('开始计时，关闭页面也不会丢失已学习的时间');
+    } catch (error) {
+      message.error('开始计时失败');
+    }
+  };
+
+  // 结束计时并保存学习记录
+  const stopLiveSession = async (sessionId) => {
+    try {
+      const response = await axios.post(`${API_BASE}/study/live/stop`, {
+        user_id: currentUser.id,
+        session_id: sessionId
+      });
+      if (response.data.session_id) {
+        message.success(`已保存 ${formatDuration(response.data.duration_minutes)} 的学习记录`);
+      } else {
+        message.info('学习时间不足1分钟，未保存记录');
+      }
+      loadSessions();
+      loadStatistics();
+    } catch (error) {
+      message.error('结束计时失败');
+    }
+  };
+
   // 添加学习记录
   const addStudySession = async (values) => {
     try {
@@ -64,6 +154,7 @@ const StudyTracker = ({ currentUser, goals }) => {
       if (response.data.success) {
         message.success('学习记录添加成功！');
         form.resetFields();
+        // 推送连接不可用（已满或断开）时本页面也能立即看到新记录
         loadSessions();
         loadStatistics();
       }
@@ -82,11 +173,46 @@ const StudyTracker = ({ currentUser, goals }) => {
     return `${mins}分钟`;
   };
 
+  // 显示进行中的会话时长（服务端时长 + 收到推送后经过的时间）
+  const formatElapsed = (session) => {
+    const seconds = session.elapsed_seconds + Math.max(0, Math.floor((now - live.receivedAt) / 1000));
+    const pad = (value) => String(value).padStart(2, '0');
+    return `${pad(Math.floor(seconds / 3600))}:${pad(Math.floor(seconds / 60) % 60)}:${pad(seconds % 60)}`;
+  };
+
   // 计算总学习时间
   const totalStudyTime = sessions.reduce((total, session) => total + session.duration_minutes, 0);
 
   return (
     <div className="study-tracker">
+      {/* 计时学习 */}
+      <Card title="⏱️ 计时学习" style={{ marginBottom: 16 }}>
+        <div style={{ display: 'flex', gap: 8, marginBottom: live.sessions.length > 0 ? 16 : 0 }}>
+          <Select placeholder="选择学习科目" value={liveSubject} onChange={setLiveSubject} style={{ flex: 1 }}>
+            {subjects.map(subject => (
+              <Option key={subject} value={subject}>{subject}</Option>
+            ))}
+          </Select>
+          <Select placeholder="关联目标（可选）" value={liveGoal} onChange={setLiveGoal} allowClear style={{ flex: 1 }}>
+            {availableGoals.map(goal => (
+              <Option key={goal.id} value={goal.id}>{goal.title}</Option>
+            ))}
+          </Select>
+          <Button type="primary" icon={<PlayCircleOutlined />} disabled={!liveSubject} onClick={startLiveSession}>
+            开始计时
+          </Button>
+        </div>
+        {live.sessions.map(session => (
+          <div key={session.session_id} style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', marginTop: 8 }}>
+            <span>{session.subject}</span>
+            <span style={{ fontSize: 20, fontWeight: 'bold', color: '#1890ff' }}>{formatElapsed(session)}</span>
+            <Button danger icon={<PauseCircleOutlined />} onClick={() => stopLiveSession(session.session_id)}>
+              结束并保存
+            </Button>
+          </div>
+        ))}
+      </Card>
+
       <div style={{ display: 'grid', gridTemplateColumns: '1fr 1fr', gap: 16, marginBottom: 16 }}>
         {/* 学习统计 */}
         <Card title="📈 学习统计">